@@ -0,0 +1,133 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from statistics import median
+from picoammeter.devices import devices
+from picoammeter.simulator import FrameGenerator, SimulatorServer
+
+
+# Runs of Pico_reader_converter.py, measured against an in-process simulator #
+configs         = {
+    "import":   ["-h"],                                 # imports and argument parsing only, no connection
+    "text":     ["-w"],
+    "binary":   ["-w", "-b"],
+    "raw":      ["--raw"],
+    "root":     ["-w", "-r"],                           # needs PyROOT
+    "plot":     ["-l", "--current"],                    # matplotlib is loaded by the plot process, not by the converter
+    "grafana":  ["--grafana"],                          # nothing listens on the InfluxDB port, the lines are dropped
+}
+default_configs = ["import", "text", "binary", "raw"]
+heavy_modules   = ["ROOT", "matplotlib", "influxdb_client"]                                  # must only be loaded by the runs that ask for them
+needs           = {"root": ["ROOT"]}
+converter       = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Pico_reader_converter.py")
+
+
+# Arguments #
+parser = ArgumentParser(usage="python3 Pico_benchmark.py -c import text binary -n 3") # startup time and peak memory of the converter, --max_startup/--max_rss to use it as a check
+parser.add_argument("-c",       "--configs",              dest="configs",             help="Runs to measure: import (only -h), text, binary, raw, root, plot, grafana",                     default=default_configs,                  type=str, choices=list(configs), nargs="+")
+parser.add_argument("-t",       "--time",                 dest="time_acq",            help="Acquisition time in seconds of every run",                                                      default=2,                                type=int)
+parser.add_argument("-n",       "--repeat",               dest="repeat",              help="Runs of every configuration, the median is reported",                                           default=3,                                type=int)
+parser.add_argument(            "--rate",                 dest="rate",                help="Frames per second sent by the simulator",                                                       default=400,                              type=int)
+parser.add_argument(            "--max_startup",          dest="max_startup",         help="Fail if a text run takes longer than this to connect, in seconds",                              default=1.0,                              type=float)
+parser.add_argument(            "--max_rss",              dest="max_rss",             help="Fail if a run without ROOT or the live plot needs more than this peak memory, in MB",           default=None,                             type=float)
+parser.add_argument("-o",       "--output",               dest="output",              help="Write the results to this JSON file",                                                           default=None,                             type=str)
+options = parser.parse_args()
+
+
+# UTILS #
+def imported_modules(path):
+    # names and total self time in seconds of the modules listed by python -X importtime
+    names, total = set(), 0
+    with open(path, "r") as file:
+        for line in file:
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            fields = line[len("import time:"):].split("|")
+            if not fields[0].strip().isdigit():                                             # the header line
+                continue
+            total += int(fields[0])
+            names.add(fields[2].strip())
+    return names, total*1e-6
+
+
+def run_once(flags, folder, env):
+    # one run of the converter: time to connect (to exit with -h), peak RSS in MB, import time and modules, exit code
+    stderr_path = os.path.join(folder, "importtime.txt")
+    command     = [sys.executable, "-X", "importtime", converter, "-d", "bench", "-t", str(options.time_acq), "-f", os.path.join(folder, "data")] + flags
+    t0          = time.time()
+    with open(stderr_path, "w") as stderr:
+        child   = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, stdin=subprocess.DEVNULL, env=env, text=True)
+        startup = None
+        for line in child.stdout:
+            if startup is None and "Connected to PICO" in line:
+                startup = time.time() - t0
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(child.pid, 0)                                       # the rusage of this child alone
+            child.returncode = os.waitstatus_to_exitcode(status)
+            rss = usage.ru_maxrss/2**20 if sys.platform == "darwin" else usage.ru_maxrss/2**10  # bytes on macOS, kB on Linux
+        else:                                                                               # Windows: no rusage, the peak memory is not measured
+            child.wait()
+            rss = None
+        child.stdout.close()
+    names, import_time = imported_modules(stderr_path)
+    return {"startup": startup if startup is not None else time.time() - t0, "rss": rss, "import_time": import_time,
+            "heavy": [m for m in heavy_modules if m in names], "modules": len(names), "returncode": child.returncode}
+
+
+##############
+# Benchmarks #
+##############
+server  = SimulatorServer(lambda: FrameGenerator(seed=1), port=0, rate=options.rate)        # any free port, through the "bench" device profile
+server.start()
+results = {}
+with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):   # without the lines of the simulator
+    profiles = os.path.join(folder, "devices.json")
+    with open(profiles, "w") as file:
+        json.dump({"bench": dict(devices["sim"], port=server.address[1])}, file)
+    env     = dict(os.environ, PICO_DEVICES=profiles, PYTHONUNBUFFERED="1")
+    for name in options.configs:
+        runs    = [run_once(configs[name], folder, env) for _ in range(options.repeat)]
+        results[name] = {
+            "flags":        configs[name],
+            "startup":      median(r["startup"] for r in runs),
+            "import_time":  median(r["import_time"] for r in runs),
+            "rss":          max((r["rss"] for r in runs if r["rss"] is not None), default=None),
+            "modules":      max(r["modules"] for r in runs),
+            "heavy":        sorted(set(m for r in runs for m in r["heavy"])),
+            "failed":       sum(r["returncode"] not in (0, None) for r in runs),
+        }
+server.stop()
+
+print(f"{'run':<10}{'startup [s]':>13}{'imports [s]':>13}{'peak RSS [MB]':>15}{'modules':>9}   heavy modules loaded")
+for name, r in results.items():
+    rss = f"{r['rss']:>15.1f}" if r["rss"] is not None else f"{'-':>15}"
+    print(f"{name:<10}{r['startup']:>13.3f}{r['import_time']:>13.3f}{rss}{r['modules']:>9}   {', '.join(r['heavy']) or '-'}"
+          + (f"   ({r['failed']} failed runs)" if r["failed"] else ""))
+
+# Checks #
+problems = []
+for name, r in results.items():
+    unexpected = [m for m in r["heavy"] if m not in needs.get(name, [])]
+    if unexpected:
+        problems.append("{} loads {}".format(name, ", ".join(unexpected)))
+    if name == "text" and r["startup"] > options.max_startup:
+        problems.append("text connects after {:.3f} s, more than {} s".format(r["startup"], options.max_startup))
+    if options.max_rss is not None and name not in ("root", "plot") and r["rss"] is not None and r["rss"] > options.max_rss:
+        problems.append("{} peaks at {:.1f} MB, more than {} MB".format(name, r["rss"], options.max_rss))
+for problem in problems:
+    print("FAILED: {}".format(problem))
+if not hasattr(os, "wait4"):
+    print("The peak memory is not available on this platform (no os.wait4), --max_rss is not checked")
+
+if options.output:
+    with open(options.output, "w") as file:
+        json.dump({"python": sys.version.split()[0], "platform": sys.platform, "time_acq": options.time_acq, "rate": options.rate,
+                   "results": results, "problems": problems}, file, indent=2)
+    print("Results written to {}".format(options.output))
+sys.exit(1 if problems else 0)
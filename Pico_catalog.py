@@ -0,0 +1,48 @@
+import sys
+from datetime import datetime
+from argparse import ArgumentParser
+import numpy as np
+from picoammeter.catalog import Catalog
+
+
+# Arguments #
+parser = ArgumentParser(usage="python3 Pico_catalog.py -f ./picoData -q \"2025-01-07 14:00\" \"2025-01-07 14:05\" -c I_DRIFT -o drift.txt") # -u to index new files, -l to list them
+parser.add_argument("-f",       "--folder",               dest="folder",              help="Data folder, with one sub-folder per day",                                                      default="./picoData",                     type=str)
+parser.add_argument("-u",       "--update",               dest="update",              help="Index the files that are new or changed since the last update",                                                                                     action="store_true")
+parser.add_argument("-l",       "--list",                 dest="list",                help="List the files of the catalog with their time range",                                                                                               action="store_true")
+parser.add_argument("-q",       "--query",                dest="query",               help="Time range to read, \"YYYY-mm-dd HH:MM[:SS]\" twice",                                           default=None,                             type=str, nargs=2)
+parser.add_argument("-c",       "--columns",              dest="columns",             help="Columns to read, separated by commas (I_<ch>, V_<ch>, T_<ch>)",                                 default="I_DRIFT",                        type=str)
+parser.add_argument("-d",       "--device",               dest="device",              help="Only the files of this PICO",                                                                   default=None,                             type=str)
+parser.add_argument("-o",       "--output",               dest="output",              help="Write the rows of the query to this file, default print a summary",                             default=None,                             type=str)
+options = parser.parse_args()
+
+catalog = Catalog(options.folder)
+
+if options.update:
+    changed = catalog.update()
+    print("{} files indexed, {} in the catalog".format(len(changed), len(catalog.files)))
+
+if options.list:
+    for key, entry in sorted(catalog.files.items(), key=lambda item: item[1]["start_time"] or 0):
+        if options.device is not None and entry["device"] != options.device:
+            continue
+        start   = datetime.fromtimestamp(entry["start_time"]).strftime("%Y-%m-%d %H:%M:%S") if entry["start_time"] else "-"
+        end     = datetime.fromtimestamp(entry["end_time"]).strftime("%Y-%m-%d %H:%M:%S") if entry["end_time"] else "-"
+        print("{:<45} {:<6} {:<8} {} -> {}  {:>10} rows".format(key, entry["format"], str(entry["device"]), start, end, entry["rows"]))
+
+if options.query:
+    start, end  = [datetime.fromisoformat(t).timestamp() for t in options.query]
+    names       = options.columns.split(",")
+    files       = catalog.find(start, end, options.device)
+    if not files:
+        print("No data between {} and {}".format(*options.query))
+        sys.exit()
+    rows        = catalog.query(start, end, names, options.device)
+    print("{} rows from {} files: {}".format(len(rows["time"]), len(files), ", ".join(files)))
+    if options.output:
+        np.savetxt(options.output, np.column_stack([rows[name] for name in ["time"] + names]), delimiter=",", header=",".join(["time"] + names), comments="")
+        print("Rows written to {}".format(options.output))
+    else:
+        for name in names:
+            if len(rows[name]):
+                print("{:<10} mean {:.6g}  min {:.6g}  max {:.6g}".format(name, rows[name].mean(), rows[name].min(), rows[name].max()))
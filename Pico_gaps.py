@@ -0,0 +1,32 @@
+import json
+import os
+import time
+from argparse import ArgumentParser
+from picoammeter.gaps import analyze
+
+
+# Arguments #
+parser = ArgumentParser(usage="python3 Pico_gaps.py -i ./picoData/010125/010125_140000_000000.raw") # .raw, .pico, .txt or .root files, -g N to list the first N gaps
+parser.add_argument("-i",       "--input",                dest="input",               help="Files to check for lost frames: .raw captures (every frame) or .pico/.txt/.root outputs",        default=None,                             type=str, nargs="+", required=True)
+parser.add_argument("-g",       "--gaps",                 dest="gaps",                help="List the row and length of the first N gaps of every file",                                     default=10,                               type=int)
+parser.add_argument("-o",       "--output",               dest="output",              help="Write the summary of every file to this JSON file",                                             default=None,                             type=str)
+options = parser.parse_args()
+
+summaries = {}
+for inFilename in options.input:
+    if not os.path.exists(inFilename):
+        print("File {} not found".format(inFilename))
+        continue
+    t0      = time.time()
+    stats   = analyze(inFilename, keep=max(options.gaps, 1000))
+    summaries[inFilename] = stats.summary()
+    print(f"------------------------------ {inFilename} ------------------------------")
+    print(stats.report())
+    for row, missed in stats.gaps[:options.gaps]:
+        print("    row {:>12}: {} frames missed before it".format(row, missed))
+    print(f"total time elapsed:                          {time.time()-t0}")
+
+if options.output:
+    with open(options.output, "w") as file:
+        json.dump(summaries, file, indent=1)
+    print("Summary written to {}".format(options.output))
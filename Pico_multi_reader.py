@@ -0,0 +1,134 @@
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from argparse import ArgumentParser
+from picoammeter.devices import devices, connection_settings, connect_to_pico
+from picoammeter.multi import DeviceStream, acquire
+from picoammeter.writers import TextWriter
+from picoammeter.binary import BinaryWriter
+from picoammeter.rootio import RootWriter
+from picoammeter.catalog import Catalog
+from picoammeter.decimate import filters
+from picoammeter.runstats import default_windows
+from picoammeter.rotate import RotatingWriter, compressions
+from picoammeter.shutdown import StopSignal
+
+
+# Arguments #
+parser = ArgumentParser(usage="python3 Pico_multi_reader.py -t <time_acq> -d pico3_pico4_pico5 -w -f ./new_folder") # -s if serial
+parser.add_argument("-t",       "--time",                 dest="time_acq",            help="Acquisition time in seconds, 0 to run until SIGINT (Ctrl-C) or SIGTERM",                         default=10,                               type=int)
+parser.add_argument("-d",       "--devices",              dest="devices",             help="PICOs to read at the same time, separated by _",                                                default="pico3_pico4_pico5",              type=str)
+parser.add_argument("-s",       "--serial",               dest="serial",              help="Enable serial connection",                                                                                                                          action="store_true")
+parser.add_argument("-w",       "--write",                dest="write",               help="Enable writing to file, one file per PICO",                                                                                                         action="store_true")
+parser.add_argument("-b",       "--binary",               dest="binary",              help="Write in chunked binary .pico format, default in .txt",                                                                                             action="store_true")
+parser.add_argument("-r",       "--root",                 dest="root",                help="Write in .root format, default in .txt",                                                                                                            action="store_true")
+parser.add_argument(            "--rotate_size",          dest="rotate_size",         help="With -w, start a new file when the current one reaches this size in MB",                        default=None,                             type=float)
+parser.add_argument(            "--rotate_every",         dest="rotate_every",        help="With -w, start a new file every N seconds, e.g. 3600",                                          default=None,                             type=float)
+parser.add_argument(            "--rotate_daily",         dest="rotate_daily",        help="With -w, start a new file, in the folder of the new day, at midnight",                                                                              action="store_true")
+parser.add_argument(            "--compress",             dest="compress",            help="With -w, compress every closed file in the background (not .root, already compressed)",         default="none",                           type=str, choices=compressions)
+parser.add_argument("-f",       "--folder",               dest="folder",              help="Folder where to save the data",                                                                 default="./picoData",                     type=str)
+parser.add_argument("-slow",    "--slow_mode_factor",     dest="slow_mode_factor",    help="Reduce writing rate by factor N provided by user, i.e. from 400Hz to 400Hz/N",                  default=1,                                type=int)
+parser.add_argument(            "--slow_filter",          dest="slow_filter",         help="With -slow, how N events become one row: pick one (default, as before), mean, minmax (two rows) or cic", default="pick",                 type=str, choices=filters)
+parser.add_argument(            "--summary",              dest="summary",             help="Write mean, rms, min, max per channel over windows of these seconds (1 10 60 if none given)",   default=None,                             type=float, nargs="*")
+options = parser.parse_args()
+
+# Settings #
+picos               = options.devices.split("_")
+time_acq            = options.time_acq
+do_serial           = options.serial
+do_write            = options.write
+root_format         = options.root
+binary_format       = options.binary and not root_format
+dataFolder          = options.folder
+outFolder           = "{}/{}".format(dataFolder, datetime.now().strftime("%d%m%y"))
+summary_windows     = options.summary if options.summary else default_windows if options.summary is not None else None
+rotate              = do_write and (options.rotate_size or options.rotate_every or options.rotate_daily or options.compress != "none")
+runName             = datetime.now().strftime("%d%m%y_%H%M%S_%f")                          # f=microsecond
+
+for pico in picos:
+    if pico not in devices:
+        print("Unknown device {}, available are {}".format(pico, list(devices)))
+        sys.exit()
+
+if (do_write or summary_windows) and not os.path.exists(outFolder):
+    os.makedirs(outFolder)
+
+
+##################
+# Initialization #
+##################
+catalog_lock = threading.Lock()                                                             # the segment threads of all the PICOs share the catalog
+def segment_done(pico):
+    # called on the segment thread of a rotating output: catalog the file if it can still be read, see picoammeter/catalog.py
+    def done(path, final):
+        print("Closed {} output file {}".format(pico, final))
+        if final == path:
+            with catalog_lock:
+                Catalog(dataFolder).add(path, device=pico, t0=t0, clock=next(stream for stream in streams if stream.pico == pico).clock.to_dict())
+    return done
+
+streams = []
+for pico in picos:
+    hostName, portNumber, baudrate = connection_settings(pico, do_serial)
+    try:
+        s = connect_to_pico(do_serial=do_serial, host=hostName, port=portNumber, baud=baudrate)
+    except Exception as error:
+        print("Connection to {} failed: {}".format(pico, error))
+        continue
+    print("---------------------- Connected to {} ----------------------".format(pico))
+    writer = None
+    if do_write:
+        extension   = "root" if root_format else "pico" if binary_format else "txt"
+        outFilename = "{}_{}.{}".format(runName, pico, extension)
+        print("Writing {} data to file {}/{}".format(pico, outFolder, outFilename))
+        open_output = RootWriter if root_format else BinaryWriter if binary_format else TextWriter
+        if rotate:                                                                          # a new file by size, time or date, see picoammeter/rotate.py
+            writer = RotatingWriter(open_output, lambda now, pico=pico: "{}/{}/{}_{}.{}".format(dataFolder, now.strftime("%d%m%y"), now.strftime("%d%m%y_%H%M%S_%f"), pico, extension),
+                                    first_path="{}/{}".format(outFolder, outFilename),
+                                    max_bytes=options.rotate_size*2**20 if options.rotate_size else None,
+                                    interval=options.rotate_every,
+                                    daily=options.rotate_daily,
+                                    compression="none" if root_format else options.compress,
+                                    on_closed=segment_done(pico))
+        else:
+            writer = open_output("{}/{}".format(outFolder, outFilename))
+    summaryPath = None
+    if summary_windows:
+        summaryPath = "{}/{}_{}_summary.csv".format(outFolder, runName, pico)
+        print("Writing {} running statistics over {} s to file {}".format(pico, summary_windows, summaryPath))
+    streams.append(DeviceStream(pico, s, do_serial=do_serial, writer=writer, slow_mode_factor=options.slow_mode_factor, slow_filter=options.slow_filter,
+                                summary_path=summaryPath, summary_windows=summary_windows))
+
+if not streams:
+    print("Connection to PICO failed")
+    sys.exit()
+
+
+####################
+# Data acquisition #
+####################
+t0      = time.time()
+stop    = StopSignal()                                                                      # SIGINT and SIGTERM end the acquisition as -t does, see picoammeter/shutdown.py
+elapsed = acquire(streams, time_acq, stop=stop)
+if stop.is_set():
+    print("{} received, acquisition stopped".format(stop.received))
+if do_write and not rotate:                                                                 # rotating outputs are cataloged as they are closed
+    catalog = Catalog(dataFolder)
+    for stream in streams:
+        try:
+            catalog.add(stream.writer.path, device=stream.pico, t0=t0, clock=stream.clock.to_dict())                      # time range and index of the file, see picoammeter/catalog.py
+        except Exception as error:
+            print("Could not add {} to the catalog: {}".format(stream.writer.path, error))
+
+for stream in streams:
+    print(f"------------------------------ {stream.pico} ------------------------------")
+    print(f"total number of bytes received:              {stream.bytes_received}")
+    print(f"time_flag has changed:                       {stream.builder.count_time_flip}")
+    print(f"total number of good events:                 {stream.nev}")
+    print(f"total number of skipped events:              {stream.nev_skip}")
+    print(f"total number of written events:              {stream.nev_written}")
+    print(f"total number of non-matching events:         {stream.sync.frames_rejected}")
+    print(f"total number of bytes skipped to resync:     {stream.sync.bytes_skipped}")
+print(f"total time elapsed:                          {elapsed}")
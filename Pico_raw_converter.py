@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from picoammeter.capture import CaptureReader, convert
+from picoammeter.catalog import Catalog, data_folder
+from picoammeter.parallel import convert_parallel
+from picoammeter.writers import TextWriter
+from picoammeter.binary import BinaryWriter
+from picoammeter.rootio import RootWriter
+from picoammeter.decimate import filters
+from picoammeter.devices import profiles_variable
+from picoammeter.runstats import default_windows
+
+
+# Arguments #
+parser = ArgumentParser(usage="python3 Pico_raw_converter.py -i ./picoData/010125/010125_140000_000000.raw -w") # -r if .root format, -b if .pico format, -j N to use N processes
+parser.add_argument("-i",       "--input",                dest="input",               help="Raw captures recorded with Pico_reader_converter.py --raw",                                     default=None,                             type=str, nargs="+", required=True)
+parser.add_argument("-w",       "--write",                dest="write",               help="Enable writing to file, otherwise only the statistics are printed",                                                                                 action="store_true")
+parser.add_argument("-r",       "--root",                 dest="root",                help="Write in .root format, default in .txt",                                                                                                            action="store_true")
+parser.add_argument("-b",       "--binary",               dest="binary",              help="Write in chunked binary .pico format, default in .txt",                                                                                             action="store_true")
+parser.add_argument("-o",       "--output",               dest="output",              help="Output file (one input only), default next to the capture with the extension of the format",    default=None,                             type=str)
+parser.add_argument("-d",       "--device",               dest="device",              help="PICO whose calibration is used, default the one recorded in the capture",                       default=None,                             type=str)
+parser.add_argument("-slow",    "--slow_mode_factor",     dest="slow_mode_factor",    help="Reduce writing rate by factor N provided by user, i.e. from 400Hz to 400Hz/N",                  default=1,                                type=int)
+parser.add_argument(            "--slow_filter",          dest="slow_filter",         help="With -slow, how N events become one row: pick one (default, as before), mean, minmax (two rows) or cic", default="pick",                 type=str, choices=filters)
+parser.add_argument(            "--summary",              dest="summary",             help="Write mean, rms, min, max per channel over windows of these seconds (1 10 60 if none given)",   default=None,                             type=float, nargs="*")
+parser.add_argument("-j",       "--jobs",                 dest="jobs",                help="Processes converting every capture, 0 for all the cores, with -w",                              default=1,                                type=int)
+parser.add_argument(            "--shards",               dest="shards",              help="With -j, keep one output per part (<output>_partNNN) instead of merging them",                                                                      action="store_true")
+
+
+def convert_one(inFilename, outFilename, fmt):
+    summaryPath = None
+    if summary_windows:
+        summaryPath = "{}_summary.csv".format(os.path.splitext(outFilename)[0])
+        print("Writing running statistics over {} s to file {}".format(summary_windows, summaryPath))
+    if options.write and options.jobs != 1:                                                 # split across processes, see picoammeter/parallel.py
+        print("Writing data to file {} with {} processes".format(outFilename, options.jobs or os.cpu_count()))
+        stats = convert_parallel(inFilename, outFilename, fmt=fmt, pico=options.device, slow_mode_factor=options.slow_mode_factor, slow_filter=options.slow_filter,
+                                 jobs=options.jobs or None, shards=options.shards)
+        if summaryPath:                                                                     # the windows run across the parts, one more pass over the capture
+            stats["summary_windows"] = convert(inFilename, None, pico=options.device, summary_path=summaryPath, summary_windows=summary_windows)["summary_windows"]
+        return stats
+    writer = None
+    if options.write:
+        print("Writing data to file {}".format(outFilename))
+        if fmt == "root":
+            writer = RootWriter(outFilename)
+        elif fmt == "pico":
+            writer = BinaryWriter(outFilename)
+        else:
+            writer = TextWriter(outFilename)
+    stats = convert(inFilename, writer, pico=options.device, slow_mode_factor=options.slow_mode_factor, slow_filter=options.slow_filter,
+                    summary_path=summaryPath, summary_windows=summary_windows)
+    if writer is not None:
+        writer.close()
+    return stats
+
+
+if __name__ == "__main__":                                                                  # the worker processes import this file again
+    options = parser.parse_args()
+
+    # Settings #
+    root_format     = options.root
+    binary_format   = options.binary and not root_format
+    extension       = "root" if root_format else "pico" if binary_format else "txt"
+    summary_windows = options.summary if options.summary else default_windows if options.summary is not None else None
+    if options.output and len(options.input) > 1:
+        print("-o can be used with one input only")
+        sys.exit()
+
+    for inFilename in options.input:
+        if not os.path.exists(inFilename):
+            print("Raw capture {} not found".format(inFilename))
+            continue
+        reader      = CaptureReader(inFilename)
+        try:
+            reader.calibration(options.device)                                              # captures without the calibration in their header need the profile of their device
+        except ValueError as error:
+            print("Cannot calibrate {}: {}".format(inFilename, error))
+            print("Set {} to the device profiles it was recorded with, or use -d <pico> to convert it with the calibration of another PICO".format(profiles_variable))
+            sys.exit(1)
+        finally:
+            reader.close()
+        outFilename = options.output or "{}.{}".format(os.path.splitext(inFilename)[0], extension)
+        t0          = time.time()
+        stats       = convert_one(inFilename, outFilename, extension)
+        if options.write and not options.shards and data_folder(outFilename):
+            try:                                                                            # <dataFolder>/<ddmmyy>/<file>: add it to the catalog of the data folder
+                reader          = CaptureReader(inFilename)
+                first_arrival   = reader.times()[0][0] if len(reader) else None             # arrival of the first bytes
+                reader.close()
+                Catalog(data_folder(outFilename)).add(outFilename, device=options.device or reader.info.get("pico"), t0=first_arrival, clock=stats["clock"])
+            except Exception as error:
+                print("Could not add the file to the catalog: {}".format(error))
+
+        print(f"------------------------------ {inFilename} ------------------------------")
+        if "parts" in stats:
+            print(f"total number of parts:                       {stats['parts']}")
+        else:
+            print(f"total number of chunks read:                 {stats['chunks']}")
+            print(f"bytes left at the end of the capture:        {stats['bytes_left']}")
+        print(f"total number of bytes read:                  {stats['bytes']}")
+        print(f"time_flag has changed:                       {stats['count_time_flip']}")
+        if stats["clock"]:
+            print(f"PICO clock drift against the host:           {stats['clock']['drift']*1e6:.3f} ppm")
+        print(f"total number of good events:                 {stats['nev']}")
+        print(f"total number of skipped events:              {stats['nev_skip']}")
+        print(f"total number of written events:              {stats['nev_written']}")
+        print(f"total number of frames missed (gaps):        {stats['frames_missed']} ({stats['gaps']})")
+        print(f"total number of non-matching events:         {stats['frames_rejected']}")
+        print(f"total number of bytes skipped to resync:     {stats['bytes_skipped']}")
+        if "summary_windows" in stats:
+            print(f"running statistics windows written:          {stats['summary_windows']}")
+        print(f"total time elapsed:                          {time.time()-t0}")
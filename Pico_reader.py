@@ -1,13 +1,12 @@
 import socket
 import sys
-import struct
 import os
 import time
 from datetime import datetime
 from argparse import ArgumentParser
 import numpy as np
 from statistics import mean
-import serial
+from picoammeter.frames import decode_frames, corrupted_frames, frame_to_line
 
 # Arguments #
 parser = ArgumentParser(usage="python3 Pico_reader.py -t <time_acq> -w -v") # -s if serial
@@ -26,7 +25,6 @@ dataFolder      = "Data_Hangar"
 outFolder       = "{}/{}".format(dataFolder, datetime.now().strftime("%d%m%y"))
 logFolder       = "{}/{}".format(outFolder, "logs")
 outFilename     = "{}.txt".format(datetime.now().strftime("%d%m%y_%H%M%S_%f"))  # F=Microsecond
-frameTemplate   = struct.Struct(">5s cI ci ci ci ci ci ci ci 5s")  # c=char, i=int, s=char[], ">" big endian (most significant byte first)
 separator       = ","
 logFilename     = "log_{}".format(outFilename)
 
@@ -79,6 +77,7 @@ def connect_to_pico(do_serial, host, port, baud):
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)   # create a TCP/IP socket
             s.connect((host, port))                                 # connect to the server
         else:
+            import serial                                           # pyserial, only needed with -s
             s = serial.Serial(port, baud)                           # connect to the serial port
             print("Connected to serial port {}".format(port))
         if do_verbose:
@@ -121,17 +120,14 @@ while time.time() - t0 <= time_acq:
             frame = s.recv(50)  # buffersize: pass the number of bytes you want to receive from the socket
         else:
             frame = s.read(50)  # buffersize: pass the number of bytes you want to receive from the serial connection
-        data = frameTemplate.unpack(frame)
+        batch = decode_frames(frame)
         # print(frame)
-        if (data[0] == b"START") and (data[-1] == b"/END/"):  # check if the frame is complete
-            # print(data)
-            line = list(data[1:-1])
-
-            if (b"J" in line) or (b"D" in line):  # check if the data must be trashed (if found a "J" or a "D")
-                corrupted_data = True
+        if batch.valid[0]:  # check if the frame is complete
+            # print(batch)
+            corrupted_data = bool(corrupted_frames(batch)[0])  # check if the data must be trashed (if found a "J" or a "D")
+            labels, values = frame_to_line(batch, 0)  # get the labels and the values
+            line = [x for pair in zip(labels, values) for x in pair]
             print(line)
-            labels = [x for i, x in enumerate(line) if i % 2 == 0]  # get the labels
-            values = [x for i, x in enumerate(line) if i % 2 != 0]  # get the values
             if nev == 0:
                 last_time_flag = labels[0]  # get the first time_flag
 
@@ -1,55 +1,101 @@
-import socket
 import sys
-import struct
 import os
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from argparse import ArgumentParser
 import numpy as np
-from statistics import mean
-import serial
-import json
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-import ROOT
-from array import array
-from influxdb_client import InfluxDBClient, Point, WriteOptions
+from picoammeter.receiver import overflow_policies
+from picoammeter.devices import devices
+from picoammeter.reader import PicoReader
+from picoammeter.writers import TextWriter
+from picoammeter.binary import BinaryWriter
+from picoammeter.rootio import RootWriter
+from picoammeter.influx import InfluxSink
+from picoammeter.liveplot import LivePlot
+from picoammeter.capture import CaptureWriter
+from picoammeter.catalog import Catalog
+from picoammeter.eventlog import EventLog, levels
+from picoammeter.metrics import Metrics, MetricsServer, StatsFile
+from picoammeter.decimate import filters, make_decimator, select
+from picoammeter.runstats import Summary, default_windows
+from picoammeter.rotate import RotatingWriter, compressions
+from picoammeter.shutdown import StopSignal
+from picoammeter.sinks import FanOut, FileSink, InfluxDBSink, PlotSink, StatsSink, parse_policies
 
 
-plt.ion()
-
 # Arguments #
 parser = ArgumentParser(usage="python3 Pico_reader_converter.py -t <time_acq> -w -f ./new_folder") # -s if serial, -r if .root format, -l if live plot
-parser.add_argument("-t",       "--time",                 dest="time_acq",            help="Acquisition time in seconds",                                                                   default=10,                               type=int)
+parser.add_argument("-t",       "--time",                 dest="time_acq",            help="Acquisition time in seconds, 0 to run until SIGINT (Ctrl-C) or SIGTERM",                         default=10,                               type=int)
+parser.add_argument("-d",       "--device",               dest="device",              help="PICO to read, see picoammeter/devices.py (sim for Pico_simulator.py)",                          default="pico5",                          type=str, choices=list(devices))
 parser.add_argument("-s",       "--serial",               dest="serial",              help="Enable serial connection",                                                                                                                          action="store_true")
 parser.add_argument("-w",       "--write",                dest="write",               help="Enable writing to file",                                                                                                                            action="store_true")
 parser.add_argument("-r",       "--root",                 dest="root",                help="Write in .root format, default in .txt",                                                                                                            action="store_true")
+parser.add_argument("-b",       "--binary",               dest="binary",              help="Write in chunked binary .pico format, default in .txt",                                                                                             action="store_true")
+parser.add_argument(            "--raw",                  dest="raw",                 help="Only record the received bytes and their arrival time to a .raw capture, see Pico_raw_converter.py",                                                action="store_true")
+parser.add_argument(            "--raw_prealloc",         dest="raw_prealloc",        help="Size in MB preallocated for the .raw capture, it grows if needed",                              default=256,                              type=int)
+parser.add_argument(            "--root_chunk",           dest="root_chunk",          help="Events committed to the .root tree at once, the tree is also AutoSaved every chunk",            default=4000,                             type=int)
+parser.add_argument(            "--root_autosave",        dest="root_autosave",       help="Seconds between two AutoSave of the .root tree",                                                default=10,                               type=float)
+parser.add_argument(            "--root_basket",          dest="root_basket",         help="Basket size of the .root branches in bytes, default by ROOT",                                   default=None,                             type=int)
+parser.add_argument(            "--root_compression",     dest="root_compression",    help="Compression of the .root file, 100*algorithm+level (e.g. 505 for zstd 5), default by ROOT",     default=None,                             type=int)
+parser.add_argument(            "--rotate_size",          dest="rotate_size",         help="With -w, start a new file when the current one reaches this size in MB",                        default=None,                             type=float)
+parser.add_argument(            "--rotate_every",         dest="rotate_every",        help="With -w, start a new file every N seconds, e.g. 3600",                                          default=None,                             type=float)
+parser.add_argument(            "--rotate_daily",         dest="rotate_daily",        help="With -w, start a new file, in the folder of the new day, at midnight",                                                                              action="store_true")
+parser.add_argument(            "--compress",             dest="compress",            help="With -w, compress every closed file in the background (not .root, already compressed)",         default="none",                           type=str, choices=compressions)
 parser.add_argument("-f",       "--folder",               dest="folder",              help="Folder where to save the data",                                                                 default="./picoData",                     type=str)
-parser.add_argument("-v",       "--verbose",              dest="verbose",             help="Enable verbose mode",                                                                                                                               action="store_true")
+parser.add_argument("-v",       "--verbose",              dest="verbose",             help="Enable verbose mode, a JSON-lines log",                                                                                                                               action="store_true")
+parser.add_argument(            "--log_level",            dest="log_level",           help="Lowest level written to the log with -v",                                                       default="debug",                          type=str, choices=list(levels))
+parser.add_argument(            "--log_every",            dest="log_every",           help="With -v, log one event every N (0 for none), anomalies are always logged",                      default=100,                              type=int)
 parser.add_argument("-l",       "--live_plot",            dest="live_plot",           help="Enable live plot",                                                                                                                                  action="store_true")
 parser.add_argument(            "--voltage",              dest="voltage",             help="Enable live voltage plot",                                                                                                                          action="store_true")
 parser.add_argument(            "--current",              dest="current",             help="Enable live current plot",                                                                                                                          action="store_true")
 parser.add_argument(            "--ch",                   dest="ch",                  help="select channel to plot, default all channel are plotted",                                       default="G3B_G3T_G2B_G2T_G1B_G1T_DRIFT",  type=str)
+parser.add_argument(            "--plot_points",          dest="plot_points",         help="Number of points shown by the live plot",                                                       default=100,                              type=int)
 parser.add_argument("-slow",    "--slow_mode_factor",     dest="slow_mode_factor",    help="Reduce writing rate by factor N provided by user, i.e. from 400Hz to 400Hz/N",                  default=1,                                type=int)
+parser.add_argument(            "--slow_filter",          dest="slow_filter",         help="With -slow, how N events become one row: pick one (default, as before), mean, minmax (two rows) or cic", default="pick",                 type=str, choices=filters)
+parser.add_argument(            "--summary",              dest="summary",             help="Write mean, rms, min, max per channel over windows of these seconds (1 10 60 if none given)",   default=None,                             type=float, nargs="*")
 parser.add_argument(            "--grafana",              dest="grafana",             help="Enable writing to InfluxDB",                                                                                                                        action="store_true")
+parser.add_argument(            "--grafana_window",       dest="grafana_window",      help="Seconds over which mean, min and max are sent to InfluxDB",                                     default=1,                                type=float)
+parser.add_argument(            "--sink_policy",          dest="sink_policy",         help="Policy of the outputs that fall behind, e.g. file=block,influx=decimate,plot=drop_oldest",      default=None,                             type=str)
+parser.add_argument(            "--sink_queue",           dest="sink_queue",          help="Batches allowed to wait for every output before its --sink_policy applies",                     default=64,                               type=int)
+parser.add_argument(            "--rx_thread",            dest="rx_thread",           help="Receive on a dedicated thread, in large chunks",                                                                                                    action="store_true")
+parser.add_argument(            "--rx_queue",             dest="rx_queue",            help="Number of received chunks allowed to wait for processing, with --rx_thread",                    default=64,                               type=int)
+parser.add_argument(            "--rx_overflow",          dest="rx_overflow",         help="Policy when processing does not keep up, with --rx_thread",                                     default="block",                          choices=overflow_policies)
+parser.add_argument(            "--no_reconnect",         dest="no_reconnect",        help="End the run when the connection dies instead of reconnecting",                                                                                      action="store_true")
+parser.add_argument(            "--stall",                dest="stall",               help="Seconds without data after which the connection is considered dead, 0 never",                   default=10,                               type=float)
+parser.add_argument(            "--max_backoff",          dest="max_backoff",         help="Longest wait in seconds between two reconnection attempts, doubling from 0.5",                  default=30,                               type=float)
+parser.add_argument(            "--metrics_port",         dest="metrics_port",        help="Serve the pipeline metrics in Prometheus text format on this local port, e.g. 9100",            default=None,                             type=int)
+parser.add_argument(            "--metrics_host",         dest="metrics_host",        help="Address the metrics are served on",                                                             default="127.0.0.1",                      type=str)
+parser.add_argument(            "--stats_file",           dest="stats_file",          help="Append a JSON line with the pipeline metrics to this file every --stats_interval",              default=None,                             type=str)
+parser.add_argument(            "--stats_interval",       dest="stats_interval",      help="Seconds between two lines of --stats_file",                                                     default=10,                               type=float)
 options = parser.parse_args()
+try:
+    sink_policy     = parse_policies(options.sink_policy)                                   # what every output does when it falls behind, see picoammeter/sinks.py
+except ValueError as error:
+    parser.error(str(error))
 
 # Settings #
-pico                = "pico5"
+pico                = options.device
 time_acq            = options.time_acq
+time_divider        = 1                                                                     # 1 if time in seconds, 1000 if time in milliseconds
 do_serial           = options.serial
-do_write            = options.write
+do_write            = options.write and not options.raw
+raw_capture         = options.raw
 root_format         = options.root
+binary_format       = options.binary and not root_format
 do_verbose          = options.verbose
 dataFolder          = options.folder
 outFolder           = "{}/{}".format(dataFolder, datetime.now().strftime("%d%m%y"))
 logFolder           = "{}/{}".format(outFolder, "logs")
-if root_format:
+if raw_capture:
+    outFilename     = "{}.raw".format(datetime.now().strftime("%d%m%y_%H%M%S_%f"))
+elif root_format:
     outFilename     = "{}.root".format(datetime.now().strftime("%d%m%y_%H%M%S_%f"))
+elif binary_format:
+    outFilename     = "{}.pico".format(datetime.now().strftime("%d%m%y_%H%M%S_%f"))
 else:
     outFilename     = "{}.txt".format(datetime.now().strftime("%d%m%y_%H%M%S_%f"))          # f=microsecond
-logFilename         = "log_{}.txt".format(datetime.now().strftime("%d%m%y_%H%M%S_%f"))
-frameTemplate       = struct.Struct(">5s cI ci ci ci ci ci ci ci 5s")                       # c=char, i=int, s=char[], ">" big endian (most significant byte first)
+summaryFilename     = "{}_summary.csv".format(os.path.splitext(outFilename)[0])            # running statistics, written with or without -w
+logFilename         = "log_{}.jsonl".format(datetime.now().strftime("%d%m%y_%H%M%S_%f"))
 separator           = ","
 convert_volt        = True
 convert_curr        = True
@@ -59,7 +105,12 @@ voltage_plot        = options.voltage
 current_plot        = options.current
 channels_to_plot    = options.ch.split("_")
 slow_mode_factor    = options.slow_mode_factor
+decimator           = make_decimator(slow_mode_factor, options.slow_filter)                 # None for the original one event every N, see picoammeter/decimate.py
+summary_windows     = options.summary if options.summary else default_windows if options.summary is not None else None
+rotate              = do_write and (options.rotate_size or options.rotate_every or options.rotate_daily or options.compress != "none")
+compression         = "none" if root_format else options.compress
 grafana             = options.grafana
+rx_thread           = options.rx_thread
 dt                  = 1e-4                                                                  # time interval corresponding to a single timestamp digit; dt is in seconds, example: dt = 0.1 msec = 1e-4 sec
 
 # InfluxDB settings
@@ -70,654 +121,324 @@ INFLUXDB_BUCKET = "bucket"
 
 
 
-# Dictionaries with calibration parameters #
-if pico == "pico5":
-    with open("./calibrations/pico5/pico5_Calibration_Voltage.json","r") as file:
-        CalVoltage = json.load(file)
-    with open("./calibrations/pico5/pico5_Calibration_Current.json","r") as file:
-        CalCurrent = json.load(file)
-elif pico == "pico4":
-    with open("./calibrations/pico4/pico4_Calibration_Voltage.json","r") as file:
-        CalVoltage = json.load(file)
-    with open("./calibrations/pico4/pico4_Calibration_Current.json","r") as file:
-        CalCurrent = json.load(file)
-elif pico == "pico3":
-    with open("./calibrations/pico5/pico5_Calibration_Voltage.json","r") as file:
-        CalVoltage = json.load(file)
-    with open("./calibrations/pico5/pico5_Calibration_Current.json","r") as file:
-        CalCurrent = json.load(file)
-
-# Connection Configuration #
-if do_serial:
-    hostName        = None
-    if pico == "pico4":
-        portNumber  = "COM7" # "COM7" per pico4, "COM8" per pico5
-    elif pico == "pico5":
-        portNumber  = "COM8"
-    elif pico == "pico3":
-        portNumber  = "COM7"
-    baudrate        = 2_000_000
-else:
-    if pico == "pico4":
-        hostName    = "picouart04.na.infn.it" # admin=admin, password=PASSWORD
-    elif pico == "pico5":
-        hostName    = "picouart05.na.infn.it" # admin=admin, password=PASSWORD
-    elif pico == "pico3":
-        hostName    = "picouart03.na.infn.it"
-    portNumber      = 23
-    baudrate        = None
-
 ### Create output folder and file ###
-if do_write:
-    if os.path.exists(dataFolder):
-        if do_verbose:
-            if not os.path.exists(logFolder):
-                os.makedirs(logFolder)
-            # Create log file
-            print("Creating log file {}/{}".format(logFolder, logFilename))
-            logFile = open(os.path.join(logFolder, logFilename), "w")
-            logFile.write("Folder {} already exists\n".format(dataFolder))
-        pass
-    else:
-        if do_verbose:
-            if not os.path.exists(logFolder):
-                os.makedirs(logFolder)
-            # Create log file
-            print("Creating log file {}/{}".format(logFolder, logFilename))
-            logFile = open(os.path.join(logFolder, logFilename), "w")
-            logFile.write("Creating folder {}\n".format(dataFolder))
-        os.makedirs(dataFolder)
-
-    if os.path.exists(outFolder):
-        if do_verbose:
-            logFile.write("Folder {} already exists\n".format(outFolder))
-        pass
-    else:
-        if do_verbose:
-            logFile.write("Creating folder {}\n".format(outFolder))
-        os.makedirs(outFolder)
+if (do_write or raw_capture or summary_windows) and not os.path.exists(outFolder):
+    os.makedirs(outFolder)
+
+if do_verbose:
+    if not os.path.exists(logFolder):
+        os.makedirs(logFolder)
+    # Create log file, written by its own thread
+    print("Creating log file {}/{}".format(logFolder, logFilename))
+    log = EventLog(os.path.join(logFolder, logFilename), level=options.log_level, every=options.log_every)
+    log.start()
+    log.info("run started", pico=pico, args=vars(options))
 
 
 
 # UTILS #
-def connect_to_pico(do_serial, host, port, baud):
-    try:
-        if do_serial==False:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)   # create a TCP/IP socket
-            s.connect((host, port))                                 # connect to the server
-        else:
-            s = serial.Serial(port, baud)                           # connect to the serial port
+def stop_reason():
+    return "{} received, stopping".format(stop.received) if stop.is_set() else reader.stop_reason()
 
+
+def connect_to_pico():
+    # the connection, reopened with backoff when it dies (see picoammeter/link.py), exits if it could not be made
+    try:
+        reader.open()
+    except ConnectionError:
         if do_verbose:
-            logFile.write("Connection to Pico established\n")
-        return s
-    
-    except Exception as error:
-        if do_verbose:
-            logFile.write("Something went wrong with the connection to Pico: {}\n".format(error))
-            logFile.write("Exiting...\n")
+            log.error("Something went wrong with the connection to Pico, exiting")
+            log.close()
         sys.exit()
+    if do_verbose:
+        log.info("Connection to Pico established", host=reader.host, port=reader.port)
+    return reader.link
 
 
-channel_map = ["G3B","G3T","G2B","G2T","G1B","G1T","DRIFT"]
-
-def correct_volt(values, CalVoltage):
-    # values goes from G3B to DRIFT
-    corr_val = []
-    for i, ch in enumerate(channel_map):
-        corr_val.append(values[i] * CalVoltage[ch]["calFit"]["m"][0] + CalVoltage[ch]["calFit"]["q"][0])
-    return corr_val
-
-def correct_curr(values, CalCurrent, labels):
-    corr_val = []
-    for i, ch in enumerate(channel_map):
-        if not ch in CalCurrent:
-            corr_val.append(values[i])
-        elif labels[i] == b'I' :
-            corr_val.append(values[i] * CalCurrent[ch]["calFit_I"]["m"][0] + CalCurrent[ch]["calFit_I"]["q"][0])
-        elif labels[i] == b'i' :
-            corr_val.append(values[i] * CalCurrent[ch]["calFit_i"]["m"][0] + CalCurrent[ch]["calFit_i"]["q"][0])
-        else:
-            corr_val.append(values[i])
-    return corr_val
-
-def correct_temp(values):
-    VRef         = 3.3                              # V
-    nbit         = 10                               # number of bits
-    corr_val     = []
-    for i, ch in enumerate(channel_map):
-        value_V = values[i] * VRef/(2**nbit-1)      # convert ADC to Volts
-        corr_val.append((value_V - 0.5)/0.01)       # convert Volts to Celsius using the LM50 sensor (ref: https://www.ti.com/lit/ds/symlink/lm50.pdf)
-    return corr_val
-
-def write_event_to_file(time_stamp, curr, volt, temp, labels, root_format, outFile, separator=",", tree=None):
-    if root_format:
-        ts[0]                  = time_stamp
-
-        current_G3B[0]         = curr[0]
-        current_G3T[0]         = curr[1]
-        current_G2B[0]         = curr[2]
-        current_G2T[0]         = curr[3]
-        current_G1B[0]         = curr[4]
-        current_G1T[0]         = curr[5]
-        currrent_DRIFT[0]      = curr[6]
-
-        voltage_G3B[0]         = volt[0]
-        voltage_G3T[0]         = volt[1]
-        voltage_G2B[0]         = volt[2]
-        voltage_G2T[0]         = volt[3]
-        voltage_G1B[0]         = volt[4]
-        voltage_G1T[0]         = volt[5]
-        voltage_DRIFT[0]       = volt[6]
-
-        temperature_G3B[0]     = temp[0]
-        temperature_G3T[0]     = temp[1]
-        temperature_G2B[0]     = temp[2]
-        temperature_G2T[0]     = temp[3]
-        temperature_G1B[0]     = temp[4]
-        temperature_G1T[0]     = temp[5]
-        temperature_DRIFT[0]   = temp[6]
-
-        tree.Fill()
-    else:
-        line_to_write      = separator.join([str(x) for x in [time_stamp] + curr + volt + temp + labels])
-        outFile.write("{}\n".format(line_to_write))
+def log_outages():
+    # outages of the link not reported yet
+    global outages_logged
+    for start, end, reason in link.outages[outages_logged:]:
+        if do_verbose:
+            log.warning("link outage", start=start, end=end, seconds=end - start, reason=reason)
+    outages_logged = len(link.outages)
 
 
 ##################
 # Initialization #
 ##################
-s = connect_to_pico(do_serial=do_serial, host=hostName, port=portNumber, baud=baudrate)  # connect to the server
+stop   = StopSignal()                   # SIGINT and SIGTERM end the acquisition as -t does, see picoammeter/shutdown.py
+reader = PicoReader(pico, serial=do_serial, duration=time_acq/time_divider, rx_thread=rx_thread,  # connection, framing, decoding and calibration, see picoammeter/reader.py
+                    rx_queue=options.rx_queue, rx_overflow=options.rx_overflow, read_size=65536,  # without --rx_thread everything received so far in one read
+                    reconnect=not options.no_reconnect, stall=options.stall, max_backoff=options.max_backoff,
+                    stop=stop.event, dt=dt, convert_volt=convert_volt, convert_curr=convert_curr, convert_temp=convert_temp)
+link   = connect_to_pico()              # connect to the server
+s      = link                           # None once the connection is closed at the end
+t0     = reader.t0
+sync, builder, clock, gaps = reader.sync, reader.builder, reader.clock, reader.gaps
+outages_logged = 0
 if s:
     print("---------------------- Connected to PICO ----------------------")
-    if do_verbose:
-        logFile.write("Writing data to file {}/{}".format(outFolder, outFilename))
+    if do_verbose and (do_write or raw_capture):
+        log.info("Writing data to file", path="{}/{}".format(outFolder, outFilename))
     if do_write:
         print("Writing data to file {}/{}".format(outFolder, outFilename))
-        if root_format:
-            outFile             = ROOT.TFile("{}/{}".format(outFolder, outFilename), "RECREATE")
-            tree                = ROOT.TTree("data_tree", "data_tree")
-            # create a branch for each value to be saved
-            ts                  = array('d', [0]) # timestamp
-
-            current_G3B         = array('d', [0])
-            current_G3T         = array('d', [0])
-            current_G2B         = array('d', [0])
-            current_G2T         = array('d', [0])
-            current_G1B         = array('d', [0])
-            current_G1T         = array('d', [0])
-            currrent_DRIFT      = array('d', [0])
-
-            voltage_G3B         = array('d', [0])
-            voltage_G3T         = array('d', [0])
-            voltage_G2B         = array('d', [0])
-            voltage_G2T         = array('d', [0])
-            voltage_G1B         = array('d', [0])
-            voltage_G1T         = array('d', [0])
-            voltage_DRIFT       = array('d', [0])
-
-            temperature_G3B     = array('d', [0])
-            temperature_G3T     = array('d', [0])
-            temperature_G2B     = array('d', [0])
-            temperature_G2T     = array('d', [0])
-            temperature_G1B     = array('d', [0])
-            temperature_G1T     = array('d', [0])
-            temperature_DRIFT   = array('d', [0])
-
-            # actually create branches
-            tree.Branch("timestamp",        ts,                     "timestamp (1e-4 sec)/D")
-
-            tree.Branch("I_G3B",            current_G3B,            "current_G3B (A)/D")
-            tree.Branch("I_G3T",            current_G3T,            "current_G3T (A)/D")
-            tree.Branch("I_G2B",            current_G2B,            "current_G2B (A)/D")
-            tree.Branch("I_G2T",            current_G2T,            "current_G2T (A)/D")
-            tree.Branch("I_G1B",            current_G1B,            "current_G1B (A)/D")
-            tree.Branch("I_G1T",            current_G1T,            "current_G1T (A)/D")
-            tree.Branch("I_DRIFT",          currrent_DRIFT,         "current_DRIFT (A)/D")
-
-            tree.Branch("V_G3B",            voltage_G3B,            "voltage_G3B (V)/D")
-            tree.Branch("V_G3T",            voltage_G3T,            "voltage_G3T (V)/D")
-            tree.Branch("V_G2B",            voltage_G2B,            "voltage_G2B (V)/D")
-            tree.Branch("V_G2T",            voltage_G2T,            "voltage_G2T (V)/D")
-            tree.Branch("V_G1B",            voltage_G1B,            "voltage_G1B (V)/D")
-            tree.Branch("V_G1T",            voltage_G1T,            "voltage_G1T (V)/D")
-            tree.Branch("V_DRIFT",          voltage_DRIFT,          "voltage_DRIFT (V)/D")
-
-            tree.Branch("T_G3B",            temperature_G3B,        "temperature_G3B (C)/D")
-            tree.Branch("T_G3T",            temperature_G3T,        "temperature_G3T (C)/D")
-            tree.Branch("T_G2B",            temperature_G2B,        "temperature_G2B (C)/D")
-            tree.Branch("T_G2T",            temperature_G2T,        "temperature_G2T (C)/D")
-            tree.Branch("T_G1B",            temperature_G1B,        "temperature_G1B (C)/D")
-            tree.Branch("T_G1T",            temperature_G1T,        "temperature_G1T (C)/D")
-            tree.Branch("T_DRIFT",          temperature_DRIFT,      "temperature_DRIFT (C)/D")
-
+        def open_output(path):
+            if root_format:
+                return RootWriter(path,                                     # output file to save data, committed to data_tree in chunks
+                                  chunk_rows=options.root_chunk,
+                                  autosave_seconds=options.root_autosave,
+                                  basket_size=options.root_basket,
+                                  compression=options.root_compression)
+            elif binary_format:
+                return BinaryWriter(path)                                   # output file to save data, see picoammeter/binary.py
+            else:
+                return TextWriter(path, separator=separator)                # output file to save data
+        if rotate:
+            def segment_done(path, final):
+                # on the segment thread: catalog the file if it can still be read, see picoammeter/catalog.py
+                print("Closed output file {}".format(final))
+                if final == path:
+                    Catalog(dataFolder).add(path, device=pico, t0=t0, clock=clock.to_dict(), outages=link.outages)
+            segment_path = lambda now: "{}/{}/{}{}".format(dataFolder, now.strftime("%d%m%y"), now.strftime("%d%m%y_%H%M%S_%f"), os.path.splitext(outFilename)[1])
+            outFile = RotatingWriter(open_output, segment_path,             # a new file by size, time or date, closed ones synced and compressed in the background, see picoammeter/rotate.py
+                                     first_path="{}/{}".format(outFolder, outFilename),
+                                     max_bytes=options.rotate_size*2**20 if options.rotate_size else None,
+                                     interval=options.rotate_every,
+                                     daily=options.rotate_daily,
+                                     compression=compression,
+                                     on_closed=segment_done)
         else:
-            tree    = None
-            outFile = open("{}/{}".format(outFolder, outFilename), "w")  # output file to save data
-            outFile.write("Timestamp,Current_G3B,Current_G3T,Current_G2B,Current_G2T,Current_G1B,Current_G1T,Current_DRIFT,Voltage_G3B,Voltage_G3T,Voltage_G2B,Voltage_G2T,Voltage_G1B,Voltage_G1T,Voltage_DRIFT,Temperature_G3B,Temperature_G3T,Temperature_G2B,Temperature_G2T,Temperature_G1B,Temperature_G1T,Temperature_DRIFT,time_flag,label_G3B,label_G3T,label_G2B,label_G2T,label_G1B,label_G1T,label_DRIFT\n")
+            outFile = open_output("{}/{}".format(outFolder, outFilename))
+    if raw_capture:
+        print("Recording raw data to file {}/{}".format(outFolder, outFilename))
+        capture = CaptureWriter("{}/{}".format(outFolder, outFilename), info={"pico": pico, "host": reader.host, "port": reader.port,
+                                "calibration": builder.calibration.to_dict()}, prealloc=options.raw_prealloc << 20)     # converted later without the device profile
 else:
     print("Connection to PICO failed")
     sys.exit()
 
-if do_verbose:
-    logFile.write("--------------------------------------------------")
-t0      = time.time()
-curr    = list(np.zeros(7))
-volt    = list(np.zeros(7))
-temp    = list(np.zeros(7))
+
+
+
+###############
+# Raw capture #
+###############
+if raw_capture:
+    # the bytes go straight from the connection to the memory-mapped file, nothing is decoded
+    nev_error = 0
+    while reader.acquiring():
+        try:
+            n = capture.receive(link.conn, is_serial=do_serial)
+        except Exception as error:
+            print("Something went wrong: {}\n".format(error))
+            nev_error += 1
+            link.failed(str(error))
+            n = None
+        else:
+            link.received(n)                                    # reconnects if the connection died, the framing resyncs on START when converted
+    print(stop_reason())
+    link.close()
+    capture.close()
+    print(f"total number of bytes received:              {capture.bytes_written}")
+    print(f"total number of chunks received:             {capture.chunks_written}")
+    print(f"total number of error events:                {nev_error}")
+    print(f"total time elapsed:                          {time.time()-t0}")
+    print(f"Closing raw capture:                         {outFolder}/{outFilename}")
+    print(f"Convert it with:                             python3 Pico_raw_converter.py -i {outFolder}/{outFilename} -w")
+    print(f"connection outages:                          {len(link.outages)} ({link.down_seconds:.1f} s)")
+    if do_verbose:
+        log_outages()
+        log.info("run finished", bytes=capture.bytes_written, chunks=capture.chunks_written, errors=nev_error)
+        log.close()
+    sys.exit()
 
 
 
 # plotting
 if live_plot:
-    fig,ax = plt.subplots(figsize=(10,6))
-    ax.set_xlabel("Time")
-    if voltage_plot: 
-        ax.set_ylabel("Voltage [V]")
-    if current_plot:
-        ax.set_ylabel("Current [A]")
-    ax.grid(True)
-    x_data = []
-    y_data = {ch: [] for ch in channels_to_plot}
-    box = ax.get_position()
-    ax.set_position([box.x0, box.y0, box.width * 0.8, box.height])  # Shrink current axis by 20%    
-    
-
-def update_plot(fig, ax, x_data, y_data, unit):
-    image = False
-
-    if image:
-        img = plt.imread("INFN.jpg") 
-        x0, y0 = ax.transData.transform((1.01,0.7))
-        ax.figure.figimage(img, x0, y0, alpha=0.5)
-    
-    plt.title("PICO",size=20)
-    if unit=="V":
-        label = "V" 
-        ax.set_ylabel("Voltage")
-    elif unit=="A":
-        label = "i" 
-        ax.set_ylabel("Current")
-    ax.set_xlabel("Timestamp")
-    ax.yaxis.set_major_formatter(ticker.EngFormatter(unit=unit))
-
-    style = ticker.EngFormatter(unit=unit, places = 2, sep=" ") # formatter for the measurements in the legend 
-    g = lambda x,pos : "{}".format(style(x,pos)) 
-    fmt = ticker.FuncFormatter(g)
-    
-    for ch in channels_to_plot:
-        if len(y_data[ch])>=100: 
-            y_data[ch]  = y_data[ch][-100:]
-            x_data      = x_data[-100:]
-
-        # ax.plot(x_data, y_data[ch], label= ch+"      "+r""+label+" = %.2f $nA$" % (y_data[ch][-1]*10**9)) # for current always in nA
-        last_val =  y_data[ch][-1]
-        ax.plot(x_data, y_data[ch], label=ch+"    {}".format(fmt(last_val)))
-    
-    
-    plt.legend(loc='center left', bbox_to_anchor=(1.01, 0.5), frameon = True) # Put a legend to the right of the current axis
-    # plt.text(0.15,0.91, 'CMS', weight='bold', fontsize=15, transform=plt.gcf().transFigure)
-    
-    """
-    if unit=="A":
-        plt.text(0.875, 0.385, r"$I$ = %.2f $nA$" % (y_data["DRIFT"][-1]*10**9), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.419, r"$I$ = %.2f $nA$" % (y_data["G1T"][-1]*10**9), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.4525, r"$I$ = %.2f $nA$" % (y_data["G1B"][-1]*10**9), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.4875, r"$I$ = %.2f $nA$" % (y_data["G2T"][-1]*10**9), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.525, r"$I$ = %.2f $nA$" % (y_data["G2B"][-1]*10**9), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.56, r"$I$ = %.2f $nA$" % (y_data["G3T"][-1]*10**9), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.595, r"$I$ = %.2f $nA$" % (y_data["G3B"][-1]*10**9), fontsize=8, transform=plt.gcf().transFigure)
-    elif unit=="V":
-        plt.text(0.875, 0.385, r"$V$ = %.2f $V$" % (y_data["DRIFT"][-1]), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.419, r"$V$ = %.2f $V$" % (y_data["G1T"][-1]), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.4525, r"$V$ = %.2f $V$" % (y_data["G1B"][-1]), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.4875, r"$V$ = %.2f $V$" % (y_data["G2T"][-1]), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.525, r"$V$ = %.2f $V$" % (y_data["G2B"][-1]), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.56, r"$V$ = %.2f $V$" % (y_data["G3T"][-1]), fontsize=8, transform=plt.gcf().transFigure)
-        plt.text(0.875, 0.595, r"$V$ = %.2f $V$" % (y_data["G3B"][-1]), fontsize=8, transform=plt.gcf().transFigure)
-    """
-    ax.grid(True, alpha=0.35)
-    plt.draw()
-    plt.pause(0.001)
-    ax.cla()
-
-
-
-def send_to_influxdb(url, token, org, bucket, time_stamp, measurement_name, fields):
-    client      = InfluxDBClient(url=url, token=token, org=org)
-    write_api   = client.write_api(write_options=WriteOptions(batch_size=1))
-
-    # Create a single InfluxDB point with multiple fields (one per channel)
-    point       = Point(measurement_name).field(fields[0], fields[1]).time(time_stamp, write_precision="s")
-    # point.field(fields[0], fields[1])
-    # for channel, current in fields.items():
-    #     point   = point.field(channel, current)
-
-    # Write to InfluxDB
-    write_api.write(bucket=bucket, record=point)
-    print(f"Writing to InfluxDB: {point.to_line_protocol()}")
-    write_api.close()
-    client.close()
+    plot_what = [q for q, wanted in [("current", current_plot), ("voltage", voltage_plot)] if wanted] or ["current"]
+    plot = LivePlot(plot_what, channels=channels_to_plot, points=options.plot_points)  # runs in its own process, see picoammeter/liveplot.py
 
 if grafana:
-    client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-    write_api = client.write_api(write_options=WriteOptions(batch_size=1))
+    influx = InfluxSink(INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET, window=options.grafana_window, tags={"pico": pico})  # posts batches of line protocol from its own thread
+    influx.start()
 
 ####################
 # Data acquisition #
 ####################
-count_time_flip   = 0
-count_I           = 0
-count_V           = 0
 nev_while         = 0
 nev               = 0
-nev_skip          = 0
-nev_notmatching   = 0
 nev_error         = 0
-nev_written       = 0
 
-bytes             = bytearray()
-time_divider      = 1 # 1 if time in seconds, 1000 if time in milliseconds
-while (time.time() - t0 <= time_acq/time_divider) or (len(bytes)>0):
+if summary_windows:
+    summary       = Summary("{}/{}".format(outFolder, summaryFilename), windows=summary_windows, dt=dt, clock=clock)  # mean, rms, min and max per window, see picoammeter/runstats.py
+    print("Writing running statistics over {} s to file {}/{}".format(summary_windows, outFolder, summaryFilename))
+
+# pipeline metrics, see picoammeter/metrics.py #
+metrics           = Metrics(labels={"pico": pico})
+metrics.counter("bytes_received_total",         "Bytes received from the PICO",                         fn=lambda: reader.bytes_received)
+metrics.counter("frames_decoded_total",         "Complete frames decoded")
+metrics.counter("frames_rejected_total",        "Frames rejected by the framing",                       fn=lambda: sync.frames_rejected)
+metrics.counter("resync_bytes_skipped_total",   "Bytes skipped to resynchronise on START",              fn=lambda: sync.bytes_skipped)
+metrics.counter("events_total",                 "Events built",                                         fn=lambda: nev)
+metrics.counter("events_written_total",         "Events written to the output file",                    fn=lambda: file_sink.written if do_write else 0)
+metrics.counter("events_skipped_total",         "Averaged events not written",                          fn=lambda: file_sink.skipped if do_write else 0)
+metrics.counter("receive_errors_total",         "Errors while receiving",                               fn=lambda: reader.errors)
+metrics.counter("frames_missed_total",          "Frames missing from the PICO counter sequence",        fn=lambda: gaps.missed)
+metrics.counter("gaps_total",                   "Gaps in the PICO counter sequence",                    fn=lambda: int(gaps.histogram.sum()))
+metrics.counter("time_flag_flips_total",        "Changes of the time flag",                             fn=lambda: builder.count_time_flip)
+metrics.gauge("clock_drift_ppm",                "Drift of the PICO clock against the host clock",       fn=lambda: clock.fit()[1]*1e6 if clock.fit() else 0)
+metrics.gauge("framing_buffer_bytes",           "Bytes received and not framed yet",                    fn=lambda: len(sync))
+metrics.counter("reconnects_total",             "Connections reopened after an outage",                 fn=lambda: len(link.outages))
+metrics.counter("link_down_seconds_total",      "Time without a connection to the PICO",                fn=lambda: link.down_seconds)
+metrics.gauge("link_up",                        "1 while connected to the PICO",                        fn=lambda: int(link.up))
+metrics.histogram("decode_seconds",             "Time to frame and decode a batch")
+metrics.histogram("calibration_seconds",        "Time to calibrate a batch")
+metrics.histogram("write_seconds",              "Time to hand a batch to the output file")
+reader.metrics    = metrics                     # the reader times decoding and calibration
+if rx_thread:
+    metrics.gauge("receiver_queue_depth",       "Received chunks waiting to be processed",              fn=lambda: reader.receiver.queue.qsize() if reader.receiver else 0)
+    metrics.counter("receiver_bytes_dropped_total", "Bytes dropped by the receiver overflow policy",    fn=lambda: reader.receiver.bytes_dropped if reader.receiver else 0)
+if do_verbose:
+    metrics.gauge("log_queue_depth",            "Log records waiting to be written",                    fn=lambda: len(log.pending))
+    metrics.counter("log_records_dropped_total", "Log records dropped",                                 fn=lambda: log.dropped)
+if grafana:
+    metrics.gauge("influx_queue_depth",         "Lines waiting to be sent to InfluxDB",                 fn=lambda: len(influx.pending))
+    metrics.counter("influx_lines_dropped_total", "Lines dropped before reaching InfluxDB",              fn=lambda: influx.lines_dropped)
+if live_plot:
+    metrics.gauge("plot_queue_depth",           "Blocks waiting to be sent to the live plot",           fn=lambda: plot.queue.qsize())
+    metrics.counter("plot_rows_dropped_total",  "Rows dropped before reaching the live plot",           fn=lambda: plot.rows_dropped)
+
+# outputs, each one on its own thread with its own queue, see picoammeter/sinks.py #
+fanout            = FanOut(clock=clock)
+if do_write:
+    file_sink     = FileSink(outFile, slow_mode_factor, decimator)  # trash the data if a "J" or a "D" is found, skip the data on 60 measurements and the data not complete yet
+    fanout.add(file_sink, queue_size=options.sink_queue, policy=sink_policy["file"], observe=lambda seconds: metrics.observe("write_seconds", seconds))
+if summary_windows:
+    fanout.add(StatsSink(summary), queue_size=options.sink_queue, policy=sink_policy["stats"])  # the full-rate events, whatever is written
+if grafana:
+    fanout.add(InfluxDBSink(influx), queue_size=options.sink_queue, policy=sink_policy["influx"])  # mean, min and max over time windows, in microseconds of host time
+if live_plot:
+    fanout.add(PlotSink(plot), queue_size=options.sink_queue, policy=sink_policy["plot"])  # one event every 65, sent to the plot process
+fanout.register(metrics)
+fanout.start()
+
+if options.metrics_port is not None:
+    metrics_server = MetricsServer(metrics, host=options.metrics_host, port=options.metrics_port)
+    metrics_server.start()
+    print("Metrics served on http://{}:{}/metrics".format(options.metrics_host, metrics_server.port))
+if options.stats_file:
+    stats_file = StatsFile(metrics, options.stats_file, interval=options.stats_interval)
+    stats_file.start()
+
+while not reader.finished:   # after the stop, the reader closes the connection and drains what was received
     # print("---------------------- Event number: ", nev, " ----------------------")
     # print("Time elapsed:                ", time.time()-t0)
-    # if len(bytes):
-        # print(f"bytes in memory {len(bytes)}:    {bytes}")
-    # print(f"number of bytes in memory:       {len(bytes)}")
+    # print(f"number of bytes in memory:       {len(sync)}")
 
 
     nev_while += 1
-    if (time.time() - t0 <= time_acq/time_divider):
-        try:
-            corrupted_data = False
-            if do_serial==False:
-                byte = s.recv(50)  # buffersize: pass the number of bytes you want to receive from the socket
-            else:
-                byte = s.read(50)  # buffersize: pass the number of bytes you want to receive from the serial connection
-
-            # print("byte received:   ", byte)
-            bytes.extend(byte)
-            # print("total bytes are: ", bytes)
-        except Exception as error:
-            print("Something went wrong: {}\n".format(error))
-            nev_error += 1
-            if do_verbose:
-                logFile.write("Something went wrong: {}\n".format(error))
-                logFile.write("--------------------------------------------------")
-
-    elif (time.time() - t0 > time_acq/time_divider) and s:
+    if s and not reader.acquiring():
         print("Time elapsed: ", time.time()-t0)
-        print("Acquisition time reached")
-        print("Socket status before shutdown:", s.fileno())
+        print(stop_reason())
+        print("Socket status before shutdown:", link.conn.fileno() if link.up else None)
         print("Closing connection to PICO")
-        # s.shutdown(socket.SHUT_RDWR)
-        s.close()
         s = None
 
-        # Close InfluxDB connection properly
-        if grafana:
-            write_api.close()
-            client.close()
-            print("InfluxDB connection closed.")
-
-    else:
-        s = None
-
-    ############################
-    ### frame reconstruction ###
-    ############################
-    if ((not s) and (len(bytes) < frameTemplate.size)):
-        print("no more bytes to read")
-        bytes.clear()
-        print("bytes cleared: ", bytes)
+    ##########################################
+    ### reception and frame reconstruction ###
+    ##########################################
+    events = reader.poll(timeout=0.1)           # timestamps and physical data of all the complete frames received, see picoammeter/events.py
+    batch  = reader.frames
+    if reader.errors > nev_error:               # the reader counts the errors, they are reported here
+        nev_error = reader.errors
+        print("Something went wrong: {}\n".format(reader.last_error))
+        if do_verbose:
+            log.error("Something went wrong", error=str(reader.last_error))
+    if reader.finished:
+        print("no more bytes to read, {} bytes dropped".format(len(sync)))
         break
-
-    elif (s) and (len(bytes) < frameTemplate.size):
-        # print("not enough bytes to unpack")
-        continue
-
-    elif (len(bytes) >= frameTemplate.size) and (b"START" in bytes) and (b"/END/" in bytes):
-        # remove the bytes until we find the word START
-
-        while bytes[:5] != b"START":
-            # print("removing bytes until START")
-            # print("removing byte: ", bytes[:1])
-            bytes = bytes[1:]
-            # print("bytes becomes: ", bytes)
-
-        if len(bytes) < frameTemplate.size:
-            # print(f"{len(bytes)} bytes are not enough to unpack")
-            continue
-
-    elif (len(bytes) >= frameTemplate.size) and ((b"START" not in bytes) or (b"/END/" not in bytes)):
-        continue
-
-
-
-    frame = bytes[:frameTemplate.size]
-    bytes = bytes[frameTemplate.size:]
-    # print("frame: ", frame)
-    data  = frameTemplate.unpack(frame)
-    # print("data: ", data)
+    metrics.inc("frames_decoded_total", len(batch.timestamp))
 
 
     ###################################
     ### data processing and writing ###
     ###################################
-    if (data[0] == b"START") and (data[-1] == b"/END/"):  # check if the frame is complete
-        # print("processing data: ", data)
-        line = list(data[1:-1])
-
-        if (b"J" in line) or (b"D" in line):  # check if the data must be trashed (if found a "J" or a "D")
-            corrupted_data = True
+    nev0      = nev
+    nevs      = nev0 + np.arange(len(events.timestamp))             # the reader counted the frames lost, rows with missed > 0 follow them
+    fanout.publish(events, nev0)                                    # to every output, written by their own threads
+    if do_verbose:
+        keep, to_write = select(events, nev0, slow_mode_factor, decimator)  # the rows the file sink writes
+        log.events(events, batch, to_write & do_write, nev0)      # one event every --log_every and the anomalies, formatted by the log thread
+        log_outages()                                               # the reconnections since the last batch
 
-        labels = [x for i, x in enumerate(line) if i % 2 == 0]  # get the labels
-        values = [x for i, x in enumerate(line) if i % 2 != 0]  # get the values
-        
+    nev += len(nevs)
+    if nev//10000 > nev0//10000:
+        print("Time elapsed:             ", time.time()-t0)
+        print("Number of good events:    ", nev)
+        if fanout.workers:
+            print("Output lag:               ", ", ".join("{} {:.3f} s".format(name, lag) for name, lag in fanout.lags().items()))
 
-        if do_verbose:
-            logFile.write("Ev. number:                                      {}\n".format(nev))
-            logFile.write(str(line) + "\n")
-            logFile.write("labels:                                          {}\n".format(labels))
-            logFile.write("values:                                          {}\n".format(values))
-
-
-        #########################################################
-        # correct timestamp for label switching (b'W' <-> b'w') #
-        #########################################################
-        if nev == 0:
-            ts0              = values[0]                                        # get the first time stamp
-            last_time_flag   = labels[0]                                        # get the first time_flag
-        time_flag            = labels[0]                                        # get the time flag
-        time_stamp           = -ts0 + values[0] + count_time_flip*(2**32-1)     # 1) normalize to the first timestamp, so ts[0]=0, ts[1]=25, ..., etc, 2) get the time stamp & 3) add the ADC max count to it for each time_flag flip
-        if time_flag != last_time_flag:
-            count_time_flip += 1
-        last_time_flag       = time_flag
-        time_s               = timedelta(seconds=time_stamp*dt)
-        exact_time_s         = int(t0 + time_s.total_seconds())
-        exact_time_ms        = int((t0 + time_s.total_seconds())*1e3)
-        exact_time_us        = int((t0 + time_s.total_seconds())*1e6)
-        # print(exact_time_s)
-        # print(int(time.time()))
-        # print(f"timestamp read is:                             {labels[0]}  {values[0]} ---> {time_stamp} ---> {time_s}")
-        # print(f"time_flag has changed {count_time_flip} times!\n")
-        ###############################
-        # Conversion to physical data #
-        ###############################
-
-
-        # other quantities #
-        if corrupted_data:
-            pass
-        elif b'T' in labels:                              # check if the data is a temperature
-            if convert_temp:
-                temp = correct_temp(values[1:])
-            else:
-                temp = values[1:]                       # get the temperature values, [1:] is to remove the time stamp
-
-        elif b'V' in labels:                            # check if the data is voltage
-            count_V += 1
-            if convert_volt:
-                volt = correct_volt(values[1:], CalVoltage)
-            else:
-                volt = values[1:]                       # get the voltage values, [1:] is to remove the time stamp
-
-        elif (b'i' in labels) or (b'I' in labels):      # check if the data is a current
-            count_I += 1
-            if convert_curr:
-                curr = correct_curr(values[1:], CalCurrent, labels[1:])
-            else:
-                curr = values[1:]                       # get the current values, [1:] is to remove the time stamp
-        
-        elif (b'p' in labels) or (b'P' in labels) or (b'm' in labels) or (b'M' in labels):
-            pass
-
-        
-        ########################
-        ### SEND TO INFLUXDB ###
-        ########################
-        if grafana:
-            # point = Point("current_measurement").field("current", curr[0]).time(exact_time_us, write_precision="us")
-            # point = Point("current_measurement").field("current_G3B", curr[0]).field("current_G3T", curr[1]).field("current_G2B", curr[2]).field("current_G2T", curr[3]).field("current_G1B", curr[4]).field("current_G1T", curr[5]).field("current_DRIFT", curr[6]).time(exact_time_s, write_precision="s")
-
-
-            # point = Point("current_measurement").tag("channel", "G3B").field("current", curr[0]).time(exact_time_s, write_precision="s")
-            if nev%10 == 0:
-                # point_I = Point("current_measurement").field("I_G3B", curr[0]).field("I_G3T", curr[1]).field("I_G2B", curr[2]).field("I_G2T", curr[3]).field("I_G1B", curr[4]).field("I_G1T", curr[5]).field("I_DRIFT", curr[6]).time(exact_time_s, write_precision="s")
-                point_I = Point("current_measurement").field("I_G3B", curr[0]).field("I_G3T", curr[1]).field("I_G2B", curr[2]).field("I_G2T", curr[3]).field("I_G1B", curr[4]).field("I_G1T", curr[5]).field("I_DRIFT", curr[6]).time(exact_time_ms, write_precision="ms")
-
-                # print(f"Writing to InfluxDB: {point.to_line_protocol()}")
-                write_api.write(bucket=INFLUXDB_BUCKET, record=point_I)
-
-
-                point_V = Point("voltage_measurement").field("V_G3B", volt[0]).field("V_G3T", volt[1]).field("V_G2B", volt[2]).field("V_G2T", volt[3]).field("V_G1B", volt[4]).field("V_G1T", volt[5]).field("V_DRIFT", volt[6]).time(exact_time_s, write_precision="s")
-
-                # print(f"Writing to InfluxDB: {point.to_line_protocol()}")
-                write_api.write(bucket=INFLUXDB_BUCKET, record=point_V)
-
-
-                point_T = Point("temperature_measurement").field("T_G3B", temp[0]).field("T_G3T", temp[1]).field("T_G2B", temp[2]).field("T_G2T", temp[3]).field("T_G1B", temp[4]).field("T_G1T", temp[5]).field("T_DRIFT", temp[6]).time(exact_time_s, write_precision="s")
-
-                # print(f"Writing to InfluxDB: {point.to_line_protocol()}")
-                write_api.write(bucket=INFLUXDB_BUCKET, record=point_T)
-
-            # send_to_influxdb(
-            #     url=INFLUXDB_URL,
-            #     token=INFLUXDB_TOKEN,
-            #     org=INFLUXDB_ORG,
-            #     bucket=INFLUXDB_BUCKET,
-            #     time_stamp=time_stamp,
-            #     measurement_name="current_measurement",
-            #     # fields={channel: value for channel, value in zip(channel_map, curr)}
-            #     fields=["current", curr[6]]
-            # )
-
-            # send_to_influxdb(
-            #     url=INFLUXDB_URL,
-            #     token=INFLUXDB_TOKEN,
-            #     org=INFLUXDB_ORG,
-            #     bucket=INFLUXDB_BUCKET,
-            #     time_stamp=time_stamp,
-            #     measurement_name="voltage_measurements",
-            #     fields={channel: value for channel, value in zip(channel_map, volt)}
-            # )
-
-
-
-        if live_plot:
-            if nev%65==0 and (not b'm' in labels) and (not b'M' in labels) and (not b'p' in labels) and (not b'P' in labels) and (not corrupted_data):
-                if voltage_plot: 
-                    unit = "V"
-                    x_data.append(time_stamp)
-                    for ch in channels_to_plot:
-                        y_data[ch].append(volt[channel_map.index(ch)])
-                if current_plot:
-                    unit = "A"
-                    x_data.append(time_stamp)
-                    for ch in channels_to_plot:
-                        y_data[ch].append(curr[channel_map.index(ch)])
-                # print(len(x_data), len(y_data[ch]))
-                update_plot(fig, ax, x_data, y_data, unit=unit)
-            
-        line_to_write = separator.join([str(x) for x in [time_stamp] + [time_s] + curr + volt + temp + labels])
-        if do_verbose:
-            logFile.write("Timestamp:                                       {}\n".format(time_stamp))
-            logFile.write("Time:                                            {}\n".format(time_s))
-            logFile.write("Current:                                         {}\n".format(curr))
-            logFile.write("Voltage:                                         {}\n".format(volt))
-            logFile.write("Temperature:                                     {}\n".format(temp))
-            logFile.write("Line to be written to {}:\n\t{}\n".format(outFilename, line_to_write))
-
-        if do_write and not corrupted_data:
-            if (nev%slow_mode_factor!=0): # reduce the number of points to be written to file, from 400Hz to 400Hz/N
-                pass
-            elif (b'p' in labels) or (b'P' in labels) or (b'm' in labels) or (b'M' in labels): # skip the data if it is on 60 measurements
-                nev_skip += 1
-                pass
-            elif (count_I==0) or (count_V==0): # skip the data if it is not complete
-                pass
-            else:
-                nev_written += 1
-                if nev_written==1:
-                    print("First event written to file occurs at nev = ", nev)
-                write_event_to_file(time_stamp=time_stamp,
-                                    curr=curr,
-                                    volt=volt,
-                                    temp=temp,
-                                    labels=labels,
-                                    root_format=root_format,
-                                    outFile=outFile,
-                                    separator=separator,
-                                    tree=tree)
-                if do_verbose:
-                    logFile.write("Good data, writing it to file.\n")
-        elif do_write and corrupted_data:
-            corrupted_data = False
-            if do_verbose:
-                logFile.write("DATA CORRUPTED, NOT WRITING IT TO FILE!\n")
-        elif not do_write:
-            if do_verbose:
-                logFile.write("NOT WRITING IT TO FILE, AS REQUESTED!\n")
-        if do_verbose:
-            logFile.write("--------------------------------------------------")
-
-        nev += 1
-        if nev%10000==0:
-            print("Time elapsed:             ", time.time()-t0)
-            print("Number of good events:    ", nev)
-    else:
-        # print("not matching frame: ", data)
-        nev_notmatching += 1
 
+fanout.stop()                                                       # everything queued is written
+if fanout.workers:
+    print(fanout.report())
 
 if grafana:
-    write_api.flush()
-    write_api.close()
-    client.close()
+    influx.close()
+    print(f"InfluxDB connection closed, lines sent:      {influx.lines_sent} ({influx.lines_dropped} dropped, {influx.errors} failed requests)")
 
 
 if live_plot:
-    plt.show()
+    print(f"live plot points sent:                       {plot.rows_sent} ({plot.rows_dropped} dropped)")
+    plot.close()  # the plot stays open until its window is closed
 
 
 # Close output file
-print(f"time_flag has changed:                       {count_time_flip}")
+print(f"time_flag has changed:                       {builder.count_time_flip}")
 print(f"total number in while loop:                  {nev_while}")
 print(f"total number of good events:                 {nev}")
-print(f"total number of skipped events:              {nev_skip}")
-print(f"total number of written events:              {nev_written}")
-print(f"total number of non-matching events:         {nev_notmatching}")
+print(f"total number of skipped events:              {file_sink.skipped if do_write else 0}")
+print(f"total number of written events:              {file_sink.written if do_write else 0}")
+print(f"total number of non-matching events:         {sync.frames_rejected}")
+print(f"total number of bytes skipped to resync:     {sync.bytes_skipped}")
 print(f"total number of error events:                {nev_error}")
+print(f"connection outages:                          {len(link.outages)} ({link.down_seconds:.1f} s without connection, PICO counter restarted {builder.restarts} times)")
+print(gaps.report())
+if clock.fit():
+    print(f"PICO clock drift against the host:           {clock.fit()[1]*1e6:.3f} ppm, timestamp 0 at {clock.fit()[0]:.6f} (start {t0:.6f})")
 print(f"total time elapsed:                          {time.time()-t0}")
-if do_write:
+if reader.receiver is not None:
+    print(f"total number of bytes received:              {reader.receiver.bytes_received}")
+    print(f"receiver queue found full:                   {reader.receiver.queue_full} times")
+    print(f"receiver chunks (bytes) dropped:             {reader.receiver.chunks_dropped} ({reader.receiver.bytes_dropped})")
+if do_write and rotate:
+    print(f"Closing output file:                         {outFile.path}")
+    outFile.close()                                                 # waits for the last files to be synced, compressed and cataloged
+    print(f"total number of output files:                {len(outFile.segments)} ({outFile.worker.errors} not finished)")
+elif do_write:
     print(f"Closing output file:                         {outFolder}/{outFilename}")
-    if root_format:
-        outFile.Write()
-        outFile.Close()
-    else:
-        outFile.close()
+    outFile.close()
+    try:
+        Catalog(dataFolder).add("{}/{}".format(outFolder, outFilename), device=pico, t0=t0, clock=clock.to_dict(), outages=link.outages)  # time range and index of the file, see picoammeter/catalog.py
+    except Exception as error:
+        print("Could not add the file to the catalog: {}".format(error))
+
+if summary_windows:
+    summary.close()
+    print(f"Closing running statistics file:             {outFolder}/{summaryFilename} ({summary.lines} windows)")
+
+# Stop the metrics
+if options.stats_file:
+    stats_file.close()
+    print(f"Pipeline metrics written to:                 {options.stats_file}")
+if options.metrics_port is not None:
+    metrics_server.close()
 
 # Close log file
 if do_verbose:
-    logFile.write("Closing log file\n")
-    logFile.close()
\ No newline at end of file
+    log_outages()
+    log.info("run finished", outages=len(link.outages), events=nev, written=file_sink.written if do_write else 0, missed=gaps.missed, gaps=gaps.gaps[:100], skipped=file_sink.skipped if do_write else 0, errors=nev_error, frames_rejected=sync.frames_rejected, bytes_skipped=sync.bytes_skipped)
+    log.close()
+    print(f"log records written (dropped):               {log.records} ({log.dropped})")
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from picoammeter.simulator import FrameGenerator, Replay, SimulatorServer, default_mix, fd_writer, open_pty, parse_mix, stream
+
+
+# Arguments #
+parser = ArgumentParser(usage="python3 Pico_simulator.py -p 2323 --rate 400 --start_ts 4294900000 --corrupt 0.001") # --pty for a serial stand-in, --replay <capture> to send recorded data
+parser.add_argument(            "--host",                 dest="host",                help="Address to listen on",                                                                          default="localhost",                      type=str)
+parser.add_argument("-p",       "--port",                 dest="port",                help="TCP port to listen on",                                                                         default=2323,                             type=int)
+parser.add_argument(            "--pty",                  dest="pty",                 help="Serve on a pseudo terminal instead of TCP, linked to this path (Linux/macOS)",                  default=None,                             type=str)
+parser.add_argument(            "--rate",                 dest="rate",                help="Frames per second, 0 to send as fast as possible",                                              default=400,                              type=float)
+parser.add_argument(            "--speed",                dest="speed",               help="Multiply the rate, e.g. 10 for ten times the real rate",                                        default=1,                                type=float)
+parser.add_argument("-t",       "--time",                 dest="duration",            help="Seconds of data sent to every client, default until it disconnects",                            default=None,                             type=float)
+parser.add_argument(            "--mix",                  dest="mix",                 help="Fraction of every frame type",                                                                  default=",".join("{}={}".format(k, v) for k, v in default_mix.items()), type=str)
+parser.add_argument(            "--start_ts",             dest="start_ts",            help="First timestamp, close to 2**32 to see the W/w flag flip soon",                                 default=0,                                type=int)
+parser.add_argument(            "--corrupt",              dest="corrupt",             help="Fraction of frames with a J or D label",                                                        default=0,                                type=float)
+parser.add_argument(            "--partial",              dest="partial",             help="Fraction of frames cut short",                                                                  default=0,                                type=float)
+parser.add_argument(            "--seed",                 dest="seed",                help="Seed of the random generator",                                                                  default=None,                             type=int)
+parser.add_argument(            "--replay",               dest="replay",              help="Send the bytes of a recorded capture instead of generated frames",                              default=None,                             type=str)
+parser.add_argument(            "--loop",                 dest="loop",                help="Start the replay over at the end of the capture",                                                                                                   action="store_true")
+options = parser.parse_args()
+
+rate = options.rate*options.speed
+
+
+def make_source():
+    if options.replay:
+        return Replay(options.replay, loop=options.loop)
+    return FrameGenerator(parse_mix(options.mix), start_timestamp=options.start_ts, corrupt=options.corrupt, partial=options.partial, seed=options.seed)
+
+
+if options.pty:
+    master, slave, path = open_pty(options.pty)
+    print("Serial stand-in ready on {}, sending {} frames/s".format(path, rate or "max"))
+    source  = make_source()
+    t0      = time.time()
+    try:
+        sent = stream(source, fd_writer(master), rate=rate, duration=options.duration)
+    except KeyboardInterrupt:
+        sent = None
+    print("bytes sent:     {}".format(sent))
+    print("time elapsed:   {}".format(time.time() - t0))
+    os.close(master)
+    os.close(slave)
+    if os.path.islink(options.pty):
+        os.remove(options.pty)
+    sys.exit()
+
+server = SimulatorServer(make_source, host=options.host, port=options.port, rate=rate, duration=options.duration)
+print("PICO simulator listening on {}:{}, sending {} frames/s".format(*server.address, rate or "max"))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    server.stop()
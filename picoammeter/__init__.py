@@ -0,0 +1,14 @@
+from picoammeter.frames import (
+    FRAME_SIZE,
+    FrameBatch,
+    FrameSync,
+    channel_map,
+    corrupted_frames,
+    decode_frames,
+    frame_dtype,
+    frameTemplate,
+)
+from picoammeter.calibration import Calibration
+from picoammeter.devices import devices, load_calibration
+from picoammeter.events import EventBatch, EventBuilder
+from picoammeter.reader import PicoReader
@@ -0,0 +1,128 @@
+import json
+import os
+
+import numpy as np
+
+from picoammeter.frames import channel_map
+
+
+# File layout:
+#   MAGIC, uint32 header length, JSON header (block_rows, columns) padded to 8 bytes,
+#   then fixed-size blocks: uint32 nrows, uint32 reserved, block_rows values of every column, one column after the other.
+# Every column can be memory-mapped with a stride of one block, the last block may be partially filled (nrows < block_rows).
+MAGIC       = b"PICOBIN1"
+columns     = ([("timestamp", "<i8")]
+               + [("I_{}".format(ch), "<f8") for ch in channel_map]
+               + [("V_{}".format(ch), "<f8") for ch in channel_map]
+               + [("T_{}".format(ch), "<f8") for ch in channel_map]
+               + [("time_flag", "u1")]
+               + [("label_{}".format(ch), "u1") for ch in channel_map]
+               + [("missed", "<i4")])
+
+
+def block_dtype(block_rows, columns=columns):
+    return np.dtype([("nrows", "<u4"), ("reserved", "<u4")] + [(name, dtype, (block_rows,)) for name, dtype in columns])
+
+
+class BinaryWriter:
+    # Chunked columnar output: events are buffered in one block of typed columns, written when full #
+    def __init__(self, path, block_rows=4096):
+        self.path       = path
+        self.block_rows = block_rows
+        self.block      = np.zeros((), dtype=block_dtype(block_rows))
+        self.nrows      = 0                                                                 # rows in the current block
+        self.file       = open(path, "wb")
+        header          = json.dumps({"block_rows": block_rows, "columns": columns}).encode()
+        header         += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)                     # keep the blocks aligned to 8 bytes
+        self.file.write(MAGIC + np.uint32(len(header)).tobytes() + header)
+
+    def write(self, events, mask):
+        # append the events selected by mask
+        idx     = mask.nonzero()[0]
+        ts      = events.timestamp[idx]
+        curr    = events.curr[idx]
+        volt    = events.volt[idx]
+        temp    = events.temp[idx]
+        labels  = events.labels[idx].view(np.uint8)
+        missed  = events.missed[idx]
+        done    = 0
+        while done < len(idx):
+            m   = min(len(idx) - done, self.block_rows - self.nrows)
+            a   = self.nrows
+            src = slice(done, done + m)
+            self.block["timestamp"][a:a+m]              = ts[src]
+            for i, ch in enumerate(channel_map):
+                self.block["I_{}".format(ch)][a:a+m]    = curr[src, i]
+                self.block["V_{}".format(ch)][a:a+m]    = volt[src, i]
+                self.block["T_{}".format(ch)][a:a+m]    = temp[src, i]
+                self.block["label_{}".format(ch)][a:a+m] = labels[src, i+1]
+            self.block["time_flag"][a:a+m]              = labels[src, 0]
+            self.block["missed"][a:a+m]                 = missed[src]
+            self.nrows += m
+            done       += m
+            if self.nrows == self.block_rows:
+                self.flush()
+
+    def flush(self):
+        # write the current block, even if partially filled
+        if self.nrows == 0:
+            return
+        self.block["nrows"] = self.nrows
+        self.file.write(self.block.tobytes())
+        self.file.flush()
+        self.nrows = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class BinaryReader:
+    # Memory-mapped readback: only the pages of the requested columns are read #
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a PICO binary file".format(path))
+            size        = int(np.frombuffer(file.read(4), dtype="<u4")[0])
+            header      = json.loads(file.read(size))
+        self.path       = path
+        self.block_rows = header["block_rows"]
+        self.columns    = [(name, dtype) for name, dtype in header["columns"]]
+        dtype           = block_dtype(self.block_rows, self.columns)
+        offset          = len(MAGIC) + 4 + size
+        nblocks         = (os.path.getsize(path) - offset) // dtype.itemsize                # a block cut by a crash is ignored
+        if nblocks > 0:
+            self.blocks = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(nblocks,))
+        else:
+            self.blocks = np.zeros(0, dtype=dtype)
+        self.nrows      = self.blocks["nrows"].astype(np.int64)
+
+    def __len__(self):
+        return int(self.nrows.sum())
+
+    @property
+    def names(self):
+        return [name for name, _ in self.columns]
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def rows(self, name, first=0, last=None):
+        # rows first <= i < last of a column, only the blocks holding them are read
+        ends    = np.cumsum(self.nrows)
+        last    = len(self) if last is None else min(last, len(self))
+        if first >= last:
+            return np.zeros(0, dtype=self.blocks.dtype[name].base)
+        b0      = int(np.searchsorted(ends, first, side="right"))
+        b1      = int(np.searchsorted(ends, last - 1, side="right")) + 1
+        data    = self.blocks[name][b0:b1]
+        nrows   = self.nrows[b0:b1]
+        flat    = data.reshape(-1) if (nrows == self.block_rows).all() else data[np.arange(self.block_rows) < nrows[:, None]]
+        offset  = first - (ends[b0] - nrows[0])
+        return flat[offset:offset + last - first]
+
+    def column(self, name):
+        data = self.blocks[name]                                                            # (nblocks, block_rows) view on the file
+        if (self.nrows == self.block_rows).all():
+            return data.reshape(-1)
+        return data[np.arange(self.block_rows) < self.nrows[:, None]]
@@ -0,0 +1,58 @@
+import numpy as np
+
+from picoammeter.devices import devices, load_calibration, profiles_variable
+from picoammeter.frames import channel_map
+
+
+VRef            = 3.3                                                                       # V, temperature ADC reference
+nbit            = 10                                                                        # number of bits of the temperature ADC
+current_ranges  = [None, b'i', b'I']                                                        # row of the current coefficients for each label, None = no calibration
+
+
+class Calibration:
+    # Calibration JSONs compiled once into dense coefficient arrays, a batch of raw values is converted in one expression #
+    def __init__(self, CalVoltage, CalCurrent):
+        nch             = len(channel_map)
+        self.channels   = np.arange(nch)
+        # voltage: value*m + q
+        self.volt_m     = np.array([CalVoltage[ch]["calFit"]["m"][0] for ch in channel_map])
+        self.volt_q     = np.array([CalVoltage[ch]["calFit"]["q"][0] for ch in channel_map])
+        # current: one row per range, the identity for the channels (or labels) without calibration
+        self.curr_m     = np.ones((len(current_ranges), nch))
+        self.curr_q     = np.zeros((len(current_ranges), nch))
+        for i, ch in enumerate(channel_map):
+            if ch in CalCurrent:
+                for r, fit in [(1, "calFit_i"), (2, "calFit_I")]:
+                    self.curr_m[r, i] = CalCurrent[ch][fit]["m"][0]
+                    self.curr_q[r, i] = CalCurrent[ch][fit]["q"][0]
+
+    @classmethod
+    def from_device(cls, pico, **kwargs):
+        if pico not in devices:
+            raise ValueError("Unknown device {}, available are {} (profiles can be added with {})".format(pico, list(devices), profiles_variable))
+        return cls(*load_calibration(pico, **kwargs))
+
+    @classmethod
+    def from_dict(cls, coefficients):
+        # the compiled arrays of to_dict(), e.g. from the header of a raw capture, without the calibration JSONs
+        calibration             = cls.__new__(cls)
+        calibration.channels    = np.arange(len(channel_map))
+        for name in ["volt_m", "volt_q", "curr_m", "curr_q"]:
+            setattr(calibration, name, np.array(coefficients[name], dtype=np.float64))
+        return calibration
+
+    def to_dict(self):
+        return dict(volt_m=self.volt_m.tolist(), volt_q=self.volt_q.tolist(), curr_m=self.curr_m.tolist(), curr_q=self.curr_q.tolist())
+
+    def volt(self, values):
+        # values (n,7) goes from G3B to DRIFT
+        return values * self.volt_m + self.volt_q
+
+    def curr(self, values, labels):
+        # b'i' and b'I' select the low and high current range of each channel
+        r = (labels == b'i') + 2*(labels == b'I')
+        return values * self.curr_m[r, self.channels] + self.curr_q[r, self.channels]
+
+    def temp(self, values):
+        value_V = values * VRef/(2**nbit-1)                                                 # convert ADC to Volts
+        return (value_V - 0.5)/0.01                                                         # convert Volts to Celsius using the LM50 sensor (ref: https://www.ti.com/lit/ds/symlink/lm50.pdf)
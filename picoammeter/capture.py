@@ -0,0 +1,195 @@
+import json
+import mmap
+import socket
+import struct
+import time
+
+import numpy as np
+
+from picoammeter.calibration import Calibration
+from picoammeter.clock import ClockFit
+from picoammeter.decimate import make_decimator, select
+from picoammeter.events import EventBuilder
+from picoammeter.frames import FrameSync, decode_frames
+from picoammeter.runstats import Summary, default_windows
+
+
+# File layout:
+#   MAGIC, uint32 header length, JSON header (pico, start time, calibration coefficients, ...) padded to 8 bytes,
+#   then one record per received chunk: float64 host receive time, uint32 nbytes, uint32 reserved, the bytes as received.
+# The file is preallocated and memory-mapped, the connection reads straight into it. A record with nbytes=0 ends the capture
+# (the preallocated tail of a capture that was not closed).
+MAGIC       = b"PICORAW1"
+record      = struct.Struct("<dII")
+
+
+class CaptureWriter:
+    # Raw capture: the bytes received from the PICO and the host time of every chunk, nothing is decoded #
+    def __init__(self, path, info=None, prealloc=1 << 28, chunk_size=65536):
+        self.path           = path
+        self.chunk_size     = chunk_size
+        self.file           = open(path, "w+b")
+        header              = json.dumps(dict(info or {}, start_time=time.time())).encode()
+        header             += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.pos            = self.file.tell()                                              # where the next record goes
+        self.size           = max(prealloc, self.pos + record.size + chunk_size)
+        self.file.truncate(self.size)
+        self.map            = mmap.mmap(self.file.fileno(), self.size)
+        self.bytes_written  = 0
+        self.chunks_written = 0
+
+    def receive(self, conn, is_serial=False):
+        # read one chunk from the socket or serial port directly into the file:
+        # the number of bytes, 0 if the connection was closed by the other side, None on timeout
+        self._reserve(record.size + self.chunk_size)
+        start   = self.pos + record.size
+        nbytes  = min(max(conn.in_waiting, 1), self.chunk_size) if is_serial else self.chunk_size
+        try:
+            with memoryview(self.map)[start:start + nbytes] as view:
+                n = conn.readinto(view) if is_serial else conn.recv_into(view)
+        except socket.timeout:
+            return None
+        if is_serial and not n:                                                             # a serial read returns nothing on timeout
+            return None
+        if n:
+            self._commit(n)
+        return n
+
+    def write(self, data):
+        # append a chunk received elsewhere
+        n = len(data)
+        self._reserve(record.size + n)
+        self.map[self.pos + record.size:self.pos + record.size + n] = data
+        self._commit(n)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(self.pos)                                                        # drop the preallocated tail
+        self.file.close()
+
+    def _commit(self, n):
+        record.pack_into(self.map, self.pos, time.time(), n, 0)
+        self.pos               += record.size + n
+        self.bytes_written     += n
+        self.chunks_written    += 1
+
+    def _reserve(self, n):
+        # grow the file (and the map) when the next record may not fit
+        if self.pos + n <= self.size:
+            return
+        self.map.flush()
+        self.map.close()
+        self.size = max(2*self.size, self.pos + n)
+        self.file.truncate(self.size)
+        self.map  = mmap.mmap(self.file.fileno(), self.size)
+
+
+class CaptureReader:
+    # Iterate over the chunks of a raw capture: (host receive time, bytes) #
+    def __init__(self, path):
+        self.path   = path
+        self.file   = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            self.file.close()
+            raise ValueError("{} is not a PICO raw capture".format(path))
+        size        = struct.unpack("<I", self.file.read(4))[0]
+        self.info   = json.loads(self.file.read(size))
+        self.first  = len(MAGIC) + 4 + size                                                 # offset of the first record
+        self.data   = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)             # slices of the map are copied out, no view is kept on it
+        self._index = None
+
+    def __iter__(self):
+        for pos, host_time, n in self._records():
+            yield host_time, self.data[pos:pos + n]
+
+    def __len__(self):
+        # bytes received in the whole capture
+        return int(self.index()[2][-1])
+
+    def _records(self):
+        # file offset of the data, host time and size of every record
+        pos = self.first
+        while pos + record.size <= len(self.data):
+            host_time, n, _ = record.unpack_from(self.data, pos)
+            if n == 0 or pos + record.size + n > len(self.data):                            # end of the capture, or a chunk cut by a crash
+                break
+            yield pos + record.size, host_time, n
+            pos += record.size + n
+
+    def index(self):
+        # file offset of every record, its host time, and the offsets of the records in the received stream (one more, the total)
+        if self._index is None:
+            records     = list(self._records())
+            offsets     = np.array([r[0] for r in records], dtype=np.int64)
+            times       = np.array([r[1] for r in records])
+            sizes       = np.array([r[2] for r in records], dtype=np.int64)
+            self._index = offsets, times, np.concatenate([[0], np.cumsum(sizes)])
+        return self._index
+
+    def read(self, start, stop):
+        # bytes of the received stream between start and stop, whatever the records they belong to
+        offsets, _, stream = self.index()
+        first   = max(int(np.searchsorted(stream, start, side="right")) - 1, 0)
+        out     = []
+        for r in range(first, len(offsets)):
+            if stream[r] >= stop:
+                break
+            a   = max(start, stream[r]) - stream[r]
+            b   = min(stop, stream[r+1]) - stream[r]
+            out.append(self.data[offsets[r] + a:offsets[r] + b])
+        return b"".join(out)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def times(self):
+        # host receive time and size of every chunk
+        _, times, stream = self.index()
+        return times, np.diff(stream)
+
+    def calibration(self, pico=None):
+        # the calibration of the device given, otherwise the one recorded in the header (Calibration.to_dict), otherwise the
+        # one of the profile of the recorded device (captures made before the coefficients were recorded)
+        if pico is None and self.info.get("calibration"):
+            return Calibration.from_dict(self.info["calibration"])
+        return Calibration.from_device(pico or self.info["pico"])
+
+
+def convert(path, writer=None, pico=None, slow_mode_factor=1, slow_filter="pick", summary_path=None, summary_windows=default_windows):
+    # Turn a raw capture into events, written with writer (TextWriter, BinaryWriter, RootWriter) as the live acquisition does:
+    # the chunks are framed, calibrated and selected in the same way, so the output is the same as with -w.
+    # With summary_path the running statistics are written there as with --summary, see picoammeter/runstats.py.
+    reader      = CaptureReader(path)
+    sync        = FrameSync()
+    builder     = EventBuilder(reader.calibration(pico))
+    clock       = ClockFit()                                                                # PICO clock against the host receive times
+    decimator   = make_decimator(slow_mode_factor, slow_filter)
+    summary     = Summary(summary_path, windows=summary_windows, clock=clock) if summary_path else None
+    stats       = dict(chunks=0, bytes=0, nev=0, nev_skip=0, nev_written=0, frames_missed=0, gaps=0)
+    for host_time, chunk in reader:
+        stats["chunks"]    += 1
+        stats["bytes"]     += len(chunk)
+        sync.feed(chunk)
+        events  = builder.process(decode_frames(sync.extract()))
+        clock.add(events.timestamp[-1:], host_time)
+        keep, write = select(events, stats["nev"], slow_mode_factor, decimator)
+        stats["nev"]       += len(events.timestamp)
+        stats["nev_skip"]  += int(np.count_nonzero(keep & events.averaged))
+        stats["frames_missed"] += int(events.missed[events.missed > 0].sum())
+        stats["gaps"]      += int(np.count_nonzero(events.missed > 0))
+        if summary is not None:
+            summary.add(events)
+        if writer is not None:
+            rows, mask = decimator.process(events, write) if decimator else (events, write)     # from 400Hz to 400Hz/N
+            writer.write(rows, mask)
+            stats["nev_written"] += int(np.count_nonzero(mask))
+    reader.close()
+    if summary is not None:
+        summary.close()
+        stats["summary_windows"] = summary.lines
+    stats.update(bytes_left=len(sync), frames_rejected=sync.frames_rejected, bytes_skipped=sync.bytes_skipped, count_time_flip=builder.count_time_flip,
+                 clock=clock.to_dict())
+    return stats
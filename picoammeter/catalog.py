@@ -0,0 +1,238 @@
+import contextlib
+import io
+import json
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+
+from picoammeter.binary import BinaryReader
+from picoammeter.frames import channel_map
+
+
+dt              = 1e-4                                                                      # seconds per timestamp digit
+index_rows      = 4000                                                                      # one sparse index entry every index_rows rows
+catalog_name    = "catalog.json"
+lock_name       = "catalog.json.lock"                                                       # taken by the processes updating the catalog
+file_pattern    = re.compile(r"^(\d{6}_\d{6}_\d{6})(?:_(\w+))?\.(txt|pico|root)$")           # <ddmmyy_hhmmss_microseconds>[_<pico>].<format>
+
+# columns as named in the .pico and .root files, and their position in the .txt lines #
+columns         = (["timestamp"] + ["I_{}".format(ch) for ch in channel_map] + ["V_{}".format(ch) for ch in channel_map]
+                   + ["T_{}".format(ch) for ch in channel_map])
+text_columns    = dict({name: i for i, name in enumerate(columns)}, missed=len(columns) + 1 + len(channel_map))   # after the time flag and the labels
+
+
+def run_start(path):
+    # start time of a run from the name of its file, None if the name does not follow the convention
+    match = file_pattern.match(os.path.basename(path))
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), "%d%m%y_%H%M%S_%f").timestamp()
+
+
+def data_folder(path):
+    # <dataFolder> of a file stored as <dataFolder>/<ddmmyy>/<file>, None for a file stored elsewhere
+    day = os.path.dirname(os.path.abspath(path))
+    if file_pattern.match(os.path.basename(path)) and re.match(r"^\d{6}$", os.path.basename(day)):
+        return os.path.dirname(day)
+    return None
+
+
+def scan(path):
+    # rows, first and last timestamp and sparse index [(timestamp, position)] of a file:
+    # the position is the byte offset of the line for .txt, the row for .pico, the entry for .root
+    fmt = os.path.splitext(path)[1][1:]
+    if fmt == "txt":
+        with open(path, "rb") as file:
+            data = np.frombuffer(file.read(), dtype=np.uint8)
+        starts  = np.concatenate([[0], np.flatnonzero(data == ord("\n")) + 1])
+        starts  = starts[starts < len(data)][1:]                                            # beginning of every line, without the header
+        read_ts = lambda k: int(bytes(data[starts[k]:starts[k] + 24]).split(b",", 1)[0])
+        picks   = list(range(0, len(starts), index_rows))
+        index   = [(read_ts(k), int(starts[k])) for k in picks]
+        rows    = len(starts)
+        last    = read_ts(rows - 1) if rows else None
+    elif fmt == "pico":
+        ts      = BinaryReader(path)["timestamp"]
+        rows    = len(ts)
+        index   = [(int(ts[k]), k) for k in range(0, rows, index_rows)]
+        last    = int(ts[-1]) if rows else None
+    elif fmt == "root":
+        ts      = _root_column(path, "timestamp")
+        rows    = len(ts)
+        index   = [(int(ts[k]), k) for k in range(0, rows, index_rows)]
+        last    = int(ts[-1]) if rows else None
+    else:
+        raise ValueError("unknown format of {}".format(path))
+    first = index[0][0] if index else None
+    return dict(format=fmt, rows=rows, first_ts=first, last_ts=last, index=index)
+
+
+def to_time(entry, ts):
+    # unix time of timestamps of a file: with the clock fitted during the run when known (see picoammeter/clock.py), else from t0
+    clock = entry.get("clock")
+    if clock:
+        return clock["offset"] + (1 + clock["drift"])*np.asarray(ts, dtype=np.float64)*dt
+    return entry["t0"] + np.asarray(ts, dtype=np.float64)*dt
+
+
+def to_timestamp(entry, time):
+    # inverse of to_time
+    clock = entry.get("clock")
+    if clock:
+        return (time - clock["offset"])/((1 + clock["drift"])*dt)
+    return (time - entry["t0"])/dt
+
+
+def _root_column(path, name, first=0, last=None):
+    import ROOT
+    frame = ROOT.RDataFrame("data_tree", path)
+    if first or last is not None:
+        frame = frame.Range(first, last if last is not None else 0)
+    return np.asarray(frame.AsNumpy([name])[name])
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    # exclusive lock between processes on the file at path (created if needed), held for the with block
+    with open(path, "a+") as file:
+        if os.name == "nt":
+            import msvcrt
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class Catalog:
+    # Start and end time, rows, device, format and sparse index of every output file under a data folder,
+    # stored in <folder>/catalog.json. query() reads only the part of the files covering the requested time range.
+    # Several processes can update it at once (converters, -j workers, segment threads): add() and update() reload
+    # the catalog and save it under a lock on <folder>/catalog.json.lock, so that no entry is lost.
+    def __init__(self, folder):
+        self.folder     = folder
+        self.path       = os.path.join(folder, catalog_name)
+        self.files      = {}                                                                # relative path -> entry
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r") as file:
+                self.files = json.load(file)["files"]
+
+    def locked(self):
+        # with catalog.locked(): load, change and save without another process in between
+        return file_lock(os.path.join(self.folder, lock_name))
+
+    def save(self):
+        # written to a temporary file and renamed, a reader never sees a half written catalog; hold locked() around
+        # the load that preceded the changes
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump({"files": self.files}, file)
+        os.replace(tmp, self.path)
+
+    def add(self, path, device=None, t0=None, clock=None, outages=None, save=True):
+        # (re)index one file; t0 is the time of timestamp 0, by default the time in the file name; clock the fit of ClockFit.to_dict();
+        # outages the (start, end, reason) of the connection outages of the run, those within the file are kept
+        match   = file_pattern.match(os.path.basename(path))
+        entry   = scan(path)
+        t0      = t0 if t0 is not None else run_start(path)
+        entry.update(device     = device or (match.group(2) if match else None),
+                     t0         = t0,
+                     clock      = clock)
+        known   = entry["rows"] and (t0 is not None or clock)
+        entry.update(start_time = float(to_time(entry, entry["first_ts"])) if known else None,
+                     end_time   = float(to_time(entry, entry["last_ts"])) if known else None,
+                     size       = os.path.getsize(path),
+                     mtime      = os.path.getmtime(path))
+        entry["outages"] = [list(outage) for outage in outages or []
+                            if not known or (outage[1] >= entry["start_time"] and outage[0] <= entry["end_time"])]
+        if save:
+            with self.locked():                                                             # the entries other processes added meanwhile are kept
+                self.load()
+                self.files[os.path.relpath(path, self.folder)] = entry
+                self.save()
+        else:
+            self.files[os.path.relpath(path, self.folder)] = entry
+        return entry
+
+    def update(self):
+        # index the files of the per-day folders that are new or changed since the last update; returns their paths
+        with self.locked():
+            self.load()
+            changed = []
+            for day in sorted(os.listdir(self.folder)):
+                day_folder = os.path.join(self.folder, day)
+                if not (os.path.isdir(day_folder) and re.match(r"^\d{6}$", day)):
+                    continue
+                for name in sorted(os.listdir(day_folder)):
+                    path    = os.path.join(day_folder, name)
+                    key     = os.path.relpath(path, self.folder)
+                    if not file_pattern.match(name):
+                        continue
+                    known   = self.files.get(key)
+                    if known and known["size"] == os.path.getsize(path) and known["mtime"] == os.path.getmtime(path):
+                        continue
+                    try:
+                        self.add(path, device=known["device"] if known else None, t0=known["t0"] if known else None,
+                                 clock=known.get("clock") if known else None, save=False)
+                        changed.append(path)
+                    except Exception as error:                                                  # e.g. a .root file without ROOT, or a file still being written
+                        print("Could not index {}: {}".format(path, error))
+            for key in [key for key in self.files if not os.path.exists(os.path.join(self.folder, key))]:
+                del self.files[key]
+            self.save()
+        return changed
+
+    def find(self, start, end, device=None):
+        # files overlapping [start, end] (unix times), in time order
+        found = [(entry["start_time"], key) for key, entry in self.files.items()
+                 if entry["start_time"] is not None and entry["start_time"] <= end and entry["end_time"] >= start
+                 and (device is None or entry["device"] == device)]
+        return [key for _, key in sorted(found)]
+
+    def query(self, start, end, names=("I_DRIFT",), device=None):
+        # rows with start <= time <= end: "time" (unix time) and the requested columns, from all the files of the range
+        out = {name: [] for name in ["time"] + list(names)}
+        for key in self.find(start, end, device):
+            entry   = self.files[key]
+            ts_lo   = to_timestamp(entry, start)
+            ts_hi   = to_timestamp(entry, end)
+            data    = self._read(os.path.join(self.folder, key), entry, ts_lo, ts_hi, names)
+            time    = to_time(entry, data["timestamp"])
+            keep    = (time >= start) & (time <= end)
+            out["time"].append(time[keep])
+            for name in names:
+                out[name].append(data[name][keep])
+        return {name: np.concatenate(parts) if parts else np.zeros(0) for name, parts in out.items()}
+
+    def _read(self, path, entry, ts_lo, ts_hi, names):
+        # the rows between the index entries around [ts_lo, ts_hi]
+        index   = entry["index"]
+        index_ts = np.array([ts for ts, _ in index])
+        a       = max(int(np.searchsorted(index_ts, ts_lo, side="right")) - 1, 0)
+        b       = int(np.searchsorted(index_ts, ts_hi, side="right"))
+        first   = index[a][1]
+        last    = index[b][1] if b < len(index) else None                                 # None: up to the end of the file
+        wanted  = ["timestamp"] + [name for name in names if name != "timestamp"]
+        if entry["format"] == "txt":
+            with open(path, "rb") as file:
+                file.seek(first)
+                segment = file.read(-1 if last is None else last - first)
+            table   = np.loadtxt(io.BytesIO(segment), delimiter=",", usecols=[text_columns[name] for name in wanted], ndmin=2)
+            return {name: table[:, i] for i, name in enumerate(wanted)}
+        if entry["format"] == "pico":
+            reader  = BinaryReader(path)
+            return {name: np.asarray(reader.rows(name, first, last)) for name in wanted}
+        return {name: _root_column(path, name, first, last) for name in wanted}
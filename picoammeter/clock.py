@@ -0,0 +1,98 @@
+import threading
+
+import numpy as np
+
+from picoammeter.frames import FRAME_SIZE, FrameSync, decode_frames
+
+
+class ClockFit:
+    # Drift of the PICO clock against the host clock, fitted over the run on (timestamp, host receive time) pairs:
+    #   host time = offset + (1 + drift)*timestamp*dt
+    # A frame is received after it is produced, so only the earliest arrival of every bin_seconds of PICO time is kept
+    # (the lower envelope of the latency) and the line is lowered to pass below all these points.
+    # The drift is fitted once min_span seconds are covered, before the latency jitter would dominate it.
+    # At most max_points are kept: beyond, the bins are merged two by two, the memory stays flat on long runs.
+    # add() and fit() hold a lock: the sinks and the segment thread read the fit while the acquisition adds points.
+    def __init__(self, dt=1e-4, bin_seconds=1.0, max_points=4096, min_span=60.0):
+        self.dt             = dt
+        self.bin_seconds    = bin_seconds
+        self.max_points     = max_points
+        self.min_span       = min_span
+        self.bins           = np.zeros(0, dtype=np.int64)
+        self.pico           = np.zeros(0)                                                   # PICO time of the kept points, seconds since timestamp 0
+        self.latency        = np.zeros(0)                                                   # host time - PICO time
+        self._fit           = None
+        self.lock           = threading.Lock()
+
+    def add(self, timestamps, host_times):
+        # timestamps (n,) increasing, in units of dt, and the host time each of them was received (n,) or one for all
+        pico        = np.asarray(timestamps, dtype=np.float64)*self.dt
+        if len(pico) == 0:
+            return
+        with self.lock:
+            latency     = np.broadcast_to(np.asarray(host_times, dtype=np.float64), pico.shape) - pico
+            bins        = np.concatenate([self.bins, np.floor(pico/self.bin_seconds).astype(np.int64)])
+            pico        = np.concatenate([self.pico, pico])
+            latency     = np.concatenate([self.latency, latency])
+            order       = np.lexsort((latency, bins))                                       # earliest arrival first in every bin
+            first       = order[np.concatenate([[True], np.diff(bins[order]) != 0])]
+            self.bins, self.pico, self.latency = bins[first], pico[first], latency[first]
+            while len(self.bins) > self.max_points:
+                self.bin_seconds   *= 2
+                self.bins          //= 2
+                order       = np.lexsort((self.latency, self.bins))
+                first       = order[np.concatenate([[True], np.diff(self.bins[order]) != 0])]
+                self.bins, self.pico, self.latency = self.bins[first], self.pico[first], self.latency[first]
+            self._fit   = None
+
+    def fit(self):
+        # (offset, drift), None before the first point; drift is 0 until min_span seconds are covered
+        with self.lock:
+            if len(self.pico) == 0:
+                return None
+            if self._fit is None:
+                if len(self.pico) < 2 or self.pico[-1] - self.pico[0] < self.min_span:
+                    drift, intercept = 0.0, 0.0
+                else:
+                    drift, intercept = np.polyfit(self.pico - self.pico[0], self.latency, 1)
+                    intercept       -= drift*self.pico[0]
+                offset      = intercept + float(np.min(self.latency - (intercept + drift*self.pico)))
+                self._fit   = (float(offset), float(drift))
+            return self._fit
+
+    def times(self, timestamps):
+        # host time (unix seconds) of every timestamp
+        offset, drift = self.fit()
+        return offset + (1 + drift)*np.asarray(timestamps, dtype=np.float64)*self.dt
+
+    def absolute_us(self, timestamps):
+        # host time in integer microseconds of every timestamp
+        return np.rint(self.times(timestamps)*1e6).astype(np.int64)
+
+    def to_dict(self):
+        fit = self.fit()
+        return None if fit is None else dict(offset=fit[0], drift=fit[1], points=len(self.pico))
+
+
+def fit_capture(reader, dt=1e-4):
+    # ClockFit of a raw capture: the last frame completed by every chunk and the host time the chunk was received.
+    # The counter is unwrapped from its steps modulo 2**32, it agrees with the EventBuilder timestamps.
+    clock   = ClockFit(dt=dt)
+    sync    = FrameSync()
+    last    = None
+    ts      = []
+    times   = []
+    for host_time, chunk in reader:
+        sync.feed(chunk)
+        block   = sync.extract()
+        if not block:
+            continue
+        if last is None:                                                                    # timestamp 0 is the first frame
+            last, unwrapped = int(decode_frames(block, count=1).timestamp[0]), 0
+        counter     = int(decode_frames(block, offset=len(block) - FRAME_SIZE).timestamp[0])
+        unwrapped  += (counter - last) % 2**32
+        last        = counter
+        ts.append(unwrapped)
+        times.append(host_time)
+    clock.add(np.array(ts), np.array(times))
+    return clock
@@ -0,0 +1,98 @@
+import numpy as np
+
+from picoammeter.events import EventBatch
+
+
+# slow mode filters: pick keeps one event every N as before, the others write one row (two for minmax) per N events #
+filters = ["pick", "mean", "minmax", "cic"]
+
+
+def take(events, rows):
+    # the rows of an EventBatch
+    return EventBatch(*[column[rows] for column in events])
+
+
+def concat(batches):
+    return EventBatch(*[np.concatenate(columns) for columns in zip(*batches)])
+
+
+def select(events, nev0, factor=1, decimator=None):
+    # rows kept (not corrupted; without decimator, one event every factor as the original slow mode) and
+    # rows to write: kept, not averaged on 60 measurements and complete
+    nev     = nev0 + np.arange(len(events.timestamp))
+    keep    = ~events.corrupted if decimator is not None else ~events.corrupted & (nev % factor == 0)
+    write   = keep & ~events.averaged & events.complete
+    return keep, write
+
+
+def make_decimator(factor, mode="mean", order=3, start=0):
+    # None when the events are written as they are: no slow mode, or the original pick
+    if factor <= 1 or mode == "pick":
+        return None
+    return Decimator(factor, mode, order, start)
+
+
+class Decimator:
+    # Streaming decimation by `factor` of the rows selected for writing, every current, voltage and temperature at once:
+    #   mean:   boxcar mean of every block of factor rows
+    #   minmax: two rows per block, the minimum then the maximum of every channel
+    #   cic:    CIC filter of `order` stages, i.e. order boxcars of factor rows in cascade, one row every factor rows
+    # An output row takes the timestamp, labels and kind of the last row of its window (the min row of minmax the timestamp
+    # of the first one) and the frames missed over the last factor rows. Rows are numbered from `start` across calls and
+    # the last rows are kept for the next call, so blocks and filter state carry over across chunks; a row is produced
+    # once its whole window has been seen, the first order-1 blocks of cic are the filter transient and give no row.
+    def __init__(self, factor, mode="mean", order=3, start=0):
+        if mode not in filters[1:]:
+            raise ValueError("Unknown decimation filter {}, choose among {}".format(mode, filters[1:]))
+        self.factor     = factor
+        self.mode       = mode
+        self.order      = order if mode == "cic" else 1
+        self.window     = self.order*(factor - 1) + 1                                       # rows behind one output
+        self.kernel     = np.ones(1)
+        for _ in range(self.order):
+            self.kernel = np.convolve(self.kernel, np.ones(factor)/factor)
+        self.count      = start                                                             # rows seen, the next row is number count
+        self.kept       = None                                                              # last window-1 rows
+
+    def process(self, events, mask):
+        # decimated events of the rows selected by mask, and the mask to write all of them
+        rows        = take(events, np.flatnonzero(mask))
+        seen        = self.count
+        self.count += len(rows.timestamp)
+        if self.kept is not None:
+            rows    = concat([self.kept, rows])
+        first       = self.count - len(rows.timestamp)                                      # number of rows[0]
+        self.kept   = take(rows, slice(max(0, len(rows.timestamp) - (self.window - 1)), None))
+
+        # ends of the windows that are complete and were not produced yet #
+        ends        = np.arange(max(seen, first + self.window - 1), self.count)
+        ends        = ends[ends % self.factor == self.factor - 1] - first                   # positions in rows
+        values      = np.concatenate([rows.curr, rows.volt, rows.temp], axis=1)
+        missed      = np.concatenate([[0], np.cumsum(np.maximum(rows.missed, 0))])
+        period      = missed[ends + 1] - missed[np.maximum(ends + 1 - self.factor, 0)]
+        if self.mode == "cic":                                                              # the cascade is one FIR filter, applied at the output rows only
+            out     = np.zeros((len(ends), values.shape[1]))
+            for j, weight in enumerate(self.kernel):
+                out += weight*values[ends - (self.window - 1) + j]
+            return self._rows(rows, ends, out, period), np.ones(len(ends), dtype=bool)
+        blocks      = values[ends[:, None] - np.arange(self.factor)[::-1]]                      # (blocks, factor, channels)
+        if self.mode == "mean":
+            return self._rows(rows, ends, blocks.mean(axis=1), period), np.ones(len(ends), dtype=bool)
+        low         = self._rows(rows, ends, blocks.min(axis=1), period, at=ends - (self.factor - 1))
+        high        = self._rows(rows, ends, blocks.max(axis=1), np.zeros_like(period))
+        order       = np.arange(2*len(ends)).reshape(2, -1).T.reshape(-1)                    # min and max of every block in turn
+        return take(concat([low, high]), order), np.ones(2*len(ends), dtype=bool)
+
+    def _rows(self, rows, ends, values, missed, at=None):
+        nch = rows.curr.shape[1]
+        n   = len(ends)
+        return EventBatch(timestamp = rows.timestamp[ends if at is None else at],
+                          curr      = values[:, :nch],
+                          volt      = values[:, nch:2*nch],
+                          temp      = values[:, 2*nch:],
+                          labels    = rows.labels[ends],
+                          kind      = rows.kind[ends],
+                          corrupted = np.zeros(n, dtype=bool),
+                          averaged  = np.zeros(n, dtype=bool),
+                          complete  = np.ones(n, dtype=bool),
+                          missed    = missed.astype(np.int64))
@@ -0,0 +1,57 @@
+import json
+import os
+import socket
+
+
+# Connection and calibration settings of every PICO #
+devices = {
+    "pico3": {"host": "picouart03.na.infn.it",  "port": 23, "com": "COM7",  "calibration": "pico5"},   # no pico3 calibration yet, the pico5 one is used
+    "pico4": {"host": "picouart04.na.infn.it",  "port": 23, "com": "COM7",  "calibration": "pico4"},   # admin=admin, password=PASSWORD
+    "pico5": {"host": "picouart05.na.infn.it",  "port": 23, "com": "COM8",  "calibration": "pico5"},   # admin=admin, password=PASSWORD
+    "sim":   {"host": "localhost",              "port": 2323, "com": "/tmp/pico_sim", "calibration": "pico5"},  # Pico_simulator.py, --pty /tmp/pico_sim for the serial stand-in
+}
+baudrate            = 2_000_000
+calibration_folder  = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "calibrations")
+profiles_variable   = "PICO_DEVICES"                                                        # environment variable with the path of a JSON file of device profiles
+
+
+def load_devices(path):
+    # add or replace device profiles from a JSON file, e.g. {"pico6": {"host": "picouart06.na.infn.it", "port": 23,
+    # "com": "/dev/ttyUSB0", "calibration": "pico5"}}; "baudrate" and "calibration_folder" can be given too. The names loaded.
+    with open(path, "r") as file:
+        profiles = json.load(file)
+    for name, profile in profiles.items():
+        devices[name] = dict(devices.get(name, {}), **profile)
+    return list(profiles)
+
+
+if os.environ.get(profiles_variable):                                                       # before any script lists the devices in its -d choices
+    load_devices(os.environ[profiles_variable])
+
+
+def load_calibration(pico, folder=None):
+    # dictionaries with the calibration parameters of a PICO, read from <folder>/<calibration>/, by default the folder of its profile
+    name    = devices[pico]["calibration"]
+    folder  = folder or devices[pico].get("calibration_folder", calibration_folder)
+    with open(os.path.join(folder, name, "{}_Calibration_Voltage.json".format(name)), "r") as file:
+        CalVoltage = json.load(file)
+    with open(os.path.join(folder, name, "{}_Calibration_Current.json".format(name)), "r") as file:
+        CalCurrent = json.load(file)
+    return CalVoltage, CalCurrent
+
+
+def connection_settings(pico, do_serial):
+    # hostName, portNumber, baudrate as expected by connect_to_pico
+    if do_serial:
+        return None, devices[pico]["com"], devices[pico].get("baudrate", baudrate)
+    return devices[pico]["host"], devices[pico]["port"], None
+
+
+def connect_to_pico(do_serial, host, port, baud):
+    # open the TCP/IP socket or the serial port, errors are left to the caller
+    if do_serial:
+        import serial
+        return serial.Serial(port, baud)                                                    # connect to the serial port
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)                                   # create a TCP/IP socket
+    s.connect((host, port))                                                                 # connect to the server
+    return s
@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from picoammeter.frames import ticks_per_frame
+
+
+levels = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+
+class EventLog(threading.Thread):
+    # Diagnostics of a run as JSON lines, formatted and written by this thread: the acquisition only queues the records.
+    #   info/warning/error(message, **fields)   one record
+    #   events(...)                             one debug record every `every` events (0 for none), and a warning for every
+    #                                           anomaly: corrupted frame, timestamp step other than ticks_per_frame, time flag flip
+    # When more than max_pending records wait, the oldest are dropped and counted.
+    def __init__(self, path, level="debug", every=100, max_pending=100000, flush_interval=1.0):
+        super().__init__(name="pico-log", daemon=True)
+        self.path           = path
+        self.level          = levels[level]
+        self.every          = every
+        self.flush_interval = flush_interval
+        self.file           = open(path, "w")
+        self.pending        = deque()
+        self.max_pending    = max_pending
+        self.wakeup         = threading.Condition()
+        self.stopping       = False
+        self.records        = 0
+        self.dropped        = 0
+        self.last_timestamp = None
+        self.last_time_flag = None
+
+    def log(self, level, message, **fields):
+        if levels[level] >= self.level:
+            self._queue(("message", time.time(), level, message, fields))
+
+    def info(self, message, **fields):
+        self.log("info", message, **fields)
+
+    def warning(self, message, **fields):
+        self.log("warning", message, **fields)
+
+    def error(self, message, **fields):
+        self.log("error", message, **fields)
+
+    def events(self, events, batch, written, nev0):
+        # select the events to log with array operations, their rows are formatted later by the thread
+        n = len(events.timestamp)
+        if n == 0:
+            return
+        ts      = events.timestamp
+        flags   = events.labels[:, 0]
+        prev_ts = ts[0] - ticks_per_frame if self.last_timestamp is None else self.last_timestamp
+        prev_fl = flags[0] if self.last_time_flag is None else self.last_time_flag
+        step    = np.diff(ts, prepend=prev_ts)
+        flip    = flags != np.concatenate([[prev_fl], flags[:-1]])
+        self.last_timestamp, self.last_time_flag = ts[-1], flags[-1]
+        anomaly = events.corrupted | (step != ticks_per_frame) | flip
+        select  = np.zeros(n, dtype=bool)
+        if self.level <= levels["warning"]:
+            select |= anomaly
+        if self.level <= levels["debug"] and self.every:
+            select |= (nev0 + np.arange(n)) % self.every == 0
+        rows    = np.flatnonzero(select)
+        if len(rows) == 0:
+            return
+        self._queue(("events", time.time(), nev0 + rows, ts[rows], events.labels[rows], batch.timestamp[rows], batch.values[rows],
+                     events.curr[rows], events.volt[rows], events.temp[rows], written[rows], events.corrupted[rows], step[rows], flip[rows]))
+
+    def close(self):
+        with self.wakeup:
+            self.stopping = True
+            self.wakeup.notify()
+        if self.is_alive():
+            self.join()
+        else:
+            self._write(list(self.pending))
+        self.file.close()
+
+    def _queue(self, item):
+        with self.wakeup:
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append(item)
+
+    def run(self):
+        while True:
+            with self.wakeup:
+                if not self.stopping:
+                    self.wakeup.wait(self.flush_interval)
+                items, self.pending = list(self.pending), deque()
+                stopping = self.stopping
+            self._write(items)
+            if stopping:
+                return
+
+    def _write(self, items):
+        lines = []
+        for item in items:
+            if item[0] == "message":
+                _, t, level, message, fields = item
+                lines.append(json.dumps(dict({"t": round(t, 6), "level": level, "msg": message}, **fields), default=str))
+                continue
+            _, t, nev, ts, labels, raw_ts, values, curr, volt, temp, written, corrupted, step, flip = item
+            for i in range(len(nev)):
+                reasons = [r for r, bad in [("corrupted", corrupted[i]), ("step", step[i] != ticks_per_frame), ("time_flag_flip", flip[i])] if bad]
+                record  = {"t": round(t, 6), "level": "warning" if reasons else "debug", "msg": "event", "nev": int(nev[i]),
+                           "timestamp": int(ts[i]), "raw_timestamp": int(raw_ts[i]), "labels": b"".join(labels[i].tolist()).decode(errors="replace"),
+                           "values": values[i].tolist(), "curr": curr[i].tolist(), "volt": volt[i].tolist(), "temp": temp[i].tolist(),
+                           "written": bool(written[i])}
+                if reasons:
+                    record.update(anomaly=reasons, step=int(step[i]))
+                lines.append(json.dumps(record))
+        if lines:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+        self.records += len(lines)
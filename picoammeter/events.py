@@ -0,0 +1,149 @@
+from collections import namedtuple
+
+import numpy as np
+
+from picoammeter.frames import channel_map, corrupted_frames, ticks_per_frame
+
+
+# what a frame carries #
+KIND_NONE           = 0                                                                     # corrupted, averaged (p/m) or unknown frame
+KIND_TEMP           = 1
+KIND_VOLT           = 2
+KIND_CURR           = 3
+
+# the time flag of a frame that is not corrupted #
+known_flags         = [b'W', b'w']
+
+# after a reconnection, how much further than the host clock allows the counter may jump before it counts as restarted #
+restart_slack       = 400*ticks_per_frame                                                   # one second at 400 Hz
+
+# one row per frame: the timestamp, the last known current, voltage and temperature of every channel, the frame labels
+#   timestamp (n,) in units of dt; curr, volt, temp (n,7); labels (n,8) time_flag first; corrupted, averaged, complete (n,); kind (n,)
+#   missed (n,): frames lost just before this one, -1 if the PICO counter went backward or repeated, see missed_frames()
+EventBatch          = namedtuple("EventBatch", ["timestamp", "curr", "volt", "temp", "labels", "kind", "corrupted", "averaged", "complete", "missed"])
+
+
+class EventBuilder:
+    # Rebuild events from decoded frames: timestamp, conversion to physical data, last known I/V/T of every channel #
+    def __init__(self, calibration, convert_volt=True, convert_curr=True, convert_temp=True):
+        self.calibration        = calibration
+        self.convert_volt       = convert_volt
+        self.convert_curr       = convert_curr
+        self.convert_temp       = convert_temp
+        self.nev                = 0
+        self.count_time_flip    = 0
+        self.count_I            = 0
+        self.count_V            = 0
+        self.ts0                = None
+        self.last_time_flag     = None
+        self.last_timestamp     = None                                                      # PICO counter of the last frame
+        self.gap_ticks          = None                                                      # set by rebase() until the next frame
+        self.restarts           = 0                                                         # PICO counters restarted after a reconnection
+        self.curr               = np.zeros(len(channel_map))
+        self.volt               = np.zeros(len(channel_map))
+        self.temp               = np.zeros(len(channel_map))
+
+    def process(self, batch):
+        n           = len(batch.timestamp)
+        corrupted   = corrupted_frames(batch)
+        labels      = np.concatenate([batch.time_flag.reshape(-1, 1), batch.labels], axis=1)
+        if n == 0:
+            empty = np.zeros((0, len(channel_map)))
+            return EventBatch(np.zeros(0, dtype=np.int64), empty, empty, empty, labels, np.zeros(0, dtype=np.uint8), corrupted, corrupted, corrupted,
+                              np.zeros(0, dtype=np.int64))
+
+        # unwrap the 32 bit counter with the time flag, which switches (b'W' <-> b'w') at every wrap #
+        if self.nev == 0:
+            self.ts0            = int(batch.timestamp[0])                                                       # get the first time stamp
+        elif self.gap_ticks is not None:
+            self._rebase(int(batch.timestamp[0]))
+        if self.last_time_flag not in known_flags:                                                              # get the first time_flag, skipping J/D
+            known               = batch.time_flag[np.isin(batch.time_flag, known_flags)]
+            self.last_time_flag = known[0] if len(known) else batch.time_flag[0]                                # none yet: no switch until one comes
+        time_flag   = _known_flag(batch.time_flag, self.last_time_flag)                                         # a corrupted flag (J/D) is not a switch
+        flipped     = time_flag != np.concatenate([[self.last_time_flag], time_flag[:-1]])
+        flips       = self.count_time_flip + np.cumsum(flipped)                                                 # the frame with the new flag is the first after the wrap
+        timestamp   = batch.timestamp.astype(np.int64) - self.ts0 + flips*2**32                                 # normalized to the first timestamp, so ts[0]=0, ts[1]=25, ..., then one full counter per wrap
+        self.count_time_flip   += int(np.count_nonzero(flipped))
+        self.last_time_flag     = time_flag[-1]
+        missed      = missed_frames(batch.timestamp, self.last_timestamp)                                       # lost frames and link stalls, from the 32 bit counter
+        self.last_timestamp     = int(batch.timestamp[-1])
+
+        # conversion to physical data #
+        has         = lambda *wanted: np.isin(labels, wanted).any(axis=1)
+        is_temp     = ~corrupted & has(b'T')                                                                    # check if the data is a temperature
+        is_volt     = ~corrupted & ~is_temp & has(b'V')                                                         # check if the data is voltage
+        is_curr     = ~corrupted & ~is_temp & ~is_volt & has(b'i', b'I')                                        # check if the data is a current
+        kind        = np.zeros(n, dtype=np.uint8)
+        kind[is_temp], kind[is_volt], kind[is_curr] = KIND_TEMP, KIND_VOLT, KIND_CURR
+
+        values      = batch.values.astype(np.float64)
+        new_temp    = self.calibration.temp(values[is_temp]) if self.convert_temp else values[is_temp]
+        new_volt    = self.calibration.volt(values[is_volt]) if self.convert_volt else values[is_volt]
+        new_curr    = self.calibration.curr(values[is_curr], batch.labels[is_curr]) if self.convert_curr else values[is_curr]
+        temp, self.temp = _last_known(self.temp, is_temp, new_temp)
+        volt, self.volt = _last_known(self.volt, is_volt, new_volt)
+        curr, self.curr = _last_known(self.curr, is_curr, new_curr)
+
+        count_V     = self.count_V + np.cumsum(is_volt)
+        count_I     = self.count_I + np.cumsum(is_curr)
+        self.count_V, self.count_I = int(count_V[-1]), int(count_I[-1])
+        self.nev   += n
+
+        return EventBatch(timestamp = timestamp,
+                          curr      = curr,
+                          volt      = volt,
+                          temp      = temp,
+                          labels    = labels,
+                          kind      = kind,
+                          corrupted = corrupted,
+                          averaged  = has(b'p', b'P', b'm', b'M'),                                              # data averaged on 60 measurements
+                          complete  = (count_I > 0) & (count_V > 0),
+                          missed    = missed)
+
+
+    def rebase(self, ticks):
+        # The next frames come from a new connection, `ticks` of PICO clock after the last frame by the host clock.
+        # If the PICO restarted meanwhile, its counter does not follow the last one: the timestamps then go on from
+        # the last one plus ticks, and the first frame misses the frames that fit in them.
+        if self.nev:
+            self.gap_ticks = max(int(ticks), ticks_per_frame)
+
+    def _rebase(self, first):
+        step = (first - self.last_timestamp + 2**31) % 2**32 - 2**31                       # as in missed_frames()
+        if step <= 0 or step > 2*self.gap_ticks + restart_slack:
+            self.ts0               += first - self.last_timestamp - self.gap_ticks
+            self.last_timestamp     = (first - self.gap_ticks) % 2**32
+            self.last_time_flag     = None                                                  # the new counter has its own flag
+            self.restarts          += 1
+        self.gap_ticks = None
+
+
+def missed_frames(timestamp, last=None, ticks=ticks_per_frame):
+    # frames missed before every frame, from the step of the 32 bit PICO counter modulo 2**32 (the wrap needs no time flag):
+    # round(step/ticks) - 1, 0 for a step shorter than one frame, -1 for a step <= 0.
+    # last is the counter of the frame before the first one, None at the start of the run.
+    ts      = np.asarray(timestamp, dtype=np.int64)
+    if len(ts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    prev    = np.concatenate([[ts[0] if last is None else last], ts[:-1]])
+    step    = (ts - prev + 2**31) % 2**32 - 2**31                                           # signed distance between two counters
+    missed  = np.maximum(np.rint(step/ticks), 1).astype(np.int64) - 1
+    missed[step <= 0] = -1
+    if last is None:
+        missed[0] = 0
+    return missed
+
+
+def _known_flag(time_flag, last):
+    # the time flag of every frame, the last W/w before it where the flag is neither
+    known   = np.isin(time_flag, known_flags)
+    idx     = np.maximum.accumulate(np.where(known, np.arange(len(time_flag)), -1))
+    return np.where(idx >= 0, time_flag[np.maximum(idx, 0)], last)
+
+
+def _last_known(last, mask, new_rows):
+    # row i is the last of new_rows at or before i (new_rows are the rows where mask is set), last before the first one
+    table = np.concatenate([last.reshape(1, -1), new_rows])
+    rows  = table[np.cumsum(mask)]
+    return rows, table[-1]
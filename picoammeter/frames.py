@@ -0,0 +1,114 @@
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+
+channel_map     = ["G3B","G3T","G2B","G2T","G1B","G1T","DRIFT"]
+frameTemplate   = struct.Struct(">5s cI ci ci ci ci ci ci ci 5s")                           # c=char, i=int, s=char[], ">" big endian (most significant byte first)
+FRAME_SIZE      = frameTemplate.size
+FRAME_START     = b"START"
+FRAME_END       = b"/END/"
+ticks_per_frame = 25                                                                        # timestamp step between two frames at 400 Hz, dt = 1e-4 s
+
+# Same layout as frameTemplate: packed, big endian, the 7 (label, value) pairs as a sub-array #
+frame_dtype     = np.dtype([("start",       "S5"),
+                            ("time_flag",   "S1"),
+                            ("timestamp",   ">u4"),
+                            ("channels",    [("label", "S1"), ("value", ">i4")], (len(channel_map),)),
+                            ("end",         "S5")])
+assert frame_dtype.itemsize == FRAME_SIZE
+
+# time_flag (n,), timestamp (n,), labels (n,7), values (n,7), valid (n,)
+FrameBatch      = namedtuple("FrameBatch", ["time_flag", "timestamp", "labels", "values", "valid"])
+
+
+def decode_frames(buffer, offset=0, count=-1):
+    # decode a buffer of aligned frames in one call, count=-1 takes all the complete frames after offset
+    if count < 0:
+        count = (memoryview(buffer).nbytes - offset) // FRAME_SIZE
+    frames = np.frombuffer(buffer, dtype=frame_dtype, count=count, offset=offset)
+    # the arrays are copied to native byte order, so no view keeps the input buffer alive
+    return FrameBatch(time_flag = frames["time_flag"].copy(),
+                      timestamp = frames["timestamp"].astype(np.uint32),
+                      labels    = frames["channels"]["label"].copy(),
+                      values    = frames["channels"]["value"].astype(np.int32),
+                      valid     = (frames["start"] == FRAME_START) & (frames["end"] == FRAME_END))
+
+
+def corrupted_frames(batch):
+    # data must be trashed if a "J" or a "D" is found in the frame
+    trash = [b"J", b"D"]
+    return np.isin(batch.time_flag, trash) | np.isin(batch.labels, trash).any(axis=1)
+
+
+def frame_to_line(batch, i):
+    # labels and values of the i-th frame as python objects, time flag and time stamp first
+    labels = batch.time_flag[i:i+1].tolist() + batch.labels[i].tolist()
+    values = [int(batch.timestamp[i])]       + batch.values[i].tolist()
+    return labels, values
+
+
+class FrameSync:
+    # Cut a byte stream into aligned frames: the buffer is scanned with a read offset and find(), never re-sliced per frame #
+    lookahead = 256                                                                         # max number of frames checked at once for alignment
+
+    def __init__(self):
+        self.buffer             = bytearray()
+        self.pos                = 0                                                         # read offset in the buffer
+        self.frames_found       = 0
+        self.frames_rejected    = 0                                                         # START without /END/ at the end of the frame
+        self.bytes_skipped      = 0                                                         # bytes dropped to resync on START
+
+    def __len__(self):
+        return len(self.buffer) - self.pos
+
+    def feed(self, data):
+        self.buffer += data
+
+    def reset(self):
+        # drop the bytes not framed yet, e.g. the frame cut by a lost connection, counted as skipped
+        self.bytes_skipped     += len(self)
+        self.buffer.clear()
+        self.pos                = 0
+
+    def extract(self):
+        # return all the complete frames in the buffer as one contiguous block of aligned frames
+        runs = []
+        while len(self.buffer) - self.pos >= FRAME_SIZE:
+            if not self.buffer.startswith(FRAME_START, self.pos):
+                self._resync()
+                continue
+            n = self._aligned_run()
+            if n == 0:                                                                      # START found in the data, but it is not a frame boundary
+                self.frames_rejected    += 1
+                self.bytes_skipped      += 1
+                self.pos                += 1
+                continue
+            if runs and runs[-1][1] == self.pos:
+                runs[-1][1] += n*FRAME_SIZE
+            else:
+                runs.append([self.pos, self.pos + n*FRAME_SIZE])
+            self.pos            += n*FRAME_SIZE
+            self.frames_found   += n
+
+        with memoryview(self.buffer) as view:
+            block = b"".join([view[a:b] for a, b in runs])
+        del self.buffer[:self.pos]                                                          # bytearray drops its head in place, no copy of the whole buffer
+        self.pos = 0
+        return block
+
+    def _resync(self):
+        idx = self.buffer.find(FRAME_START, self.pos)
+        if idx < 0:                                                                         # keep the tail, it can hold the beginning of the next START
+            idx = max(self.pos, len(self.buffer) - len(FRAME_START) + 1)
+        self.bytes_skipped     += idx - self.pos
+        self.pos                = idx
+
+    def _aligned_run(self):
+        # number of consecutive well-formed frames starting at the read offset
+        n       = min((len(self.buffer) - self.pos) // FRAME_SIZE, self.lookahead)
+        frames  = np.frombuffer(self.buffer, dtype=frame_dtype, count=n, offset=self.pos)
+        good    = (frames["start"] == FRAME_START) & (frames["end"] == FRAME_END)
+        del frames                                                                          # release the buffer export, the bytearray must stay resizable
+        return n if good.all() else int(np.argmin(good))
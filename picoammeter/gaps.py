@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+
+from picoammeter.binary import BinaryReader
+from picoammeter.capture import CaptureReader
+from picoammeter.events import missed_frames
+from picoammeter.frames import FrameSync, channel_map, decode_frames, ticks_per_frame
+
+
+# type of the frame that follows a gap, from its labels (time flag first), in the order the EventBuilder decides it #
+frame_types = ["current", "voltage", "temperature", "averaged", "corrupted", "other"]
+
+# bins of the number of frames missed in one gap #
+gap_bins    = [1, 2, 3, 4, 6, 11, 101, 1001, 10001]
+gap_labels  = ["1", "2", "3", "4-5", "6-10", "11-100", "101-1000", "1001-10000", ">10000"]
+read_size   = 32 << 20                                                                      # bytes of a .raw capture framed at once
+
+
+def frame_type(labels):
+    # index in frame_types of every frame, labels (n,8) with the time flag first
+    has     = lambda *wanted: np.isin(labels, wanted).any(axis=1)
+    types   = np.full(len(labels), frame_types.index("other"), dtype=np.int64)
+    types[has(b"i", b"I")]              = frame_types.index("current")
+    types[has(b"V")]                    = frame_types.index("voltage")
+    types[has(b"T")]                    = frame_types.index("temperature")
+    types[has(b"p", b"P", b"m", b"M")]  = frame_types.index("averaged")
+    types[has(b"J", b"D")]              = frame_types.index("corrupted")
+    return types
+
+
+class GapStats:
+    # Frames missed by the acquisition, counted from the `missed` column of the events (see events.missed_frames):
+    # total, number of gaps, histogram of the gap lengths per type of the frame after the gap, counter going backward,
+    # and the row and length of the first `keep` gaps.
+    def __init__(self, keep=1000):
+        self.frames     = 0
+        self.missed     = 0
+        self.backward   = 0
+        self.largest    = 0
+        self.histogram  = np.zeros((len(frame_types), len(gap_bins)), dtype=np.int64)
+        self.gaps       = []                                                                # (row, missed)
+        self.keep       = keep
+
+    def add(self, missed, types, first_row=0):
+        # missed (n,) and types (n,) of consecutive rows, first_row is the row of missed[0] in the run
+        gap             = missed > 0
+        self.frames    += len(missed)
+        self.backward  += int(np.count_nonzero(missed < 0))
+        if not gap.any():
+            return
+        lengths         = missed[gap]
+        self.missed    += int(lengths.sum())
+        self.largest    = max(self.largest, int(lengths.max()))
+        np.add.at(self.histogram, (types[gap], np.searchsorted(gap_bins, lengths, side="right") - 1), 1)
+        rows            = np.flatnonzero(gap)[:max(0, self.keep - len(self.gaps))]
+        self.gaps      += list(zip((first_row + rows).tolist(), missed[rows].tolist()))
+
+    def add_events(self, events, first_row=0):
+        self.add(events.missed, frame_type(events.labels), first_row)
+
+    def summary(self):
+        expected = self.frames + self.missed
+        return dict(frames=self.frames, missed=self.missed, gaps=int(self.histogram.sum()), backward=self.backward, largest=self.largest,
+                    loss=self.missed/expected if expected else 0.0,
+                    histogram={name: {label: int(n) for label, n in zip(gap_labels, row) if n} for name, row in zip(frame_types, self.histogram) if row.any()},
+                    first_gaps=self.gaps)
+
+    def report(self):
+        summary = self.summary()
+        lines   = ["frames checked:                              {}".format(summary["frames"]),
+                   "frames missed (gaps):                        {} ({}), {:.4%} of the frames".format(summary["missed"], summary["gaps"], summary["loss"]),
+                   "largest gap:                                 {} frames ({:.4f} s)".format(summary["largest"], summary["largest"]*ticks_per_frame*1e-4),
+                   "counter going backward or repeating:         {}".format(summary["backward"])]
+        if summary["gaps"]:
+            lines.append("gaps per type of the next frame:             " + " ".join("{:>10}".format(label) for label in gap_labels))
+            for name, row in zip(frame_types, self.histogram):
+                if row.any():
+                    lines.append("    {:<41}{}".format(name, " ".join("{:>10}".format(n) for n in row)))
+        return "\n".join(lines)
+
+
+def analyze(path, keep=1000):
+    # GapStats of a file: every frame of a .raw capture, or the rows of a .pico/.txt/.root output.
+    # Outputs written before the `missed` column existed only hold the written rows: the gaps are then estimated from the
+    # timestamp step, in units of the most common step, and rows that were not written (averaged, corrupted) count as missed.
+    stats   = GapStats(keep=keep)
+    fmt     = os.path.splitext(path)[1][1:]
+    if fmt == "raw":
+        reader  = CaptureReader(path)
+        sync    = FrameSync()
+        last    = None
+        for start in range(0, len(reader), read_size):
+            sync.feed(reader.read(start, min(start + read_size, len(reader))))
+            batch   = decode_frames(sync.extract())
+            labels  = np.concatenate([batch.time_flag.reshape(-1, 1), batch.labels], axis=1)
+            stats.add(missed_frames(batch.timestamp, last), frame_type(labels), stats.frames)
+            last    = int(batch.timestamp[-1]) if len(batch.timestamp) else last
+        reader.close()
+        return stats
+    if fmt == "pico":
+        reader  = BinaryReader(path)
+        ts      = reader["timestamp"]
+        missed  = reader["missed"] if "missed" in reader.names else None
+        labels  = np.stack([reader[name] for name in ["time_flag"] + ["label_{}".format(ch) for ch in channel_map]], axis=1).view("S1")
+    elif fmt == "txt":
+        with open(path, "r") as file:
+            header = file.readline().strip().split(",")
+        names   = ["time_flag"] + ["label_{}".format(ch) for ch in channel_map]
+        table   = np.loadtxt(path, delimiter=",", skiprows=1, dtype=str, ndmin=2,
+                             usecols=[0] + [header.index(name) for name in names] + ([header.index("missed")] if "missed" in header else []))
+        ts      = table[:, 0].astype(np.int64)
+        labels  = np.char.encode(np.char.replace(np.char.replace(table[:, 1:9], "b'", ""), "'", "")).astype("S1")   # written as b'I'
+        missed  = table[:, 9].astype(np.int64) if "missed" in header else None
+    elif fmt == "root":
+        from picoammeter.catalog import _root_column
+        ts      = _root_column(path, "timestamp").astype(np.int64)
+        try:
+            missed = _root_column(path, "missed").astype(np.int64)
+        except Exception:                                                                   # written before the missed branch existed
+            missed = None
+        labels  = np.full((len(ts), 1 + len(channel_map)), b"?", dtype="S1")                # no labels in the .root files
+    else:
+        raise ValueError("unknown format of {}".format(path))
+    if missed is None:
+        step    = np.diff(ts, prepend=ts[:1])
+        unit    = int(np.median(step[step > 0])) if (step > 0).any() else ticks_per_frame
+        missed  = missed_frames(ts % 2**32, ticks=unit)
+    stats.add(np.asarray(missed, dtype=np.int64), frame_type(labels))
+    return stats
@@ -0,0 +1,132 @@
+import threading
+import urllib.parse
+from collections import deque
+
+import numpy as np
+
+from picoammeter.events import KIND_CURR, KIND_TEMP, KIND_VOLT
+from picoammeter.frames import channel_map
+
+
+# measurement, field prefix, EventBatch column, kind of the frames that carry it #
+quantities = [("current_measurement",      "I", "curr", KIND_CURR),
+              ("voltage_measurement",      "V", "volt", KIND_VOLT),
+              ("temperature_measurement",  "T", "temp", KIND_TEMP)]
+
+
+class WindowAggregator:
+    # mean, min and max of every channel over fixed time windows, for the frames of one kind #
+    def __init__(self, measurement, prefix, window_us):
+        self.measurement    = measurement
+        self.fields         = ["{}_{}".format(prefix, ch) for ch in channel_map]
+        self.window_us      = window_us
+        self.open           = None                                                          # [window, count, sum, min, max] of the window still receiving data
+
+    def add(self, times_us, values):
+        # times_us (n,) increasing, values (n,7); returns the windows closed by these values
+        if len(times_us) == 0:
+            return []
+        window          = times_us // self.window_us
+        starts          = np.flatnonzero(np.diff(window, prepend=window[0] - 1))
+        counts          = np.diff(np.append(starts, len(window)))
+        sums            = np.add.reduceat(values, starts)
+        mins            = np.minimum.reduceat(values, starts)
+        maxs            = np.maximum.reduceat(values, starts)
+        windows         = [[window[a], counts[k], sums[k], mins[k], maxs[k]] for k, a in enumerate(starts)]
+        if self.open is not None:
+            if self.open[0] == windows[0][0]:                                               # same window as the previous batch: merge
+                w = windows[0]
+                windows[0] = [w[0], w[1] + self.open[1], w[2] + self.open[2], np.minimum(w[3], self.open[3]), np.maximum(w[4], self.open[4])]
+            else:
+                windows.insert(0, self.open)
+        self.open       = windows.pop()
+        return windows
+
+    def flush(self):
+        windows, self.open = ([self.open] if self.open is not None else []), None
+        return windows
+
+    def lines(self, windows, tags=""):
+        # line protocol, one point per window at the beginning of the window, microsecond precision
+        out = []
+        for window, count, sums, mins, maxs in windows:
+            mean    = sums / count
+            fields  = ",".join("{0}={1!r},{0}_min={2!r},{0}_max={3!r}".format(name, float(mean[i]), float(mins[i]), float(maxs[i])) for i, name in enumerate(self.fields))
+            out.append("{}{} {} {}".format(self.measurement, tags, fields, int(window)*self.window_us))
+        return out
+
+
+class InfluxSink(threading.Thread):
+    # Send per-window aggregates of I, V and T to InfluxDB (v2 write API): line protocol is built for whole batches
+    # and posted by this thread when batch_size lines are waiting or every flush_interval seconds.
+    def __init__(self, url, token, org, bucket, window=1.0, tags=None, batch_size=500, flush_interval=1.0, max_pending=100000, timeout=5):
+        super().__init__(name="pico-influx", daemon=True)
+        query               = urllib.parse.urlencode({"org": org, "bucket": bucket, "precision": "us"})
+        self.write_url      = "{}/api/v2/write?{}".format(url.rstrip("/"), query)
+        self.headers        = {"Authorization": "Token {}".format(token), "Content-Type": "text/plain; charset=utf-8"}
+        self.tags           = "".join(",{}={}".format(k, v) for k, v in sorted((tags or {}).items()))
+        self.aggregators    = [(column, kind, WindowAggregator(measurement, prefix, int(window*1e6))) for measurement, prefix, column, kind in quantities]
+        self.batch_size     = batch_size
+        self.flush_interval = flush_interval
+        self.timeout        = timeout
+        self.pending        = deque(maxlen=max_pending)                                     # lines waiting to be sent, the oldest are dropped if InfluxDB is unreachable for long
+        self.wakeup         = threading.Condition()
+        self.stopping       = False
+        self.lines_sent     = 0
+        self.lines_dropped  = 0
+        self.requests       = 0
+        self.errors         = 0
+        self.last_error     = None
+
+    def add(self, events, times_us):
+        # aggregate a batch of events, times_us is the absolute time of every event in microseconds
+        lines = []
+        for column, kind, aggregator in self.aggregators:
+            rows = (events.kind == kind) & ~events.corrupted
+            lines += aggregator.lines(aggregator.add(times_us[rows], getattr(events, column)[rows]), self.tags)
+        self._queue(lines)
+
+    def _queue(self, lines):
+        if not lines:
+            return
+        with self.wakeup:
+            self.lines_dropped += max(0, len(self.pending) + len(lines) - self.pending.maxlen)
+            self.pending.extend(lines)
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.notify()
+
+    def close(self):
+        # send the windows still open and everything pending, then stop the thread
+        lines = []
+        for column, kind, aggregator in self.aggregators:
+            lines += aggregator.lines(aggregator.flush(), self.tags)
+        self._queue(lines)
+        with self.wakeup:
+            self.stopping = True
+            self.wakeup.notify()
+        self.join()
+
+    def run(self):
+        while True:
+            with self.wakeup:
+                if not self.stopping and len(self.pending) < self.batch_size:
+                    self.wakeup.wait(self.flush_interval)
+                batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+                stopping = self.stopping
+            if batch:
+                self._post(batch)
+            if stopping and not batch:
+                return
+
+    def _post(self, batch):
+        import urllib.request                                                               # http.client and ssl, only once InfluxDB is used
+        request = urllib.request.Request(self.write_url, data="\n".join(batch).encode(), headers=self.headers, method="POST")
+        self.requests += 1
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+            self.lines_sent += len(batch)
+        except Exception as error:
+            self.errors         += 1
+            self.lines_dropped  += len(batch)
+            self.last_error      = error
@@ -0,0 +1,148 @@
+import socket
+import threading
+import time
+
+from picoammeter.devices import connect_to_pico
+
+
+class Link:
+    # The connection to one PICO, reopened when it dies: an exception while reading, the other side closing the socket
+    # (a read of zero bytes) or nothing received for `stall` seconds (the PICO streams continuously, a terminal server that
+    # rebooted can leave a socket that never returns data). The link is then closed and reopened with exponential backoff,
+    # from `backoff` up to `max_backoff` seconds between attempts, until it succeeds, stop (a threading.Event) is set or
+    # the host time reaches `deadline`, e.g. the end of the acquisition.
+    # Every outage is kept as (start, end, reason), host times, and `generation` counts the connections: the bytes of a
+    # new generation do not continue the frame that was cut, the framing has to be reset before they are fed.
+    # Reading blocks while reconnecting; with a Receiver it is the receiver thread that waits.
+    # With retry=False the first failure is final, as before: open() tries once and a dead link stays closed.
+    def __init__(self, do_serial, host, port, baud, timeout=1.0, stall=10.0, backoff=0.5, max_backoff=30.0, stop=None, retry=True):
+        self.do_serial      = do_serial
+        self.host           = host
+        self.port           = port
+        self.baud           = baud
+        self.timeout        = timeout
+        self.stall          = stall
+        self.backoff        = backoff
+        self.max_backoff    = max_backoff
+        self.stop           = stop
+        self.retry          = retry
+        self.deadline       = None
+        self.interrupted    = threading.Event()                                             # set by interrupt(), e.g. when the receiver stops
+        self.conn           = None
+        self.generation     = 0
+        self.attempts       = 0                                                             # failed connection attempts
+        self.outages        = []                                                            # (start, end, reason)
+        self.down_since     = None
+        self.last_data      = None
+        self.buffer         = None                                                          # reused by read()
+
+    @property
+    def up(self):
+        return self.conn is not None
+
+    @property
+    def down_seconds(self):
+        # time spent without a connection, the current outage included
+        current = time.time() - self.down_since if self.down_since is not None else 0.0
+        return sum(end - start for start, end, _ in self.outages) + current
+
+    def stopped(self):
+        return (self.interrupted.is_set() or (self.stop is not None and self.stop.is_set())
+                or (self.deadline is not None and time.time() >= self.deadline))
+
+    def interrupt(self):
+        self.interrupted.set()
+
+    def open(self):
+        # connect, retrying with backoff; False if stopped before a connection was made
+        delay = self.backoff
+        while not self.stopped():
+            try:
+                conn = connect_to_pico(self.do_serial, self.host, self.port, self.baud)
+            except Exception as error:
+                self.attempts += 1
+                if not self.retry:
+                    print("Connection to PICO {}:{} failed: {}".format(self.host or "", self.port, error))
+                    return False
+                print("Connection to PICO {}:{} failed ({}), retrying in {:.1f} s".format(self.host or "", self.port, error, delay))
+                self._sleep(delay)
+                delay = min(2*delay, self.max_backoff)
+                continue
+            if self.do_serial:
+                conn.timeout = self.timeout
+            else:
+                conn.settimeout(self.timeout)
+            self.conn       = conn
+            self.generation += 1
+            self.last_data  = time.time()
+            return True
+        return False
+
+    def failed(self, reason):
+        # the connection is dead: close it and reconnect, the outage is recorded once the link is back (or stopped)
+        self.close()
+        if not self.retry:
+            print("Connection to PICO lost: {}".format(reason))
+            return
+        self.down_since = time.time()
+        print("Connection to PICO lost: {}, reconnecting".format(reason))
+        self.open()
+        self.outages.append((self.down_since, time.time(), reason))
+        self.down_since = None
+        if self.up:
+            print("Connection to PICO back after {:.1f} s".format(self.outages[-1][1] - self.outages[-1][0]))
+
+    def received(self, n):
+        # account for one read that gave n bytes, 0 if the socket was closed, None if nothing arrived within the timeout
+        if n == 0 and not self.do_serial:
+            self.failed("connection closed by the other side")
+        elif not n:
+            if self.stall and time.time() - self.last_data > self.stall:
+                self.failed("nothing received for {:.0f} s".format(self.stall))
+        else:
+            self.last_data = time.time()
+
+    def read_into(self, buf):
+        # bytes read into buf, None if nothing was received (timeout, or the link was reopened in the meantime),
+        # 0 once the link is closed for good (retry=False)
+        if self.conn is None:
+            if not self.retry:
+                return 0
+            if self.stopped() or not self.open():
+                return None
+        try:
+            if self.do_serial:
+                nbytes = min(max(self.conn.in_waiting, 1), len(buf))                        # whatever is waiting, in one read
+                with memoryview(buf) as view:
+                    n = self.conn.readinto(view[:nbytes])
+            else:
+                n = self.conn.recv_into(buf)
+        except socket.timeout:
+            n = None
+        except Exception as error:
+            self.failed(str(error))
+            return None if self.up or self.retry else 0
+        self.received(n)
+        return n if n else None if self.up or self.retry else 0
+
+    def read(self, size):
+        # up to size bytes, b"" if nothing was received: a view on a buffer kept for the next reads, valid until then
+        # (e.g. copied once into the FrameSync buffer), so reading does not allocate or copy
+        if self.buffer is None or len(self.buffer) < size:
+            self.buffer = bytearray(size)
+        view    = memoryview(self.buffer)[:size]
+        n       = self.read_into(view)
+        return view[:n] if n else b""
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def _sleep(self, seconds):
+        end = time.time() + seconds
+        while not self.stopped() and time.time() < end:
+            self.interrupted.wait(min(0.2, end - time.time()))
@@ -0,0 +1,214 @@
+import os
+import queue
+import subprocess
+import sys
+import threading
+from argparse import ArgumentParser
+
+import numpy as np
+
+from picoammeter.frames import channel_map
+
+
+# quantity to plot: EventBatch column, axis label, unit #
+plot_quantities = {"current": ("curr", "Current", "A"),
+                   "voltage": ("volt", "Voltage", "V")}
+
+
+class RingBuffer:
+    # the last `size` rows, stored twice so that they are always available in order as one contiguous view #
+    def __init__(self, size, width):
+        self.size   = size
+        self.data   = np.full((2*size, width), np.nan)
+        self.pos    = 0                                                                     # where the next row goes
+        self.count  = 0
+
+    def extend(self, rows):
+        rows        = rows[-self.size:]
+        idx         = (self.pos + np.arange(len(rows))) % self.size
+        self.data[idx]              = rows
+        self.data[idx + self.size]  = rows
+        self.pos    = (self.pos + len(rows)) % self.size
+        self.count  = min(self.count + len(rows), self.size)
+
+    def view(self):
+        end = self.pos + self.size
+        return self.data[end - self.count:end]
+
+
+class LivePlot:
+    # Live monitor running in its own process: the acquisition only selects one event every `every`, and hands the
+    # rows to a sender thread that writes them to the pipe of the plot process. If the plot does not keep up, rows are dropped.
+    def __init__(self, quantities=("current",), channels=channel_map, points=100, every=65, interval=0.1, queue_size=64):
+        self.quantities     = list(quantities)
+        self.columns        = [channel_map.index(ch) for ch in channels]
+        self.every          = every
+        self.nev            = 0
+        self.rows_sent      = 0
+        self.rows_dropped   = 0
+        self.window_closed  = False
+        command             = [sys.executable, "-m", "picoammeter.liveplot",
+                               "--quantities", "_".join(self.quantities), "--channels", "_".join(channels),
+                               "--points", str(points), "--interval", str(interval)]
+        root                = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process        = subprocess.Popen(command, stdin=subprocess.PIPE, cwd=root)     # a new interpreter: the acquisition script is not imported again
+        self.queue          = queue.Queue(maxsize=queue_size)
+        self.sender         = threading.Thread(target=self._send, name="pico-plot", daemon=True)
+        self.sender.start()
+
+    def add(self, events):
+        # the same events as the old per-event plot: one every `every`, not averaged and not corrupted
+        nev     = self.nev + np.arange(len(events.timestamp))
+        self.nev += len(nev)
+        rows    = (nev % self.every == 0) & ~events.averaged & ~events.corrupted
+        if self.window_closed or not rows.any():
+            return
+        data    = [events.timestamp[rows].reshape(-1, 1)]
+        for quantity in self.quantities:
+            data.append(getattr(events, plot_quantities[quantity][0])[rows][:, self.columns])
+        block   = np.hstack(data).astype(np.float64)
+        try:
+            self.queue.put_nowait(block)
+        except queue.Full:
+            self.rows_dropped += len(block)
+
+    def close(self, wait=True):
+        # stop sending; with wait the plot stays on screen until its window is closed
+        self.queue.put(None)
+        self.sender.join()
+        if wait:
+            self.process.wait()
+
+    def _send(self):
+        stream = self.process.stdin
+        while True:
+            block = self.queue.get()
+            if block is None:
+                break
+            if self.window_closed:                                                          # keep draining, so that close() never blocks
+                continue
+            try:
+                stream.write(np.int64(len(block)).tobytes() + block.tobytes())
+                stream.flush()
+                self.rows_sent += len(block)
+            except OSError:                                                                 # broken pipe: the plot window was closed
+                self.window_closed = True
+        try:
+            stream.close()
+        except OSError:
+            pass
+
+
+def _read_blocks(stream, width, blocks):
+    # runs in the plot process: rows from the acquisition, None at the end of the run
+    while True:
+        header = stream.read(8)
+        if len(header) < 8:
+            break
+        n       = int(np.frombuffer(header, dtype=np.int64)[0])
+        data    = stream.read(n*width*8)
+        if len(data) < n*width*8:
+            break
+        blocks.put(np.frombuffer(data, dtype=np.float64).reshape(n, width))
+    blocks.put(None)
+
+
+def run(quantities, channels, points=100, interval=0.1, stream=None):
+    # The plot: the lines are created once and updated with set_data, only the lines and the legend are redrawn (blitting).
+    # The whole figure is redrawn only when the data leave the axis limits.
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as ticker
+
+    stream      = stream or sys.stdin.buffer
+    nch         = len(channels)
+    ring        = RingBuffer(points, 1 + nch*len(quantities))
+    fig, axes   = plt.subplots(len(quantities), 1, sharex=True, figsize=(10, 3 + 3*len(quantities)), squeeze=False)
+    fig.subplots_adjust(right=0.78)
+    axes[0, 0].set_title("PICO", size=20)
+    panels      = []
+    for k, quantity in enumerate(quantities):
+        _, name, unit = plot_quantities[quantity]
+        ax      = axes[k, 0]
+        ax.set_ylabel(name)
+        ax.yaxis.set_major_formatter(ticker.EngFormatter(unit=unit))
+        ax.grid(True, alpha=0.35)
+        lines   = [ax.plot([], [], label=ch, animated=True)[0] for ch in channels]
+        legend  = ax.legend(loc="center left", bbox_to_anchor=(1.01, 0.5), frameon=True)  # Put a legend to the right of the axis
+        legend.set_animated(True)
+        fmt     = ticker.EngFormatter(unit=unit, places=2, sep=" ")                        # formatter for the measurements in the legend
+        panels.append((ax, lines, legend, fmt, 1 + k*nch))
+    axes[-1, 0].set_xlabel("Timestamp")
+
+    state       = {"background": None}
+    fig.canvas.mpl_connect("draw_event", lambda event: state.update(background=None))     # resized or redrawn: take the background again
+
+    def rescale(data):
+        # new limits only when the data are outside the current ones, with some margin to avoid redrawing at every update
+        changed = False
+        x       = data[:, 0]
+        left, right = axes[0, 0].get_xlim()
+        if x[-1] > right or x[0] < left:
+            span    = max(x[-1] - x[0], 1)
+            axes[0, 0].set_xlim(x[0], x[-1] + 0.25*span)
+            changed = True
+        for ax, lines, legend, fmt, first in panels:
+            y       = data[:, first:first+nch]
+            lo, hi  = np.nanmin(y), np.nanmax(y)
+            bottom, top = ax.get_ylim()
+            if lo < bottom or hi > top or (top - bottom) > 20*max(hi - lo, abs(hi)*1e-3, 1e-15):
+                margin  = 0.1*max(hi - lo, abs(hi)*1e-3, 1e-15)
+                ax.set_ylim(lo - margin, hi + margin)
+                changed = True
+        return changed
+
+    def update():
+        data = ring.view()
+        for ax, lines, legend, fmt, first in panels:
+            for c, (line, text) in enumerate(zip(lines, legend.get_texts())):
+                line.set_data(data[:, 0], data[:, first + c])
+                text.set_text("{}    {}".format(channels[c], fmt(data[-1, first + c])))
+        if rescale(data) or state["background"] is None:
+            fig.canvas.draw()
+            state["background"] = fig.canvas.copy_from_bbox(fig.bbox)
+        fig.canvas.restore_region(state["background"])
+        for ax, lines, legend, fmt, first in panels:
+            for line in lines:
+                ax.draw_artist(line)
+            ax.draw_artist(legend)
+        fig.canvas.blit(fig.bbox)
+
+    blocks      = queue.Queue()
+    threading.Thread(target=_read_blocks, args=(stream, ring.data.shape[1], blocks), daemon=True).start()
+    plt.show(block=False)
+    finished    = False
+    while not finished and plt.fignum_exists(fig.number):
+        new = False
+        try:
+            block = blocks.get(timeout=interval)
+            while block is not None:
+                ring.extend(block)
+                new     = True
+                block   = blocks.get_nowait()
+            finished = True
+        except queue.Empty:
+            pass
+        if new:
+            update()
+        fig.canvas.flush_events()
+    if finished and plt.fignum_exists(fig.number):
+        for ax, lines, legend, fmt, first in panels:                                        # keep the last picture on screen until the window is closed
+            for line in lines:
+                line.set_animated(False)
+            legend.set_animated(False)
+        plt.ioff()
+        plt.show()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(usage="python3 -m picoammeter.liveplot --quantities current_voltage < rows")
+    parser.add_argument("--quantities",     dest="quantities",  default="current",                      type=str)
+    parser.add_argument("--channels",       dest="channels",    default="_".join(channel_map),          type=str)
+    parser.add_argument("--points",         dest="points",      default=100,                            type=int)
+    parser.add_argument("--interval",       dest="interval",    default=0.1,                            type=float)
+    options = parser.parse_args()
+    run(options.quantities.split("_"), options.channels.split("_"), points=options.points, interval=options.interval)
@@ -0,0 +1,158 @@
+import bisect
+import json
+import threading
+import time
+
+
+latency_buckets = (1e-5, 3e-5, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1.0, 3.0)      # seconds
+
+
+class Histogram:
+    # number of observations per bucket (value <= bound), their sum and count #
+    def __init__(self, buckets=latency_buckets):
+        self.buckets    = tuple(buckets)
+        self.counts     = [0]*(len(self.buckets) + 1)                                       # the last one is +Inf
+        self.sum        = 0.0
+        self.count      = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metrics:
+    # Counters, gauges and latency histograms of the acquisition, rendered in the Prometheus text format.
+    # A counter or gauge registered with fn is read from fn when rendered, e.g. the counters the receiver, the framing
+    # and the sinks already keep; the others are updated with inc()/set(), the histograms with observe() or timer().
+    # Every value is updated from one thread (the acquisition loop, or a sink worker for its own histogram) and takes no
+    # lock; the HTTP and stats threads only read.
+    def __init__(self, prefix="pico", labels=None):
+        self.prefix     = prefix
+        self.labels     = ",".join('{}="{}"'.format(k, v) for k, v in (labels or {}).items())
+        self.metrics    = {}                                                                # name -> [type, help, value, fn]
+        self.started    = time.time()
+
+    def counter(self, name, help, fn=None):
+        self.metrics[name] = ["counter", help, 0, fn]
+
+    def gauge(self, name, help, fn=None):
+        self.metrics[name] = ["gauge", help, 0, fn]
+
+    def histogram(self, name, help, buckets=latency_buckets):
+        self.metrics[name] = ["histogram", help, Histogram(buckets), None]
+
+    def inc(self, name, value=1):
+        self.metrics[name][2] += value
+
+    def set(self, name, value):
+        self.metrics[name][2] = value
+
+    def observe(self, name, value):
+        self.metrics[name][2].observe(value)
+
+    def timer(self, name):
+        # with metrics.timer("calibration_seconds"): ...
+        return _Timer(self.metrics[name][2])
+
+    def value(self, name):
+        kind, _, value, fn = self.metrics[name]
+        return fn() if fn is not None else value
+
+    def snapshot(self):
+        # current values; histograms as count, sum and mean
+        out = {"time": round(time.time(), 3), "uptime": round(time.time() - self.started, 3)}
+        for name, (kind, _, value, fn) in list(self.metrics.items()):
+            if kind == "histogram":
+                out[name] = {"count": value.count, "sum": round(value.sum, 6), "mean": value.sum/value.count if value.count else None}
+            else:
+                out[name] = self.value(name)
+        return out
+
+    def render(self):
+        lines = []
+        for name, (kind, help, value, fn) in list(self.metrics.items()):
+            full = "{}_{}".format(self.prefix, name)
+            lines.append("# HELP {} {}".format(full, help))
+            lines.append("# TYPE {} {}".format(full, kind))
+            if kind != "histogram":
+                lines.append("{}{} {}".format(full, self._labels(), self.value(name)))
+                continue
+            counts, cumulative = list(value.counts), 0
+            for bound, count in zip(list(value.buckets) + ["+Inf"], counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(full, self._labels('le="{}"'.format(bound)), cumulative))
+            lines.append("{}_sum{} {}".format(full, self._labels(), value.sum))
+            lines.append("{}_count{} {}".format(full, self._labels(), cumulative))
+        return "\n".join(lines) + "\n"
+
+    def _labels(self, extra=""):
+        labels = ",".join(x for x in [self.labels, extra] if x)
+        return "{" + labels + "}" if labels else ""
+
+
+class MetricsServer(threading.Thread):
+    # GET /metrics on host:port, for Prometheus or curl #
+    def __init__(self, metrics, host="127.0.0.1", port=9100):
+        super().__init__(name="pico-metrics", daemon=True)
+        import http.server                                                                  # only with --metrics_port
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] not in ("/", "/metrics"):
+                    handler.send_error(404)
+                    return
+                body = metrics.render().encode()
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):                                                # no line on stderr per request
+                pass
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.port   = self.server.server_address[1]
+
+    def run(self):
+        self.server.serve_forever(poll_interval=0.5)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StatsFile(threading.Thread):
+    # one JSON line with the snapshot of the metrics every interval seconds, and a last one when closed #
+    def __init__(self, metrics, path, interval=10.0):
+        super().__init__(name="pico-stats", daemon=True)
+        self.metrics    = metrics
+        self.file       = open(path, "a")
+        self.interval   = interval
+        self.stopping   = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self._write()
+
+    def close(self):
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
+        self._write()
+        self.file.close()
+
+    def _write(self):
+        self.file.write(json.dumps(self.metrics.snapshot(), default=str) + "\n")
+        self.file.flush()
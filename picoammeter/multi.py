@@ -0,0 +1,130 @@
+import selectors
+import time
+
+import numpy as np
+
+from picoammeter.calibration import Calibration
+from picoammeter.clock import ClockFit
+from picoammeter.decimate import make_decimator, select
+from picoammeter.events import EventBuilder
+from picoammeter.frames import FrameSync, decode_frames
+from picoammeter.receiver import Receiver
+from picoammeter.runstats import Summary, default_windows
+
+
+class DeviceStream:
+    # Everything that belongs to one PICO in a multi-device acquisition: connection, framing, events and output #
+    def __init__(self, pico, conn, do_serial=False, writer=None, slow_mode_factor=1, slow_filter="pick", chunk_size=65536,
+                 summary_path=None, summary_windows=default_windows):
+        self.pico               = pico
+        self.conn               = conn
+        self.do_serial          = do_serial
+        self.writer             = writer
+        self.slow_mode_factor   = slow_mode_factor
+        self.decimator          = make_decimator(slow_mode_factor, slow_filter)
+        self.sync               = FrameSync()
+        self.builder            = EventBuilder(Calibration.from_device(pico))
+        self.clock              = ClockFit()                                                # drift of this PICO clock against the host
+        self.received_at        = None                                                      # host time the last bytes fed were received
+        self.summary            = Summary(summary_path, windows=summary_windows, clock=self.clock) if summary_path else None    # running statistics, see picoammeter/runstats.py
+        self.buffer             = bytearray(chunk_size)                                     # preallocated, filled by recv_into
+        self.closed             = False
+        self.error              = None                                                      # why the connection was lost, if it was
+        self.nev                = 0
+        self.nev_skip           = 0
+        self.nev_written        = 0
+        self.bytes_received     = 0
+        if do_serial:                                                                       # serial ports cannot be selected on every platform, a receiver thread drains them
+            self.receiver       = Receiver(conn, is_serial=True, chunk_size=chunk_size)
+            self.receiver.start()
+        else:
+            self.receiver       = None
+            conn.setblocking(False)
+
+    def recv(self):
+        # read what is waiting on the socket
+        try:
+            n = self.conn.recv_into(self.buffer)
+        except BlockingIOError:
+            return
+        except OSError as error:                                                            # reset or broken: this PICO is done, the others go on
+            print("Connection to {} lost: {}".format(self.pico, error))
+            self.error  = error
+            self.closed = True
+            return
+        if n == 0:                                                                          # connection closed by the other side
+            self.closed = True
+            return
+        self.bytes_received += n
+        self.received_at     = time.time()
+        with memoryview(self.buffer) as view:
+            self.sync.feed(view[:n])
+
+    def poll_receiver(self):
+        # take the chunks the receiver thread has read so far
+        chunk = self.receiver.get(timeout=0)
+        while chunk is not None:
+            self.bytes_received += len(chunk)
+            self.sync.feed(chunk)
+            self.receiver.release(chunk)
+            self.received_at     = self.receiver.received_at
+            chunk = self.receiver.get(timeout=0)
+        if not self.receiver.is_alive():
+            self.closed = True
+
+    def process(self):
+        # decode, calibrate and write all the complete frames received so far
+        events  = self.builder.process(decode_frames(self.sync.extract()))
+        self.clock.add(events.timestamp[-1:], self.received_at)
+        keep, write = select(events, self.nev, self.slow_mode_factor, self.decimator)     # skip the corrupted data, the data on 60 measurements and the data not complete yet
+        self.nev += len(events.timestamp)
+        self.nev_skip += int(np.count_nonzero(keep & events.averaged))
+        if self.summary is not None:
+            self.summary.add(events)
+        if self.writer is not None:
+            rows, mask = self.decimator.process(events, write) if self.decimator else (events, write)    # from 400Hz to 400Hz/N
+            self.writer.write(rows, mask)
+            self.nev_written += int(np.count_nonzero(mask))
+        return events
+
+    def close(self):
+        if self.receiver is not None:
+            self.receiver.stop()
+            self.poll_receiver()
+        self.process()
+        self.conn.close()
+        if self.writer is not None:
+            self.writer.close()
+        if self.summary is not None:
+            self.summary.close()
+
+
+def acquire(streams, time_acq, poll_interval=0.05, stop=None):
+    # read all the PICOs from one loop: sockets through a selector, serial ports through their receiver thread,
+    # for time_acq seconds (until stop is set with 0), then close every stream after processing what it received
+    sel = selectors.DefaultSelector()
+    for stream in streams:
+        if stream.receiver is None:
+            sel.register(stream.conn, selectors.EVENT_READ, stream)
+    t0 = time.time()
+    try:
+        while (time_acq <= 0 or time.time() - t0 <= time_acq) and not (stop is not None and stop.is_set()) and not all(stream.closed for stream in streams):
+            if sel.get_map():
+                for key, _ in sel.select(timeout=poll_interval):
+                    key.data.recv()
+                    if key.data.closed:
+                        sel.unregister(key.fileobj)
+            else:
+                time.sleep(poll_interval)
+            for stream in streams:
+                if stream.receiver is not None and not stream.closed:
+                    stream.poll_receiver()
+                stream.process()
+    finally:                                                                                # every output is closed, whatever went wrong
+        sel.close()
+        for stream in streams:
+            try:
+                stream.close()
+            except Exception as error:
+                print("Could not close the stream of {}: {}".format(stream.pico, error))
+    return time.time() - t0
@@ -0,0 +1,233 @@
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from picoammeter.binary import MAGIC as BINARY_MAGIC, BinaryWriter
+from picoammeter.capture import CaptureReader
+from picoammeter.clock import fit_capture
+from picoammeter.decimate import concat, make_decimator, select, take
+from picoammeter.events import KIND_CURR, KIND_TEMP, KIND_VOLT, EventBuilder, known_flags
+from picoammeter.frames import FRAME_END, FRAME_SIZE, FRAME_START, FrameSync, channel_map, decode_frames, frame_dtype
+from picoammeter.rootio import RootWriter
+from picoammeter.writers import TextWriter
+
+
+# Offline conversion of a raw capture on several processes:
+#   1) the received stream is cut into frame-aligned parts, one or more per process;
+#   2) every part is framed and calibrated on its own, keeping what the next parts need: number of frames, time flag flips,
+#      first and last W/w time flag (J/D are skipped), last known current, voltage and temperature;
+#   3) the state the EventBuilder would have at the beginning of every part is rebuilt from these summaries in order;
+#   4) every part is converted again from that state into its own shard, the shards are merged or kept.
+# With a slow mode filter, a part writes the windows that lie within it and hands its first and last rows back: the windows
+# across two parts are computed from them and written into a small shard between the two.
+# The events are the same as with Pico_raw_converter.py on one process.
+formats     = {"txt": TextWriter, "pico": BinaryWriter, "root": RootWriter}
+part_size   = 32 << 20                                                                      # bytes of capture per part at most, the events of a part are held in memory
+
+
+def frame_boundary(reader, pos, window=1 << 16):
+    # first offset at or after pos, in the received stream, where two consecutive frames begin
+    total = len(reader)
+    while pos < total:
+        data    = reader.read(pos, min(pos + window + 2*FRAME_SIZE, total))
+        start   = data.find(FRAME_START)
+        while 0 <= start < len(data) - FRAME_SIZE and start < window:
+            frames = np.frombuffer(data, dtype=frame_dtype, count=min(2, (len(data) - start) // FRAME_SIZE), offset=start)
+            if ((frames["start"] == FRAME_START) & (frames["end"] == FRAME_END)).all():
+                return pos + start
+            start = data.find(FRAME_START, start + 1)
+        pos += window
+    return total
+
+
+def split(reader, parts):
+    # frame-aligned [start, stop) ranges of the received stream
+    total   = len(reader)
+    bounds  = [0] + [frame_boundary(reader, total*k // parts) for k in range(1, parts)] + [total]
+    bounds  = sorted(set(bounds))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _events(path, start, stop, calibration, state=None):
+    # frame and calibrate one part of the capture, from the given EventBuilder state
+    reader  = CaptureReader(path)
+    data    = reader.read(start, stop)
+    reader.close()
+    sync    = FrameSync()
+    sync.feed(data)
+    builder = EventBuilder(calibration)
+    if state is not None:
+        for name, value in state.items():
+            setattr(builder, name, value)
+    events  = builder.process(decode_frames(sync.extract()))
+    return events, builder, sync
+
+
+def _summary(path, start, stop, calibration):
+    # what the following parts need to know about this one
+    events, builder, sync = _events(path, start, stop, calibration)
+    n       = len(events.timestamp)
+    summary = dict(n=n, flips=builder.count_time_flip, count_I=builder.count_I, count_V=builder.count_V,
+                   frames_rejected=sync.frames_rejected, bytes_skipped=sync.bytes_skipped + len(sync))
+    # rows selected for writing, depending on whether a current and a voltage were seen before the part (see EventBuilder.complete) #
+    base    = ~events.corrupted & ~events.averaged
+    seen_I  = np.cumsum(events.kind == KIND_CURR) > 0
+    seen_V  = np.cumsum(events.kind == KIND_VOLT) > 0
+    summary["selected"] = [int(np.count_nonzero(base & (before_I | seen_I) & (before_V | seen_V))) for before_I in (False, True) for before_V in (False, True)]
+    if n:
+        known   = events.labels[:, 0][np.isin(events.labels[:, 0], known_flags)]            # None when every frame has a corrupted flag
+        summary.update(first_flag=known[0] if len(known) else None, last_flag=builder.last_time_flag if len(known) else None,
+                       ts0=builder.ts0, last_timestamp=builder.last_timestamp,
+                       curr=builder.curr if (events.kind == KIND_CURR).any() else None,
+                       volt=builder.volt if (events.kind == KIND_VOLT).any() else None,
+                       temp=builder.temp if (events.kind == KIND_TEMP).any() else None)
+    return summary
+
+
+def initial_states(summaries):
+    # EventBuilder state at the beginning of every part, as if the parts before had been processed by the same builder
+    states  = []
+    state   = None
+    for summary in summaries:
+        states.append(None if state is None else dict(state))
+        if summary["n"] == 0:
+            continue
+        if state is None:                                                                   # first frames: ts0 and the first time flag come from here
+            nch   = len(channel_map)
+            state = dict(nev=0, count_time_flip=0, count_I=0, count_V=0, ts0=summary["ts0"], last_time_flag=summary["first_flag"], last_timestamp=None,
+                         curr=np.zeros(nch), volt=np.zeros(nch), temp=np.zeros(nch))
+        if summary["first_flag"] is not None:                                               # a part with J/D flags only does not switch
+            boundary = int(state["last_time_flag"] in known_flags and summary["first_flag"] != state["last_time_flag"])  # flip between the last W/w before and the first one here
+            state["count_time_flip"] += summary["flips"] + boundary
+            state["last_time_flag"]   = summary["last_flag"]
+        state["nev"]             += summary["n"]
+        state["count_I"]         += summary["count_I"]
+        state["count_V"]         += summary["count_V"]
+        state["last_timestamp"]   = summary["last_timestamp"]
+        for quantity in ["curr", "volt", "temp"]:
+            if summary[quantity] is not None:
+                state[quantity] = summary[quantity]
+    return states
+
+
+def _convert_part(path, start, stop, calibration, state, nev0, out_path, fmt, slow_mode_factor, slow_filter, sel0):
+    # convert one part into its own shard, the event selection is the one of the live acquisition;
+    # sel0 is the number of rows selected for writing before the part, it aligns the blocks of the slow mode filter
+    events, builder, sync = _events(path, start, stop, calibration, state)
+    decimator   = make_decimator(slow_mode_factor, slow_filter, start=sel0)
+    keep, write = select(events, nev0, slow_mode_factor, decimator)
+    rows, mask  = events, write
+    edges       = []
+    if decimator:
+        selected    = np.flatnonzero(write)
+        edge        = decimator.window - 1                                                  # rows a window across the part boundary may need
+        if len(selected) < 2*edge:                                                          # too few rows: all of them go with the windows across parts
+            edges   = [take(events, selected)]
+            mask    = np.zeros(len(events.timestamp), dtype=bool)
+        else:
+            edges   = [take(events, selected[:edge]), take(events, selected[len(selected) - edge:])]
+            rows, mask = decimator.process(events, write)
+    writer  = formats[fmt](out_path)
+    writer.write(rows, mask)
+    writer.close()
+    return dict(nev=len(events.timestamp), nev_skip=int(np.count_nonzero(keep & events.averaged)), nev_written=int(np.count_nonzero(mask)),
+                selected=int(np.count_nonzero(write)), edges=edges,
+                frames_missed=int(events.missed[events.missed > 0].sum()), gaps=int(np.count_nonzero(events.missed > 0)),
+                count_time_flip=builder.count_time_flip)
+
+
+def _clock(path):
+    # clock fit of the whole capture, run on the pool next to the parts
+    reader  = CaptureReader(path)
+    clock   = fit_capture(reader).to_dict()
+    reader.close()
+    return clock
+
+
+def _across(results, sel0, slow_mode_factor, slow_filter):
+    # rows of the windows across parts: [(part after which they go, decimated events)]
+    runs    = []                                                                            # [part, number of the first row, rows]: edge rows that follow each other
+    run     = None
+    for k, result in enumerate(results):
+        edges   = result["edges"]
+        if run is None:
+            run = [k, sel0[k], []]
+        run[2].append(edges[0])
+        if len(edges) == 2:                                                                 # the middle of the part is written by the part itself
+            runs.append(run)
+            run = [k, sel0[k] + result["selected"] - len(edges[1].timestamp), [edges[1]]]
+    if run is not None:
+        runs.append(run)
+    out     = []
+    for k, first, batches in runs:
+        rows        = concat(batches)
+        decimator   = make_decimator(slow_mode_factor, slow_filter, start=first)
+        events, mask = decimator.process(rows, np.ones(len(rows.timestamp), dtype=bool))
+        if mask.any():
+            out.append((k, events))
+    return out
+
+
+def merge(shards, out_path, fmt):
+    # one output file from the shards, in order
+    if fmt == "root":
+        import ROOT
+        merger = ROOT.TFileMerger(False)
+        merger.OutputFile(out_path, "RECREATE")
+        for shard in shards:
+            merger.AddFile(shard)
+        if not merger.Merge():
+            raise RuntimeError("merging {} failed".format(out_path))
+        return
+    with open(out_path, "wb") as out:
+        for k, shard in enumerate(shards):
+            with open(shard, "rb") as file:
+                if k > 0:                                                                   # the header is written once
+                    if fmt == "txt":
+                        file.readline()
+                    else:
+                        file.seek(len(BINARY_MAGIC))
+                        size = int(np.frombuffer(file.read(4), dtype="<u4")[0])
+                        file.seek(len(BINARY_MAGIC) + 4 + size)
+                shutil.copyfileobj(file, out, 1 << 20)
+
+
+def convert_parallel(path, out_path, fmt="txt", pico=None, slow_mode_factor=1, slow_filter="pick", jobs=None, parts=None, shards=False):
+    # Convert a raw capture with a pool of `jobs` processes (all the cores by default).
+    # With shards the parts are kept as <out>_partNNN.<ext>, otherwise they are merged into out_path.
+    jobs        = jobs or os.cpu_count() or 1
+    reader      = CaptureReader(path)
+    calibration = reader.calibration(pico)                                                  # the one recorded in the capture unless pico is given
+    parts       = parts or max(jobs, -(-len(reader) // part_size))
+    ranges      = split(reader, parts) if len(reader) else [(0, 0)]
+    reader.close()
+    base, ext   = os.path.splitext(out_path)
+    shard_paths = ["{}_part{:03d}{}".format(base, k, ext) for k in range(len(ranges))]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        clock       = pool.submit(_clock, path)
+        summaries   = list(pool.map(_summary, *zip(*[(path, a, b, calibration) for a, b in ranges])))
+        states      = initial_states(summaries)
+        nev0        = np.concatenate([[0], np.cumsum([s["n"] for s in summaries])])
+        selected    = [s["selected"][2*int(bool(st and st["count_I"])) + int(bool(st and st["count_V"]))] for s, st in zip(summaries, states)]
+        sel0        = np.concatenate([[0], np.cumsum(selected)])
+        results     = list(pool.map(_convert_part, *zip(*[(path, a, b, calibration, states[k], int(nev0[k]), shard_paths[k], fmt, slow_mode_factor, slow_filter, int(sel0[k]))
+                                                           for k, (a, b) in enumerate(ranges)])))
+        clock       = clock.result()
+    across  = _across(results, sel0, slow_mode_factor, slow_filter) if make_decimator(slow_mode_factor, slow_filter) else []
+    for k, events in reversed(across):                                                      # a shard between part k and part k+1
+        shard_paths.insert(k + 1, "{}_part{:03d}_edge{}".format(base, k, ext))
+        writer  = formats[fmt](shard_paths[k + 1])
+        writer.write(events, np.ones(len(events.timestamp), dtype=bool))
+        writer.close()
+    if not shards:
+        merge(shard_paths, out_path, fmt)
+        for shard in shard_paths:
+            os.remove(shard)
+    stats = dict(parts=len(ranges), bytes=ranges[-1][1], outputs=shard_paths if shards else [out_path],
+                 nev=sum(r["nev"] for r in results), nev_skip=sum(r["nev_skip"] for r in results), nev_written=sum(r["nev_written"] for r in results) + sum(len(e.timestamp) for _, e in across),
+                 frames_missed=sum(r["frames_missed"] for r in results), gaps=sum(r["gaps"] for r in results),
+                 count_time_flip=results[-1]["count_time_flip"], clock=clock,
+                 frames_rejected=sum(s["frames_rejected"] for s in summaries), bytes_skipped=sum(s["bytes_skipped"] for s in summaries))
+    return stats
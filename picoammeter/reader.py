@@ -0,0 +1,207 @@
+import contextlib
+import time
+
+import numpy as np
+
+from picoammeter.calibration import Calibration
+from picoammeter.clock import ClockFit
+from picoammeter.decimate import concat, take
+from picoammeter.devices import connection_settings, devices
+from picoammeter.events import EventBuilder
+from picoammeter.frames import FRAME_SIZE, FrameBatch, FrameSync, decode_frames
+from picoammeter.gaps import GapStats
+from picoammeter.link import Link
+from picoammeter.receiver import Receiver
+
+
+class PicoReader:
+    # Acquisition from one PICO for other programs: connection (reopened when it dies, see picoammeter/link.py), framing,
+    # decoding and calibration, the events handed out as EventBatch of NumPy arrays (see picoammeter/events.py):
+    #
+    #   with PicoReader("pico5", duration=60, batch_size=400, only_good=True) as reader:
+    #       for events in reader:
+    #           print(events.timestamp[-1], events.curr.mean(axis=0))
+    #
+    # device is a name of picoammeter/devices.py (profiles can be added with PICO_DEVICES or load_devices()).
+    # Iterating yields batches of batch_size events, the last one shorter, or of what every poll() built with None;
+    # only_good keeps the events the converter writes (not corrupted, not averaged on 60 measurements, complete).
+    # The acquisition lasts duration seconds, until stop (a threading.Event) is set or close() with None or 0, then what
+    # was received is processed before the iteration ends. poll() is the step underneath, for loops of their own.
+    # On the way the reader keeps the drift of the PICO clock (clock), the lost frames (gaps) and the framing counters (sync).
+    # After a reconnection the timestamps go on from the last ones even if the PICO restarted its counter (builder.restarts).
+    # A failed receive is not printed: it is counted in errors, the last one kept in last_error, for the caller to report.
+    def __init__(self, device="pico5", serial=False, batch_size=400, duration=None, only_good=False, calibration=None,
+                 rx_thread=True, rx_queue=64, rx_overflow="block", read_size=65536, reconnect=True, stall=10.0, max_backoff=30.0,
+                 stop=None, metrics=None, dt=1e-4, convert_volt=True, convert_curr=True, convert_temp=True):
+        if device not in devices:
+            raise ValueError("Unknown device {}, available are {}".format(device, list(devices)))
+        self.device         = device
+        self.serial         = serial
+        self.batch_size     = batch_size
+        self.duration       = duration
+        self.only_good      = only_good
+        self.rx_thread      = rx_thread
+        self.rx_queue       = rx_queue
+        self.rx_overflow    = rx_overflow
+        self.read_size      = read_size                                                     # bytes read at once without rx_thread
+        self.stop           = stop
+        self.metrics        = metrics                                                       # picoammeter/metrics.py, timed if it has decode_seconds and calibration_seconds
+        self.host, self.port, self.baudrate = connection_settings(device, serial)
+        self.link           = Link(serial, self.host, self.port, self.baudrate, timeout=0.1 if rx_thread else 1.0, stall=stall,
+                                   max_backoff=max_backoff, stop=stop, retry=reconnect)
+        self.sync           = FrameSync()
+        self.builder        = EventBuilder(calibration or Calibration.from_device(device),
+                                           convert_volt=convert_volt, convert_curr=convert_curr, convert_temp=convert_temp)
+        self.clock          = ClockFit(dt=dt)                                               # drift of the PICO clock against the host
+        self.gaps           = GapStats()                                                    # frames lost by the link
+        self.receiver       = None
+        self.t0             = None
+        self.generation     = 0                                                             # connection the bytes in the framing buffer came from
+        self.received_at    = None                                                          # host time the last bytes fed were received
+        self.held           = []                                                            # (complete frames, PICO ticks until the next connection) of the connections that ended
+        self.frames         = None                                                          # FrameBatch decoded by the last poll()
+        self.nev            = 0
+        self.bytes_received = 0
+        self.errors         = 0
+        self.last_error     = None
+        self.closing        = False                                                         # receiving is over, what was received is processed
+        self.finished       = False
+
+    # connection #
+    def open(self):
+        # connect, ConnectionError if it could not be done (stopped before, or on the first failure without reconnect)
+        if not self.link.open():
+            raise ConnectionError("Connection to {} ({}:{}) failed".format(self.device, self.host or "", self.port))
+        self.t0             = time.time()
+        self.generation     = self.link.generation
+        if self.duration:
+            self.link.deadline = self.t0 + self.duration                                   # no reconnection attempt after the end
+        return self
+
+    def __enter__(self):
+        return self.open() if not self.link.up else self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # stop receiving now, the events not handed out yet are dropped
+        self._stop_receiving()
+        self.finished = True
+
+    def acquiring(self):
+        # receive until duration, stop or the end of the connection
+        return (not self.closing and not (self.stop is not None and self.stop.is_set()) and (self.link.up or self.link.retry)
+                and (not self.duration or time.time() - self.t0 <= self.duration))
+
+    def stop_reason(self):
+        if self.stop is not None and self.stop.is_set():
+            return "stop requested"
+        if not self.link.up and not self.link.retry:
+            return "Connection closed by PICO"
+        return "Acquisition time reached"
+
+    # acquisition #
+    def poll(self, timeout=0.1):
+        # receive for up to timeout seconds (everything the receiver thread has read, or one read), then frame, decode and
+        # calibrate the complete frames: an EventBatch, possibly empty. Once acquiring() is over, the connection is closed,
+        # the received bytes are processed and `finished` is set when nothing is left.
+        if self.acquiring():
+            self._receive(timeout)
+        elif not self.closing:
+            self._stop_receiving()
+        with self._timer("decode_seconds"):
+            held, self.held = self.held, []
+            block       = self.sync.extract()                                               # all the complete frames received so far, resynchronised on START
+            self.frames = decode_frames(b"".join([frames for frames, _ in held] + [block]))
+        if self.closing and not block:
+            self.finished = True
+        with self._timer("calibration_seconds"):
+            events      = self._build(held)
+        self.clock.add(events.timestamp[-1:], self.received_at)                             # the last frame was complete when its last bytes were received
+        self.gaps.add_events(events, self.nev)
+        self.nev       += len(events.timestamp)
+        return events
+
+    def __iter__(self):
+        if not self.link.up and not self.finished:
+            self.open()
+        pending, count = [], 0
+        while not self.finished:
+            events = self.poll()
+            if self.only_good:
+                events = take(events, np.flatnonzero(~events.corrupted & ~events.averaged & events.complete))
+            n = len(events.timestamp)
+            if self.batch_size is None:
+                if n:
+                    yield events
+                continue
+            pending.append(events)
+            count += n
+            while count >= self.batch_size:
+                events  = concat(pending)
+                pending = [take(events, slice(self.batch_size, None))]
+                count  -= self.batch_size
+                yield take(events, slice(0, self.batch_size))
+        if count:
+            yield concat(pending)
+
+    def _receive(self, timeout):
+        try:
+            if self.rx_thread:
+                if self.receiver is None:                                                   # started with the first poll, the link can be used alone before
+                    self.receiver = Receiver(self.link.conn, is_serial=self.serial, queue_size=self.rx_queue, overflow=self.rx_overflow, link=self.link)
+                    self.receiver.start()
+                chunk = self.receiver.get(timeout=timeout)                                  # chunks drained from the connection by the receiver thread
+                while chunk is not None:
+                    self._feed(chunk, self.receiver.generation, self.receiver.received_at)
+                    self.receiver.release(chunk)
+                    chunk = self.receiver.get(timeout=0)
+                if not self.receiver.is_alive() and not self.receiver.closed:
+                    raise ConnectionError("receiver thread stopped: {}".format(self.receiver.error))
+            else:
+                data = self.link.read(self.read_size)
+                self._feed(data, self.link.generation, time.time())
+        except Exception as error:                                                          # counted, reported by the caller
+            self.errors    += 1
+            self.last_error = error
+
+    def _build(self, held):
+        # the events of self.frames, the builder rebased where a connection ended (its counter may have restarted)
+        if not held:
+            return self.builder.process(self.frames)
+        batches, start = [], 0
+        for frames, ticks in held:
+            stop    = start + len(frames) // FRAME_SIZE
+            batches.append(self.builder.process(FrameBatch(*[column[start:stop] for column in self.frames])))
+            self.builder.rebase(ticks)
+            start   = stop
+        batches.append(self.builder.process(FrameBatch(*[column[start:] for column in self.frames])))
+        return concat(batches)
+
+    def _feed(self, data, generation, received_at):
+        if generation != self.generation:                                                   # the connection was reopened, the frames it completed are built first
+            ticks = (received_at - self.received_at)/self.clock.dt if self.received_at is not None else 0
+            self.held.append((self.sync.extract(), ticks))
+            self.sync.reset()                                                               # drop the frame it cut
+            self.generation = generation
+        self.sync.feed(data)
+        self.bytes_received += len(data)
+        self.received_at     = received_at
+
+    def _stop_receiving(self):
+        # stop the receiver, keep what it left in the queue, close the connection
+        self.closing = True
+        if self.receiver is not None:
+            self.receiver.stop()
+            chunk = self.receiver.get(timeout=0)
+            while chunk is not None:
+                self._feed(chunk, self.receiver.generation, self.receiver.received_at)
+                self.receiver.release(chunk)
+                chunk = self.receiver.get(timeout=0)
+        self.link.close()
+
+    def _timer(self, name):
+        if self.metrics is not None and name in self.metrics.metrics:
+            return self.metrics.timer(name)
+        return contextlib.nullcontext()
@@ -0,0 +1,135 @@
+import queue
+import socket
+import threading
+import time
+
+
+overflow_policies = ["block", "drop_oldest", "drop_newest"]
+
+
+class Receiver(threading.Thread):
+    # Drain a socket or a serial port on a dedicated thread, in large chunks read into preallocated buffers.
+    # The chunks are handed over to the processing stage through a queue bounded by the pool of queue_size buffers:
+    # get() a chunk, feed it, release() it. When no buffer is free the consumer is not keeping up and
+    #   overflow = "block":         stop reading until the consumer frees a buffer (the kernel/serial buffer fills up)
+    #   overflow = "drop_oldest":   throw away the oldest chunk waiting in the queue
+    #   overflow = "drop_newest":   throw away the chunk just received
+    # With a link (picoammeter/link.py) instead of conn the connection is reopened when it dies, and every chunk carries
+    # the generation of the connection it came from: `generation` after get() tells when the framing has to be reset.
+    def __init__(self, conn, is_serial=False, chunk_size=65536, queue_size=64, overflow="block", poll_interval=0.1, link=None):
+        super().__init__(name="pico-receiver", daemon=True)
+        if overflow not in overflow_policies:
+            raise ValueError("Unknown overflow policy {}, choose among {}".format(overflow, overflow_policies))
+        self.conn               = conn
+        self.link               = link
+        self.is_serial          = is_serial
+        self.chunk_size         = chunk_size
+        self.overflow           = overflow
+        self.poll_interval      = poll_interval
+        self.queue              = queue.Queue()                                             # (buffer, nbytes, host time, generation) ready to be processed, at most queue_size
+        self.free               = queue.Queue()                                             # buffers ready to be filled
+        for _ in range(queue_size):
+            self.free.put(bytearray(chunk_size))
+        self.scratch            = bytearray(chunk_size)                                     # landing buffer for "drop_newest"
+        self.stopping           = threading.Event()
+        self.closed             = False                                                     # the other side closed the connection
+        self.error              = None
+        self.bytes_received     = 0
+        self.chunks_received    = 0
+        self.queue_full         = 0                                                         # times no buffer was free to store the next chunk
+        self.chunks_dropped     = 0
+        self.bytes_dropped      = 0
+        self.received_at        = None                                                      # host time the chunk of the last get() was received
+        self.generation         = 0                                                         # connection the chunk of the last get() came from
+
+        if link is None:                                                                    # a link sets the timeout of every connection it opens
+            if is_serial:
+                self.conn.timeout   = poll_interval
+            else:
+                self.conn.settimeout(poll_interval)
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def stop(self):
+        self.stopping.set()
+        if self.link is not None:                                                           # do not wait for a reconnection
+            self.link.interrupt()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def get(self, timeout=None):
+        # next received chunk as a memoryview, None if nothing arrived within timeout
+        try:
+            buf, n, self.received_at, self.generation = self.queue.get(block=timeout is None or timeout > 0, timeout=timeout)
+        except queue.Empty:
+            return None
+        return memoryview(buf)[:n]
+
+    def release(self, chunk):
+        # give the buffer behind a chunk back to the receiver
+        buf = chunk.obj
+        chunk.release()
+        self.free.put(buf)
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                buf, drop = self._take_buffer()
+                if buf is None:
+                    continue
+                n = self._read_into(buf)
+                if n is None:                                                               # timeout, nothing received
+                    if not drop:
+                        self.free.put(buf)
+                    continue
+                if n == 0:                                                                  # connection closed by the other side
+                    self.closed = True
+                    break
+                self.bytes_received     += n
+                self.chunks_received    += 1
+                if drop:
+                    self.chunks_dropped += 1
+                    self.bytes_dropped  += n
+                else:
+                    self.queue.put((buf, n, time.time(), self.link.generation if self.link is not None else 0))
+        except Exception as error:
+            self.error = error
+
+    def _take_buffer(self):
+        # buffer to read into, and whether its content has to be dropped
+        try:
+            return self.free.get_nowait(), False
+        except queue.Empty:
+            pass
+        self.queue_full += 1
+        if self.overflow == "drop_newest":
+            return self.scratch, True
+        if self.overflow == "drop_oldest":
+            try:
+                buf, n, _, _ = self.queue.get_nowait()
+                self.chunks_dropped    += 1
+                self.bytes_dropped     += n
+                return buf, False
+            except queue.Empty:                                                             # the consumer holds every buffer, wait for one
+                pass
+        while not self.stopping.is_set():
+            try:
+                return self.free.get(timeout=self.poll_interval), False
+            except queue.Empty:
+                pass
+        return None, False
+
+    def _read_into(self, buf):
+        if self.link is not None:                                                           # reconnects by itself, never reports a closed connection
+            return self.link.read_into(buf)
+        try:
+            if self.is_serial:
+                nbytes = min(max(self.conn.in_waiting, 1), self.chunk_size)             # whatever is waiting, in one read
+                with memoryview(buf) as view:
+                    n = self.conn.readinto(view[:nbytes])
+                return n if n else None                                                     # a serial read returns nothing on timeout
+            return self.conn.recv_into(buf)
+        except socket.timeout:
+            return None
@@ -0,0 +1,98 @@
+import time
+
+import numpy as np
+
+from picoammeter.frames import channel_map
+
+
+# branch name, leaf list: same tree as the one filled event by event so far #
+branches    = ([("timestamp", "timestamp (1e-4 sec)/D")]
+               + [("I_{}".format(ch), "current_{} (A)/D".format(ch)) for ch in channel_map]
+               + [("V_{}".format(ch), "voltage_{} (V)/D".format(ch)) for ch in channel_map]
+               + [("T_{}".format(ch), "temperature_{} (C)/D".format(ch)) for ch in channel_map]
+               + [("missed", "frames missed before this event/D")])
+
+# the rows of a chunk are copied into the branch buffers and filled from C++, not through one PyROOT call per event
+_fill_code  = """
+void pico_branch(TTree* tree, const char* name, double* row, int column, const char* leaflist) {
+    tree->Branch(name, row + column, leaflist);
+}
+void pico_fill(TTree* tree, double* row, const double* columns, int ncolumns, long stride, long nrows) {
+    for (long i = 0; i < nrows; ++i) {
+        for (int c = 0; c < ncolumns; ++c) row[c] = columns[c*stride + i];
+        tree->Fill();
+    }
+}
+"""
+_declared   = False
+
+
+class RootWriter:
+    # .root output: events are buffered in numpy columns and committed to data_tree one chunk at a time.
+    # The tree is AutoSaved every autosave_events events or autosave_seconds seconds, so that memory stays flat
+    # and a crash loses at most what was not saved yet.
+    def __init__(self, path, chunk_rows=4000, autosave_events=None, autosave_seconds=10, basket_size=None, compression=None):
+        global _declared
+        import ROOT
+        if not _declared:
+            ROOT.gInterpreter.Declare(_fill_code)
+            _declared = True
+        self.ROOT               = ROOT
+        self.path               = path
+        self.chunk_rows         = chunk_rows
+        self.autosave_events    = autosave_events or chunk_rows
+        self.autosave_seconds   = autosave_seconds
+        if compression is None:
+            self.file           = ROOT.TFile(path, "RECREATE")
+        else:
+            self.file           = ROOT.TFile(path, "RECREATE", "", compression)         # compression = 100*algorithm + level, e.g. 101 (zlib 1), 505 (zstd 5)
+        self.tree               = ROOT.TTree("data_tree", "data_tree")
+        self.row                = np.zeros(len(branches))                                   # branch buffers
+        self.columns            = np.zeros((len(branches), chunk_rows))                     # events waiting to be committed
+        self.nrows              = 0
+        for c, (name, leaflist) in enumerate(branches):
+            ROOT.pico_branch(self.tree, name, self.row, c, leaflist)
+        if basket_size is not None:
+            self.tree.SetBasketSize("*", basket_size)
+        self.unsaved            = 0                                                         # events committed since the last AutoSave
+        self.last_save          = time.time()
+
+    def write(self, events, mask):
+        # append the events selected by mask
+        idx     = mask.nonzero()[0]
+        done    = 0
+        while done < len(idx):
+            m   = min(len(idx) - done, self.chunk_rows - self.nrows)
+            rows = idx[done:done+m]
+            a   = self.nrows
+            self.columns[0, a:a+m]                      = events.timestamp[rows]
+            self.columns[1:1+len(channel_map), a:a+m]   = events.curr[rows].T
+            self.columns[1+len(channel_map):1+2*len(channel_map), a:a+m] = events.volt[rows].T
+            self.columns[1+2*len(channel_map):1+3*len(channel_map), a:a+m] = events.temp[rows].T
+            self.columns[-1, a:a+m]                     = events.missed[rows]
+            self.nrows += m
+            done       += m
+            if self.nrows == self.chunk_rows:
+                self.commit()
+        if (self.unsaved >= self.autosave_events) or ((self.unsaved or self.nrows) and time.time() - self.last_save >= self.autosave_seconds):
+            self.autosave()
+
+    def commit(self):
+        # fill the tree with the buffered chunk
+        if self.nrows == 0:
+            return
+        self.ROOT.pico_fill(self.tree, self.row, self.columns.reshape(-1), len(branches), self.chunk_rows, self.nrows)
+        self.unsaved   += self.nrows
+        self.nrows      = 0
+
+    def autosave(self):
+        # commit what is buffered and save the tree, the baskets are flushed to disk
+        self.commit()
+        self.tree.AutoSave("SaveSelf FlushBaskets")
+        self.unsaved    = 0
+        self.last_save  = time.time()
+
+    def close(self):
+        self.commit()
+        self.tree.Write("", self.ROOT.TObject.kOverwrite)
+        self.file.Close()
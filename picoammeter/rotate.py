@@ -0,0 +1,136 @@
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+
+compressions    = ["none", "gzip", "zstd"]
+suffixes        = {"gzip": ".gz", "zstd": ".zst"}
+copy_size       = 1 << 20                                                                   # bytes compressed at once
+
+
+def fsync_path(path):
+    # flush a closed file, or the entry of a file in its folder, to the disk
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def compress_file(path, method="gzip", level=None):
+    # path -> path.gz or path.zst, synced to the disk before the original is removed; the new path
+    target  = path + suffixes[method]
+    with open(path, "rb") as src:
+        if method == "gzip":
+            dst = gzip.open(target, "wb", compresslevel=6 if level is None else level)
+        else:
+            import zstandard                                                                # only needed for zstd
+            dst = zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(open(target, "wb"))
+        with dst:
+            shutil.copyfileobj(src, dst, copy_size)
+    fsync_path(target)
+    os.remove(path)
+    fsync_path(os.path.dirname(os.path.abspath(path)))
+    return target
+
+
+class SegmentWorker(threading.Thread):
+    # Closed segments are synced, compressed (if asked) and handed to on_closed(path, final_path) by this thread, so the
+    # acquisition never waits on the disk. close() finishes the segments still queued.
+    def __init__(self, compression="none", level=None, on_closed=None):
+        super().__init__(name="pico-segments", daemon=True)
+        self.compression    = compression
+        self.level          = level
+        self.on_closed      = on_closed
+        self.queue          = queue.Queue()
+        self.done           = []                                                            # final paths
+        self.errors         = 0
+
+    def add(self, path):
+        self.queue.put(path)
+
+    def run(self):
+        path = self.queue.get()
+        while path is not None:
+            try:
+                fsync_path(path)
+                final = compress_file(path, self.compression, self.level) if self.compression != "none" else path
+                self.done.append(final)
+                if self.on_closed is not None:
+                    self.on_closed(path, final)
+            except Exception as error:
+                print("Could not finish the segment {}: {}".format(path, error))
+                self.errors += 1
+            path = self.queue.get()
+
+    def close(self):
+        self.queue.put(None)
+        if self.is_alive():
+            self.join()
+
+
+class RotatingWriter:
+    # A writer (TextWriter, BinaryWriter, RootWriter) that rolls over to a new file when the current one holds max_bytes,
+    # has been open for `interval` seconds, or, with daily, when the date changes. The files are made by make(path), the
+    # first one at first_path if given, the next ones at path_for(datetime) of when they are opened (e.g.
+    # <dataFolder>/<ddmmyy>/<ddmmyy_hhmmss_microseconds>.txt, the folder of a new day is created).
+    # The rows of one write() go to one file, the check is done after it; the next file is only opened by the next rows
+    # to write, so a run never ends on an empty file.
+    # Closed files go to a SegmentWorker: synced, compressed with compression (none, gzip or zstd) and cataloged there.
+    def __init__(self, make, path_for, first_path=None, max_bytes=None, interval=None, daily=False, compression="none", level=None, on_closed=None):
+        if compression == "zstd":
+            import zstandard                                                                # fail now rather than at the first segment
+        self.make       = make
+        self.path_for   = path_for
+        self.max_bytes  = max_bytes
+        self.interval   = interval
+        self.daily      = daily
+        self.segments   = []                                                                # paths of the files written, in order
+        self.worker     = SegmentWorker(compression, level, on_closed)
+        self.worker.start()
+        self._open(first_path)
+
+    def _open(self, path=None):
+        now             = datetime.now()
+        path            = path or self.path_for(now)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.writer     = self.make(path)
+        self.path       = path
+        self.opened     = time.time()
+        self.date       = now.date()
+        self.segments.append(path)
+
+    def size(self):
+        # bytes written to the current file so far
+        file = getattr(self.writer, "file", None)
+        return file.tell() if hasattr(file, "tell") else os.path.getsize(self.path)
+
+    def due(self):
+        return ((self.max_bytes is not None and self.size() >= self.max_bytes)
+                or (self.interval is not None and time.time() - self.opened >= self.interval)
+                or (self.daily and datetime.now().date() != self.date))
+
+    def write(self, events, mask):
+        if self.writer is None:
+            if not mask.any():
+                return
+            self._open()
+        self.writer.write(events, mask)
+        if self.due():
+            self.rotate()
+
+    def rotate(self):
+        # close the current file and hand it to the worker, the next one is opened by write()
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.worker.add(self.path)
+        self.writer     = None
+
+    def close(self):
+        self.rotate()
+        self.worker.close()
@@ -0,0 +1,102 @@
+import numpy as np
+
+from picoammeter.frames import channel_map
+
+
+default_windows = [1, 10, 60]                                                               # seconds
+stat_names      = ["mean", "rms", "min", "max"]                                             # rms around the mean, as ROOT's GetRMS
+quantities      = ["Current", "Voltage", "Temperature"]
+
+
+class RunningStats:
+    # Count, mean, sum of squared deviations (M2), min and max of every column over consecutive windows of `width`
+    # timestamps (window k holds k*width <= timestamp < (k+1)*width). Every batch is reduced per window at once and merged
+    # into the open window with the pairwise form of Welford's update (Chan et al.), so the memory does not grow with the
+    # rows: only the open window is kept, the others are returned as soon as a later timestamp closes them.
+    def __init__(self, width, columns):
+        self.width  = width
+        self.window = None                                                                  # index of the open window
+        self.count  = 0
+        self.mean   = np.zeros(columns)
+        self.m2     = np.zeros(columns)
+        self.min    = np.full(columns, np.inf)
+        self.max    = np.full(columns, -np.inf)
+
+    def add(self, timestamps, values):
+        # timestamps (n,) increasing, values (n, columns); the windows closed, as tuples (window, count, mean, rms, min, max)
+        if len(timestamps) == 0:
+            return []
+        windows = timestamps//self.width
+        starts  = np.flatnonzero(np.concatenate([[True], np.diff(windows) != 0]))
+        counts  = np.diff(np.append(starts, len(windows)))
+        mean    = np.add.reduceat(values, starts, axis=0)/counts[:, None]
+        m2      = np.add.reduceat((values - np.repeat(mean, counts, axis=0))**2, starts, axis=0)
+        low     = np.minimum.reduceat(values, starts, axis=0)
+        high    = np.maximum.reduceat(values, starts, axis=0)
+        closed  = []
+        for i, window in enumerate(windows[starts].tolist()):
+            if window != self.window:
+                if self.window is not None:
+                    closed.append(self._result())
+                self.window, self.count = window, 0
+                self.min[:], self.max[:] = np.inf, -np.inf
+            n               = self.count + counts[i]
+            delta           = mean[i] - self.mean
+            self.m2         = self.m2 + m2[i] + delta**2*self.count*counts[i]/n if self.count else m2[i]
+            self.mean       = self.mean + delta*counts[i]/n if self.count else mean[i]
+            self.count      = n
+            self.min        = np.minimum(self.min, low[i])
+            self.max        = np.maximum(self.max, high[i])
+        return closed
+
+    def flush(self):
+        # the open window, partial, or nothing
+        closed      = [self._result()] if self.count else []
+        self.window = None
+        self.count  = 0
+        return closed
+
+    def _result(self):
+        return (self.window, self.count, self.mean.copy(), np.sqrt(self.m2/self.count), self.min.copy(), self.max.copy())
+
+
+class Summary:
+    # Running statistics of the currents, voltages and temperatures of every channel over windows of `windows` seconds,
+    # written to a .csv next to the output, one line per window: its width, the timestamp it starts at, the host time of
+    # that timestamp (from clock, empty until it is fitted), the events in it, then mean, rms, min and max of every column.
+    # Only the events that would be written at full rate are used (not corrupted, not averaged on 60 measurements, complete),
+    # whether or not they are written. The last, partial windows are written when closed.
+    def __init__(self, path, windows=default_windows, dt=1e-4, clock=None, separator=","):
+        self.path       = path
+        self.separator  = separator
+        self.clock      = clock
+        self.windows    = [(seconds, RunningStats(max(1, int(round(seconds/dt))), 3*len(channel_map))) for seconds in windows]
+        self.lines      = 0
+        self.file       = open(path, "w")
+        columns         = ["{}_{}_{}".format(quantity, ch, stat) for quantity in quantities for ch in channel_map for stat in stat_names]
+        self.file.write(separator.join(["window", "start", "time", "n"] + columns) + "\n")
+
+    def add(self, events, mask=None):
+        # events of the run in order, mask selects the ones to use, by default the ones complete and good
+        if mask is None:
+            mask    = ~events.corrupted & ~events.averaged & events.complete
+        timestamps  = events.timestamp[mask]
+        values      = np.concatenate([events.curr[mask], events.volt[mask], events.temp[mask]], axis=1)
+        for seconds, stats in self.windows:
+            self._write(seconds, stats, stats.add(timestamps, values))
+
+    def close(self):
+        for seconds, stats in self.windows:
+            self._write(seconds, stats, stats.flush())
+        self.file.close()
+
+    def _write(self, seconds, stats, closed):
+        for window, count, mean, rms, low, high in closed:
+            start   = window*stats.width
+            fit     = self.clock.fit() if self.clock is not None else None
+            host    = "{:.6f}".format(self.clock.times(start)) if fit else ""
+            values  = np.stack([mean, rms, low, high], axis=1).reshape(-1)                  # the stats of every column in turn
+            self.file.write(self.separator.join(["{:g}".format(seconds), str(start), host, str(count)] + ["{:.9g}".format(x) for x in values.tolist()]) + "\n")
+            self.lines += 1
+        if closed:
+            self.file.flush()
@@ -0,0 +1,24 @@
+import signal
+import threading
+
+
+class StopSignal:
+    # SIGINT (Ctrl-C) and SIGTERM (systemctl stop, kill) ask the acquisition to stop instead of killing it: the first one
+    # sets the event, the loop stops receiving, processes what is left and closes every output as at the end of -t.
+    # The previous handlers are then restored, so a second signal stops the process at once.
+    def __init__(self, signals=(signal.SIGINT, signal.SIGTERM)):
+        self.event      = threading.Event()
+        self.received   = None                                                              # name of the signal received
+        self.previous   = {sig: signal.signal(sig, self._handle) for sig in signals}
+
+    def _handle(self, signum, frame):
+        self.received = signal.Signals(signum).name
+        self.restore()
+        self.event.set()
+
+    def restore(self):
+        for sig, handler in self.previous.items():
+            signal.signal(sig, handler)
+
+    def is_set(self):
+        return self.event.is_set()
@@ -0,0 +1,219 @@
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+
+from picoammeter.capture import MAGIC as CAPTURE_MAGIC, CaptureReader
+from picoammeter.frames import FRAME_END, FRAME_SIZE, FRAME_START, channel_map, frame_dtype, ticks_per_frame
+
+
+default_mix     = {"I": 0.90, "V": 0.05, "T": 0.03, "p": 0.01, "m": 0.01}                   # fraction of the frames of every type
+
+# raw ADC values around which the channels of every frame type are generated: mean, spread #
+raw_values      = {"I": (30000, 200), "V": (2000, 20), "T": (230, 2), "p": (30000, 50), "m": (2000, 5)}
+
+
+def parse_mix(text):
+    # "I=0.9,V=0.05,T=0.03,p=0.01,m=0.01" -> dict, missing types are not generated
+    mix = {}
+    for item in text.split(","):
+        kind, fraction = item.split("=")
+        if kind not in raw_values:
+            raise ValueError("unknown frame type {}, available are {}".format(kind, list(raw_values)))
+        mix[kind] = float(fraction)
+    return mix
+
+
+class FrameGenerator:
+    # Valid START.../END/ frames as sent by a PICO, built a whole batch at a time with the frame_dtype layout.
+    # The timestamp advances by ticks_per_frame and wraps around 2**32, the time flag switching between b'W' and b'w' at every wrap.
+    # Corruption can be injected: J/D labels (the frame is trashed by the reader) and partial frames (bytes missing).
+    def __init__(self, mix=None, start_timestamp=0, corrupt=0.0, partial=0.0, seed=None):
+        mix                 = mix or default_mix
+        self.kinds          = list(mix)
+        self.weights        = np.array([mix[k] for k in self.kinds], dtype=float)
+        self.weights       /= self.weights.sum()
+        self.corrupt        = corrupt
+        self.partial        = partial
+        self.rng            = np.random.default_rng(seed)
+        self.nframes        = 0
+        self.timestamp      = start_timestamp % 2**32
+        self.time_flag      = b"W"
+        self.frames_corrupted   = 0
+        self.frames_partial     = 0
+
+    def frames(self, n):
+        # the next n frames as bytes
+        nch         = len(channel_map)
+        frames      = np.zeros(n, dtype=frame_dtype)
+        frames["start"], frames["end"] = FRAME_START, FRAME_END
+
+        # timestamp and time flag: a wrap flips the flag from that frame on #
+        ts          = self.timestamp + ticks_per_frame*np.arange(n, dtype=np.int64)
+        wraps       = ts // 2**32
+        flip        = wraps % 2 == 1
+        flags       = np.where(flip, b"w" if self.time_flag == b"W" else b"W", self.time_flag)
+        frames["timestamp"] = ts % 2**32
+        frames["time_flag"] = flags
+        self.timestamp      = int((ts[-1] + ticks_per_frame) % 2**32) if n else self.timestamp
+        if n and (ts[-1] + ticks_per_frame) // 2**32 % 2 == 1:
+            self.time_flag  = b"w" if self.time_flag == b"W" else b"W"
+
+        # labels and values of every frame type #
+        kind        = self.rng.choice(len(self.kinds), size=n, p=self.weights)
+        labels      = np.empty((n, nch), dtype="S1")
+        values      = np.empty((n, nch), dtype=np.int64)
+        for k, name in enumerate(self.kinds):
+            rows            = kind == k
+            m               = int(rows.sum())
+            mean, spread    = raw_values[name]
+            values[rows]    = self.rng.normal(mean, spread, size=(m, nch)).astype(np.int64)
+            if name == "I":                                                                 # every channel in the low (i) or high (I) current range
+                labels[rows] = np.where(self.rng.random((m, nch)) < 0.5, b"i", b"I")
+            else:
+                labels[rows] = name.encode()
+
+        # J/D labels #
+        bad         = self.rng.random(n) < self.corrupt
+        if bad.any():
+            labels[bad, self.rng.integers(0, nch, size=int(bad.sum()))] = self.rng.choice([b"J", b"D"], size=int(bad.sum()))
+        frames["channels"]["label"] = labels
+        frames["channels"]["value"] = values
+        self.frames_corrupted  += int(bad.sum())
+        self.nframes           += n
+
+        # partial frames: the end of the frame is lost #
+        data        = frames.tobytes()
+        cut         = self.rng.random(n) < self.partial
+        if cut.any():
+            keep            = np.ones((n, FRAME_SIZE), dtype=bool)
+            lengths         = self.rng.integers(1, FRAME_SIZE, size=int(cut.sum()))
+            keep[cut]       = np.arange(FRAME_SIZE) < lengths[:, None]
+            data            = np.frombuffer(data, dtype=np.uint8)[keep.reshape(-1)].tobytes()
+            self.frames_partial += int(cut.sum())
+        return data
+
+
+class Replay:
+    # the bytes of a recorded capture (a plain byte dump or a .raw capture), frame after frame; with loop the capture starts over at its end #
+    def __init__(self, path, loop=False):
+        with open(path, "rb") as file:
+            self.data   = file.read()
+        if self.data.startswith(CAPTURE_MAGIC):                                             # only the received bytes, without the record headers
+            reader      = CaptureReader(path)
+            self.data   = b"".join(chunk for _, chunk in reader)
+            reader.close()
+        self.loop       = loop
+        self.pos        = 0
+        self.nframes    = 0
+
+    def frames(self, n):
+        out = b""
+        while len(out) < n*FRAME_SIZE:
+            if self.pos >= len(self.data):
+                if not self.loop or not self.data:
+                    break
+                self.pos = 0
+            take        = min(n*FRAME_SIZE - len(out), len(self.data) - self.pos)
+            out        += self.data[self.pos:self.pos + take]
+            self.pos   += take
+        self.nframes   += len(out) // FRAME_SIZE
+        return out
+
+
+def stream(source, write, rate=400, duration=None, chunk_frames=None, stop=None):
+    # Send the frames of source with write(bytes) at `rate` frames per second, rate=0 as fast as possible.
+    # Returns the number of bytes sent, stops at the end of a replay, after duration seconds or when stop is set.
+    chunk_frames    = chunk_frames or (max(1, int(rate//100)) if rate else 4096)                # about 10 ms of data per write at the nominal rate
+    sent_frames     = 0
+    sent_bytes      = 0
+    t0              = time.time()
+    while (duration is None or time.time() - t0 < duration) and not (stop is not None and stop.is_set()):
+        n = chunk_frames
+        if rate:
+            due = int((time.time() - t0)*rate) - sent_frames
+            if due <= 0:
+                time.sleep(chunk_frames/rate/2)
+                continue
+            n = min(due, 10*chunk_frames)
+        data = source.frames(n)
+        if not data:
+            break
+        write(data)
+        sent_frames    += n
+        sent_bytes     += len(data)
+    return sent_bytes
+
+
+class SimulatorServer:
+    # TCP stand-in of picouartXX.na.infn.it:23, every client gets its own stream from make_source() #
+    def __init__(self, make_source, host="localhost", port=2323, rate=400, duration=None):
+        self.make_source    = make_source
+        self.rate           = rate
+        self.duration       = duration
+        self.server         = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.address        = self.server.getsockname()
+        self.stopping       = threading.Event()
+        self.clients        = []
+
+    def serve_forever(self):
+        self.server.settimeout(0.2)
+        while not self.stopping.is_set():
+            try:
+                conn, address = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            client = threading.Thread(target=self._serve_client, args=(conn, address), daemon=True)
+            client.start()
+            self.clients.append(client)
+
+    def start(self):
+        # serve from a background thread, for tests
+        thread = threading.Thread(target=self.serve_forever, name="pico-simulator", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopping.set()
+        self.server.close()
+
+    def _serve_client(self, conn, address):
+        print("Client connected from {}:{}".format(*address))
+        conn.settimeout(None)
+        try:
+            sent = stream(self.make_source(), conn.sendall, rate=self.rate, duration=self.duration, stop=self.stopping)
+            print("Stream to {}:{} finished, {} bytes sent".format(*address, sent))
+        except OSError as error:                                                            # the reader closed the connection
+            print("Client {}:{} disconnected: {}".format(*address, error))
+        finally:
+            conn.close()
+
+
+def open_pty(link=None):
+    # serial stand-in: a pseudo terminal in raw mode, the reader opens the returned path (or link) as a serial port
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)                                                                       # no newline translation or echo of the binary frames
+    path = os.ttyname(slave)
+    if link is not None:
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(path, link)
+        path = link
+    return master, slave, path
+
+
+def fd_writer(fd):
+    # write(bytes) for a file descriptor, os.write can take only part of the data
+    def write(data):
+        with memoryview(data) as view:
+            while len(view):
+                view = view[os.write(fd, view):]
+    return write
@@ -0,0 +1,282 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from picoammeter.decimate import concat, select, take
+
+
+# what a sink does when its queue is full, see SinkWorker #
+sink_policies = ["block", "drop_oldest", "decimate"]
+
+# sinks of the converter and their policy by default #
+default_policies = {"file": "block", "stats": "block", "influx": "decimate", "plot": "drop_oldest"}
+
+# sinks that need the rows of a batch to follow each other (slow mode selection, row numbers, windows): no "decimate" #
+consecutive_sinks = ["file", "stats"]
+
+# a batch as published to every sink: the events, the row number of the first one in the run, the host time of every
+# event in microseconds (None unless a sink asked for it) and the host time it was published
+Batch = namedtuple("Batch", ["events", "first_row", "times_us", "published"])
+
+
+def parse_policies(text, defaults=default_policies):
+    # "file=block,influx=drop_oldest" -> the policy of every sink, the ones not given as in defaults
+    policies = dict(defaults)
+    for item in filter(None, (text or "").split(",")):
+        name, _, policy = item.partition("=")
+        if name not in defaults or policy not in sink_policies:
+            raise ValueError("Bad sink policy {}: use <sink>=<policy>, sinks {}, policies {}".format(item, list(defaults), sink_policies))
+        if name in consecutive_sinks and policy == "decimate":
+            raise ValueError("Bad sink policy {}: the {} sink needs consecutive events, use block or drop_oldest".format(item, name))
+        policies[name] = policy
+    return policies
+
+
+# sinks: write(batch) on the worker thread of the sink, close() once it is stopped #
+class FileSink:
+    # .txt, .pico or .root output (TextWriter, BinaryWriter, RootWriter or a RotatingWriter of them): the rows of the
+    # converter (not corrupted, not averaged, complete), with the slow mode (one row every factor, or a Decimator)
+    consecutive = True
+
+    def __init__(self, writer, factor=1, decimator=None, name="file"):
+        self.name           = name
+        self.writer         = writer
+        self.factor         = factor
+        self.decimator      = decimator
+        self.written        = 0
+        self.skipped        = 0                                                             # averaged events not written
+        self.first_written  = None                                                          # row of the first event written
+
+    def write(self, batch):
+        events          = batch.events
+        keep, to_write  = select(events, batch.first_row, self.factor, self.decimator)
+        self.skipped   += int(np.count_nonzero(keep & events.averaged))
+        if self.first_written is None and to_write.any():
+            self.first_written = batch.first_row + int(np.flatnonzero(to_write)[0])
+            print("First event written to file occurs at nev = ", self.first_written)
+        rows, mask      = self.decimator.process(events, to_write) if self.decimator else (events, to_write)  # from 400Hz to 400Hz/N
+        self.written   += int(np.count_nonzero(mask))
+        self.writer.write(rows, mask)
+
+    def close(self):
+        self.writer.close()
+
+
+class StatsSink:
+    # running statistics over time windows (picoammeter/runstats.py Summary) of the full-rate events
+    consecutive = True
+
+    def __init__(self, summary, name="stats"):
+        self.name       = name
+        self.summary    = summary
+
+    def write(self, batch):
+        self.summary.add(batch.events)
+
+    def close(self):
+        self.summary.close()
+
+
+class InfluxDBSink:
+    # per-window mean, min and max to InfluxDB (picoammeter/influx.py InfluxSink, which posts from a thread of its own)
+    wants_times = True
+
+    def __init__(self, influx, name="influx"):
+        self.name       = name
+        self.influx     = influx
+
+    def write(self, batch):
+        self.influx.add(batch.events, batch.times_us)
+
+    def close(self):
+        self.influx.close()
+
+
+class PlotSink:
+    # live plot (picoammeter/liveplot.py LivePlot, in its own process); close() waits for its window to be closed
+    def __init__(self, plot, name="plot"):
+        self.name       = name
+        self.plot       = plot
+
+    def write(self, batch):
+        self.plot.add(batch.events)
+
+    def close(self):
+        self.plot.close()
+
+
+class SinkWorker(threading.Thread):
+    # One sink on a thread of its own, fed through a queue of at most queue_size batches. When the sink falls behind
+    # and the queue is full, publishing a batch
+    #   policy = "block":       waits for the sink (every event reaches it, the acquisition slows down with it)
+    #   policy = "drop_oldest": throws away the oldest batch waiting
+    #   policy = "decimate":    merges the two oldest batches keeping every other event, the sink sees the whole run
+    #                           at a lower rate (the row numbers of a merged batch follow the first one, so it is
+    #                           refused for the sinks that are `consecutive`)
+    # `lag` is how late the sink is: the age of the oldest batch it has not finished, 0 when it is idle.
+    # A failing sink is reported and counted, the other sinks and the acquisition go on. observe(seconds) is called
+    # with the time of every write(), e.g. to fill a histogram of picoammeter/metrics.py.
+    def __init__(self, sink, queue_size=64, policy="block", observe=None):
+        super().__init__(name="pico-sink-{}".format(sink.name), daemon=True)
+        if policy not in sink_policies:
+            raise ValueError("Unknown sink policy {}, choose among {}".format(policy, sink_policies))
+        if policy == "decimate" and getattr(sink, "consecutive", False):
+            raise ValueError("The {} sink needs consecutive rows, it cannot use the decimate policy".format(sink.name))
+        self.sink               = sink
+        self.name               = sink.name
+        self.queue_size         = max(queue_size, 2)
+        self.policy             = policy
+        self.observe            = observe
+        self.pending            = deque()                                                   # Batch waiting, oldest first
+        self.wakeup             = threading.Condition()
+        self.stopping           = False
+        self.current            = None                                                      # published time of the batch being written
+        self.batches_done       = 0
+        self.events_done        = 0
+        self.batches_dropped    = 0
+        self.events_dropped     = 0
+        self.merges             = 0                                                         # decimations of the queue
+        self.blocked_seconds    = 0.0                                                       # time publishing waited for this sink
+        self.busy_seconds       = 0.0                                                       # time spent in write()
+        self.max_lag            = 0.0
+        self.errors             = 0
+        self.last_error         = None
+
+    @property
+    def queue_depth(self):
+        return len(self.pending)
+
+    @property
+    def lag(self):
+        with self.wakeup:
+            oldest = self.current if self.current is not None else self.pending[0].published if self.pending else None
+        return time.time() - oldest if oldest is not None else 0.0
+
+    def put(self, batch):
+        with self.wakeup:
+            if len(self.pending) >= self.queue_size:
+                self._overflow()
+            self.pending.append(batch)
+            self.wakeup.notify_all()
+
+    def _overflow(self):
+        # called with the lock held and the queue full
+        if self.policy == "block":
+            t0 = time.time()
+            while len(self.pending) >= self.queue_size and self.is_alive():
+                self.wakeup.wait(0.1)
+            self.blocked_seconds += time.time() - t0
+        elif self.policy == "drop_oldest":
+            dropped                 = self.pending.popleft()
+            self.batches_dropped   += 1
+            self.events_dropped    += len(dropped.events.timestamp)
+        else:
+            first, second   = self.pending.popleft(), self.pending.popleft()
+            events          = concat([first.events, second.events])
+            times_us        = np.concatenate([first.times_us, second.times_us]) if first.times_us is not None else None
+            self.events_dropped += len(events.timestamp) - len(events.timestamp[::2])
+            self.merges    += 1
+            self.pending.appendleft(Batch(take(events, slice(None, None, 2)), first.first_row,
+                                          times_us[::2] if times_us is not None else None, first.published))
+
+    def run(self):
+        while True:
+            with self.wakeup:
+                while not self.pending and not self.stopping:
+                    self.wakeup.wait()
+                if not self.pending:
+                    return
+                batch           = self.pending.popleft()
+                self.current    = batch.published
+                self.wakeup.notify_all()                                                    # a slot is free for a blocked put()
+            t0 = time.time()
+            try:
+                self.sink.write(batch)
+            except Exception as error:
+                self.errors    += 1
+                self.last_error = error
+                if self.errors == 1:
+                    print("Sink {} failed: {}".format(self.name, error))
+            self.busy_seconds  += time.time() - t0
+            if self.observe is not None:
+                self.observe(time.time() - t0)
+            self.max_lag        = max(self.max_lag, time.time() - batch.published)
+            self.batches_done  += 1
+            self.events_done   += len(batch.events.timestamp)
+            self.current        = None
+
+    def stop(self):
+        # write what is queued, then stop the thread
+        with self.wakeup:
+            self.stopping = True
+            self.wakeup.notify_all()
+        if self.is_alive():
+            self.join()
+
+
+class FanOut:
+    # The acquisition publishes every decoded and calibrated batch once; every sink gets it on its own SinkWorker, so
+    # a slow sink (InfluxDB, the plot) only delays itself, unless its policy is "block":
+    #   fanout = FanOut(clock=clock)
+    #   fanout.add(FileSink(outFile), policy="block")
+    #   fanout.add(InfluxDBSink(influx), policy="drop_oldest")
+    #   fanout.start()
+    #   fanout.publish(events, first_row)   # for every batch
+    #   fanout.stop()                       # everything queued written, then the sinks can be closed (or close() for both)
+    # The clock (picoammeter/clock.py) gives the host time of every event to the sinks that want it (wants_times).
+    def __init__(self, clock=None):
+        self.clock      = clock
+        self.workers    = []
+
+    def add(self, sink, queue_size=64, policy="block", observe=None):
+        worker = SinkWorker(sink, queue_size=queue_size, policy=policy, observe=observe)
+        self.workers.append(worker)
+        return worker
+
+    def __getitem__(self, name):
+        return next(worker for worker in self.workers if worker.name == name)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def publish(self, events, first_row):
+        if len(events.timestamp) == 0:
+            return
+        times_us = None
+        if self.clock is not None and any(getattr(worker.sink, "wants_times", False) for worker in self.workers):
+            times_us = self.clock.absolute_us(events.timestamp)                             # on this thread, with the fit of this batch
+        batch = Batch(events, first_row, times_us, time.time())
+        for worker in self.workers:
+            worker.put(batch)
+
+    def lags(self):
+        return {worker.name: worker.lag for worker in self.workers}
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def close(self):
+        self.stop()
+        for worker in self.workers:
+            worker.sink.close()
+
+    def register(self, metrics):
+        # lag, queue depth and drops of every sink, see picoammeter/metrics.py
+        for worker in self.workers:
+            name = worker.name
+            metrics.gauge("sink_{}_lag_seconds".format(name),          "Age of the oldest batch the {} sink has not written".format(name),      fn=lambda w=worker: w.lag)
+            metrics.gauge("sink_{}_queue_depth".format(name),          "Batches waiting for the {} sink".format(name),                          fn=lambda w=worker: w.queue_depth)
+            metrics.counter("sink_{}_events_dropped_total".format(name), "Events dropped or decimated away before the {} sink".format(name),    fn=lambda w=worker: w.events_dropped)
+            metrics.counter("sink_{}_blocked_seconds_total".format(name), "Time the acquisition waited for the {} sink".format(name),           fn=lambda w=worker: w.blocked_seconds)
+            metrics.counter("sink_{}_errors_total".format(name),       "Batches the {} sink failed to write".format(name),                      fn=lambda w=worker: w.errors)
+
+    def report(self):
+        lines = []
+        for worker in self.workers:
+            lines.append("sink {:<10} {} batches, {} events handled ({} dropped, {} failed), policy {}, max lag {:.3f} s, waited for {:.3f} s".format(
+                worker.name + ":", worker.batches_done, worker.events_done, worker.events_dropped, worker.errors, worker.policy, worker.max_lag, worker.blocked_seconds))
+        return "\n".join(lines)
@@ -0,0 +1,22 @@
+text_header = "Timestamp,Current_G3B,Current_G3T,Current_G2B,Current_G2T,Current_G1B,Current_G1T,Current_DRIFT,Voltage_G3B,Voltage_G3T,Voltage_G2B,Voltage_G2T,Voltage_G1B,Voltage_G1T,Voltage_DRIFT,Temperature_G3B,Temperature_G3T,Temperature_G2B,Temperature_G2T,Temperature_G1B,Temperature_G1T,Temperature_DRIFT,time_flag,label_G3B,label_G3T,label_G2B,label_G2T,label_G1B,label_G1T,label_DRIFT,missed"
+
+
+class TextWriter:
+    # .txt output, one line per event: timestamp, 7 currents, 7 voltages, 7 temperatures, time flag, 7 labels and frames missed before it #
+    def __init__(self, path, separator=","):
+        self.path       = path
+        self.separator  = separator
+        self.file       = open(path, "w")                                                   # output file to save data
+        self.file.write(text_header + "\n")
+
+    def write_event(self, time_stamp, curr, volt, temp, labels, missed=0):
+        line_to_write = self.separator.join([str(x) for x in [time_stamp] + curr + volt + temp + labels + [missed]])
+        self.file.write("{}\n".format(line_to_write))
+
+    def write(self, events, mask):
+        # write the events selected by mask
+        for i in mask.nonzero()[0]:
+            self.write_event(int(events.timestamp[i]), events.curr[i].tolist(), events.volt[i].tolist(), events.temp[i].tolist(), events.labels[i].tolist(), int(events.missed[i]))
+
+    def close(self):
+        self.file.close()
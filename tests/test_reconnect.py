@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from picoammeter.devices import devices
+from picoammeter.frames import ticks_per_frame
+from picoammeter.reader import PicoReader
+from picoammeter.simulator import FrameGenerator, SimulatorServer
+
+
+# The simulator closes every connection after one second, PicoReader reconnects and goes on #
+def acquire(monkeypatch, make_source, rx_thread=True, seconds=3.5):
+    server = SimulatorServer(make_source, port=0, rate=400, duration=1)
+    server.start()
+    monkeypatch.setitem(devices, "test", dict(devices["sim"], port=server.address[1]))
+    try:
+        with PicoReader("test", duration=seconds, batch_size=None, rx_thread=rx_thread) as reader:
+            events = list(reader)
+    finally:
+        server.stop()
+    timestamp   = np.concatenate([e.timestamp for e in events])
+    missed      = np.concatenate([e.missed for e in events])
+    return reader, timestamp, missed
+
+
+@pytest.mark.parametrize("rx_thread", [True, False])
+def test_counter_restarted_by_the_pico(monkeypatch, rx_thread):
+    # every connection gets a new PICO, its counter starts over
+    reader, timestamp, missed = acquire(monkeypatch, lambda: FrameGenerator(seed=1, start_timestamp=10**6), rx_thread)
+    assert reader.link.generation >= 2
+    assert reader.builder.restarts == reader.link.generation - 1
+    assert (np.diff(timestamp) > 0).all()                                                   # no timestamp goes back or repeats
+    assert (missed >= 0).all()
+    assert (timestamp[-1] - timestamp[0])*reader.clock.dt > 3                               # the whole run, not the last connection
+
+
+def test_counter_going_on(monkeypatch):
+    # the same PICO behind a terminal server that drops the connection: its counter follows the last one
+    source = FrameGenerator(seed=1, start_timestamp=2**32 - 400*ticks_per_frame)               # wraps during the run
+    reader, timestamp, missed = acquire(monkeypatch, lambda: source)
+    assert reader.link.generation >= 2
+    assert reader.builder.restarts == 0
+    assert reader.builder.count_time_flip == 1
+    assert (np.diff(timestamp) == ticks_per_frame).all()
+    assert (missed == 0).all()